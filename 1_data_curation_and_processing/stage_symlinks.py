@@ -3,13 +3,27 @@
 #  --stage-out /cbica/projects/bbl_22q/analysis/pfn/pnet_inputs/22q_pnet_stage_symlinks \
 #  --scans-out /cbica/projects/bbl_22q/analysis/pfn/pnet_inputs/22q_pnet_stage_symlinks/Scan_List.txt \
 #   --group subject
+#
+# Add --fd-summary <fd_summary_from_xcpd.py CSV> with --max-mean-fd / --max-median-fd / --min-vols
+# to leave high-motion sessions (or scans, with --qc-level scan) out of the stage; staged and
+# excluded scans are listed in --manifest.
 
 import argparse
+import csv
 import re
 import sys
 import os
 from pathlib import Path
 
+def use_common():
+    """Make the shared modules in ../common importable (a flat deployment needs nothing)."""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "common")
+    if path not in sys.path:
+        sys.path.append(path)
+
+use_common()
+from motion_qc import MotionGate, add_motion_args, scan_task
+
 # Match sub and optional ses anywhere in the filename/path
 SUB_RE = re.compile(r"(sub-[A-Za-z0-9]+)")
 SES_RE = re.compile(r"(ses-[A-Za-z0-9]+)")
@@ -45,14 +59,31 @@ def main():
                     help="Show what would be done without creating anything")
     ap.add_argument("--group", choices=["subject", "subject+session"], default="subject+session",
                     help="Grouping key for concatenation (default: subject+session)")
+    ap.add_argument("--index", default=None,
+                    help="Shared SQLite file index (common/bids_index.py); refreshed and queried "
+                         "instead of walking --root")
+    ap.add_argument("--manifest", default=None,
+                    help="CSV of every scan with its symlink, status (staged/excluded) and exclusion reason "
+                         "(default with --fd-summary: <stage-out>/stage_manifest.csv)")
+    add_motion_args(ap)
     args = ap.parse_args()
 
     root = Path(args.root).resolve()
     stage = Path(args.stage_out).resolve()
     if not root.exists():
         sys.exit(f"[ERROR] --root does not exist: {root}")
-
-    files = sorted(root.rglob(args.pattern))
+    try:
+        gate = MotionGate.from_args(args)
+    except (OSError, ValueError, KeyError) as e:
+        sys.exit(f"[ERROR] --fd-summary: {e}")
+    manifest = Path(args.manifest).resolve() if args.manifest else (
+        stage / "stage_manifest.csv" if gate is not None else None)
+
+    if args.index:
+        from bids_index import indexed_glob
+        files = indexed_glob(args.index, root, args.pattern)
+    else:
+        files = sorted(root.rglob(args.pattern))
     if not files:
         sys.exit(f"[ERROR] Found 0 files under {root} matching pattern {args.pattern}")
 
@@ -85,17 +116,43 @@ def main():
         stage.mkdir(parents=True, exist_ok=True)
 
     symlink_paths = []
+    manifest_rows = []
+    n_excluded = 0
     for key in sorted(groups.keys()):
         dest_dir = stage / key
-        if args.dry_run:
-            print(f"[DRY-RUN] Would create dir: {dest_dir}")
-        else:
-            dest_dir.mkdir(exist_ok=True)
-
         scans = sorted(groups[key])
+
+        # Motion QC before any link is made; link numbers stay those of the full scan list
+        reasons = {}
+        if gate is not None:
+            for source in scans:
+                sub, ses = parse_sub_ses(source)
+                reason = gate.check(sub, ses, scan_task(source.name) if gate.level == "scan" else None)
+                if reason:
+                    reasons[source] = reason
+            if reasons:
+                n_excluded += len(reasons)
+                why = "; ".join(sorted(set(reasons.values())))
+                print(f"[QC] {key}: excluded {len(reasons)}/{len(scans)} scans ({why})")
+
+        if len(reasons) < len(scans):
+            if args.dry_run:
+                print(f"[DRY-RUN] Would create dir: {dest_dir}")
+            else:
+                dest_dir.mkdir(exist_ok=True)
+
         for index, source in enumerate(scans, start=1):
             out_name = f"{index:03d}__{source.name}"
             dest = dest_dir / out_name
+            if source in reasons:
+                manifest_rows.append({"group": key, "source": str(source), "link": "",
+                                      "status": "excluded", "reason": reasons[source]})
+                # Remove a link staged by an earlier run without the criteria
+                if dest.is_symlink() and not args.dry_run:
+                    dest.unlink()
+                continue
+            manifest_rows.append({"group": key, "source": str(source), "link": str(dest),
+                                  "status": "staged", "reason": ""})
 
             if args.dry_run:
                 action = "overwrite" if (dest.exists() and args.overwrite) else "create"
@@ -112,6 +169,9 @@ def main():
                 dest.symlink_to(rel)
             symlink_paths.append(dest)
 
+        if len(reasons) == len(scans) and dest_dir.is_dir() and not args.dry_run and not any(dest_dir.iterdir()):
+            dest_dir.rmdir()
+
     if args.scans_out:
         scans_out = Path(args.scans_out).resolve()
         if args.dry_run:
@@ -121,13 +181,26 @@ def main():
             scans_out.write_text("\n".join(str(p) for p in symlink_paths))
             print(f"[OK] Wrote scan list: {scans_out} ({len(symlink_paths)} entries)")
 
-    total = sum(len(v) for v in groups.values())
+    if manifest is not None:
+        if args.dry_run:
+            print(f"[DRY-RUN] Would write manifest: {manifest} ({len(manifest_rows)} scans)")
+        else:
+            manifest.parent.mkdir(parents=True, exist_ok=True)
+            tmp = manifest.with_name(manifest.name + ".tmp")
+            with open(tmp, "w", newline="") as f:
+                w = csv.DictWriter(f, fieldnames=["group", "source", "link", "status", "reason"])
+                w.writeheader()
+                w.writerows(manifest_rows)
+            os.replace(tmp, manifest)
+            print(f"[OK] Wrote manifest: {manifest} ({n_excluded} excluded)")
+
+    total = sum(len(v) for v in groups.values()) - n_excluded
     print(f"[DONE] Groups: {len(groups)}  |  Symlinks: {total}  |  Stage root: {stage}")
 
     print("\nNext steps:")
     print("  • Set pNet config to use this stage for automatic concatenation>")
     print("  • Do NOT set file_subject_ID or file_subject_folder.")
-    print("  • Ensure Combine_Scan = "True".")
+    print('  • Ensure Combine_Scan = "True".')
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
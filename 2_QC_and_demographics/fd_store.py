@@ -0,0 +1,142 @@
+# python fd_store.py --base /cbica/projects/bbl_22q/data/22q_xcpd_extracted --store /cbica/projects/bbl_22q/data/22q_xcpd_extracted/22q_fd_store.parquet
+# python fd_store.py --base /cbica/projects/bbl_22q/data/PNC_xcpd_extracted/xcpd --store /cbica/projects/bbl_22q/data/PNC_xcpd_extracted/PNC_fd_store.parquet
+
+#!/usr/bin/env python3
+"""
+Persistent per-volume FD store for a cohort (one Parquet file).
+
+Each row is one volume of one motion file: sub, ses, task, run, path, volume, fd,
+plus the file's size and mtime. A file without FD values is kept as a single
+placeholder row (volume -1, fd NaN) so it is not re-parsed. update_store() re-parses only motion files that
+are new or whose size/mtime changed, drops files that disappeared, and rewrites
+the store atomically. summarize_store() feeds the stored values to the same
+segmented reductions as fd_summary_from_xcpd.py, so a summary never has to touch
+the motion files again. For BABS zip inputs the path is archive.zip!member and the
+size/mtime are the member's size and the archive's mtime. In R the store can be read with arrow::read_parquet().
+
+Requires pyarrow (or fastparquet) for pandas' Parquet support.
+"""
+import os, argparse
+import pandas as pd
+import numpy as np
+
+from fd_summary_from_xcpd import (
+    DEFAULT_PERCENTILES, DEFAULT_THRESHOLDS, DEFAULT_WORKERS,
+    collect_motion_files, load_fd_runs, parse_fd_text, read_motion_text, summarize_runs, use_common,
+)
+
+KEY_COLUMNS = ["sub", "ses", "task", "run", "path"]
+EMPTY_VOLUME = -1  # placeholder row for a motion file with no FD values
+COLUMNS = KEY_COLUMNS + ["volume", "fd", "file_size", "file_mtime_ns"]
+
+def _empty_store():
+    return pd.DataFrame({c: pd.Series(dtype="int64" if c in ("volume", "file_size", "file_mtime_ns")
+                                      else "float64" if c == "fd" else "object")
+                         for c in COLUMNS})
+
+def read_fd_all(fp):
+    """Every volume's FD (NaN kept, so positions are true volume indices)."""
+    text = read_motion_text(fp)
+    return np.empty(0) if text is None else parse_fd_text(text, keep_nan=True)
+
+def load_store(path):
+    if not path or not os.path.exists(path):
+        return _empty_store()
+    return pd.read_parquet(path, columns=COLUMNS)
+
+def write_store(df, path):
+    # Write next to the target and rename, so readers never see a partial file
+    tmp = f"{path}.tmp"
+    df.to_parquet(tmp, index=False)
+    os.replace(tmp, path)
+
+def update_store(store_path, base, tasks=None, workers=DEFAULT_WORKERS, index=None):
+    """
+    Bring the store in line with the motion files under base and return it.
+    Files with unchanged size and mtime keep their stored rows; only new or
+    modified files are parsed.
+    """
+    store = load_store(store_path)
+    runs = collect_motion_files(base, tasks, index)
+    use_common()
+    from bids_zip import stat_path  # archive members: member size, archive mtime
+    stats = {r[4]: stat_path(r[4]) for r in runs}
+
+    known = store.drop_duplicates("path").set_index("path")[["file_size", "file_mtime_ns"]]
+    stale = []
+    for r in runs:
+        st = stats[r[4]]
+        if r[4] not in known.index or tuple(known.loc[r[4]]) != (st.st_size, st.st_mtime_ns):
+            stale.append(r)
+
+    gone = ~store["path"].isin(stats.keys())
+    keep = ~gone & ~store["path"].isin([r[4] for r in stale])
+    parts = [store[keep]]
+    if stale:
+        values, offsets = load_fd_runs([r[4] for r in stale], workers, reader=read_fd_all)
+        # Files without FD values keep one placeholder row, so their size/mtime is recorded too
+        empty = np.diff(offsets) == 0
+        n = np.where(empty, 1, np.diff(offsets))
+        cols = {c: np.repeat(np.array([r[i] for r in stale], dtype=object), n)
+                for i, c in enumerate(KEY_COLUMNS)}
+        volume = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+        fd = np.full(n.sum(), np.nan)
+        real = ~np.repeat(empty, n)
+        fd[real] = values
+        volume[~real] = EMPTY_VOLUME
+        cols["volume"] = volume
+        cols["fd"] = fd
+        cols["file_size"] = np.repeat([stats[r[4]].st_size for r in stale], n)
+        cols["file_mtime_ns"] = np.repeat([stats[r[4]].st_mtime_ns for r in stale], n)
+        parts.append(pd.DataFrame(cols, columns=COLUMNS))
+
+    out = pd.concat(parts, ignore_index=True) if len(parts) > 1 else parts[0]
+    out = out.sort_values(KEY_COLUMNS + ["volume"], kind="stable").reset_index(drop=True)
+    if stale or gone.any() or not os.path.exists(store_path):
+        write_store(out, store_path)
+    print(f"FD store: {len(runs)} files | parsed {len(stale)} | reused {len(runs) - len(stale)}"
+          f" | dropped {store.loc[gone, 'path'].nunique()}")
+    return out
+
+def summarize_store(store, tasks=None, percentiles=DEFAULT_PERCENTILES, thresholds=DEFAULT_THRESHOLDS):
+    """
+    Per-(sub, ses) summary table from a loaded store. Non-finite FD values are
+    excluded, but every stored file still counts as a run (n_vols 0 if it has none
+    left), matching the direct path in fd_summary_from_xcpd.py.
+    """
+    if tasks is not None:
+        store = store[store["task"].isin(tasks)]
+    store = store.sort_values(KEY_COLUMNS + ["volume"], kind="stable")
+    finite = pd.Series(np.isfinite(store["fd"].to_numpy()), index=store.index)
+    runs_df = finite.groupby([store[c] for c in KEY_COLUMNS], sort=False).sum()
+    runs = [tuple(k) for k in runs_df.index]
+    offsets = np.zeros(len(runs) + 1, dtype=np.int64)
+    np.cumsum(runs_df.to_numpy(dtype=np.int64), out=offsets[1:])
+    values = store["fd"].to_numpy(dtype=float)[finite.to_numpy()]
+    return summarize_runs(runs, values, offsets, tasks, percentiles, thresholds)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Create or incrementally update a per-volume FD Parquet store from XCP-D motion.tsv files."
+    )
+    parser.add_argument(
+        "--base",
+        required=True,
+        help="Dataset directory containing sub-*/ses-*/func/*motion.tsv, or BABS zip archive(s)",
+    )
+    parser.add_argument("--store", required=True, help="Parquet file to create or update.")
+    parser.add_argument(
+        "--workers", type=int, default=DEFAULT_WORKERS,
+        help="Threads used to read motion files (default: %(default)s)."
+    )
+    parser.add_argument(
+        "--index", default=None,
+        help="Shared SQLite file index (common/bids_index.py) to query instead of globbing --base."
+    )
+    args = parser.parse_args()
+
+    store = update_store(args.store, args.base, workers=args.workers, index=args.index)
+    print(f"Wrote: {args.store} ({int((store['volume'] != EMPTY_VOLUME).sum())} volumes)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+# python fd_summary_from_xcpd.py --base /cbica/projects/bbl_22q/data/22q_xcpd_extracted --out /cbica/projects/bbl_22q/data/22q_xcpd_extracted/22q_fd_summary.csv
+# python fd_summary_from_xcpd.py --base /cbica/projects/bbl_22q/data/PNC_xcpd_extracted/xcpd --out /cbica/projects/bbl_22q/data/PNC_xcpd_extracted/PNC_fd_summary.csv
+
+#!/usr/bin/env python3
+"""
+Summarize framewise displacement (FD) from XCP-D motion.tsv files in one pass.
+
+Every task found under sub-*/ses-*/func is discovered automatically. Each motion
+file is read once, and mean, median, percentiles, max and counts above FD
+thresholds are computed per task and across all tasks ("combined"), all in one
+output table (one row per sub/ses). Runs of the same task are concatenated.
+
+Files are read concurrently in a thread pool with a column-only parser, and all FD
+values are packed into one contiguous array with per-run offsets; statistics are
+segmented reductions over that array rather than per-session concatenation.
+
+--base may also be a BABS output zip, or a directory of them: motion.tsv members
+are then listed from each archive's central directory and parsed in memory
+(see common/bids_zip.py), so nothing has to be extracted first.
+
+Column names follow the older mean/median scripts (n_vols_<task>, mean_fd_<task>,
+median_fd_<task>, n_vols_total, mean_fd_combined, ...), which are now thin
+wrappers around summarize_base().
+"""
+import os, re, sys, glob, argparse
+from pathlib import PurePath
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import numpy as np
+
+MOTION_GLOB = os.path.join("sub-*", "ses-*", "func", "*motion.tsv")
+ENTITY_RE = re.compile(r"(?:^|_)(sub|ses|task|run)-([A-Za-z0-9]+)")
+
+DEFAULT_PERCENTILES = (25, 75, 95)
+DEFAULT_THRESHOLDS = (0.2, 0.5)
+DEFAULT_WORKERS = 16
+
+def _to_float(x):
+    try:
+        return float(x)
+    except ValueError:
+        return np.nan
+
+def parse_fd_text(text, column="framewise_displacement", keep_nan=False):
+    """Column-only TSV parser: split each line just far enough to reach the FD field."""
+    lines = text.splitlines()
+    if not lines:
+        return np.empty(0)
+    header = lines[0].split("\t")
+    if column not in header:
+        return np.empty(0)
+    idx = header.index(column)
+    fields = [ln.split("\t", idx + 1)[idx] if ln.count("\t") >= idx else "" for ln in lines[1:] if ln]
+    fd = np.fromiter((_to_float(x) for x in fields), dtype=float, count=len(fields))
+    return fd if keep_nan else fd[np.isfinite(fd)]
+
+def use_common():
+    """Make the shared modules in ../common importable (a flat deployment needs nothing)."""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "common")
+    if path not in sys.path:
+        sys.path.append(path)
+
+def read_motion_text(fp):
+    """Text of a motion file or of a zip member (archive.zip!member); None if missing."""
+    if not fp:
+        return None
+    if ".zip!" in fp:
+        use_common()
+        from bids_zip import read_bytes
+        return read_bytes(fp).decode("utf-8")
+    if not os.path.isfile(fp):
+        return None
+    with open(fp, encoding="utf-8") as f:
+        return f.read()
+
+# Read just FD column from one motion file
+def read_fd(fp):
+    text = read_motion_text(fp)
+    return np.empty(0) if text is None else parse_fd_text(text)
+
+def load_fd_runs(paths, workers=DEFAULT_WORKERS, reader=read_fd):
+    """
+    Read motion files concurrently (the work is dominated by filesystem latency) and
+    pack all FD values into one contiguous array. Returns (values, offsets), where
+    run i occupies values[offsets[i]:offsets[i + 1]].
+    """
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as ex:
+        arrays = list(ex.map(reader, paths))
+    lengths = np.fromiter((a.size for a in arrays), dtype=np.int64, count=len(arrays))
+    offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    values = np.concatenate(arrays) if arrays else np.empty(0)
+    return values, offsets
+
+def key_from_path(p):
+    """(sub, ses, task, run) from the filename, falling back to sub-/ses- path components."""
+    ents = dict(ENTITY_RE.findall(os.path.basename(p)))
+    parts = p.split(os.sep)
+    sub = ents.get("sub") and f"sub-{ents['sub']}" or next((x for x in parts if x.startswith("sub-")), None)
+    ses = ents.get("ses") and f"ses-{ents['ses']}" or next((x for x in parts if x.startswith("ses-")), None)
+    return sub, ses, ents.get("task"), ents.get("run", "")
+
+def threshold_label(t):
+    return f"n_fd_gt_{t:g}"
+
+def segment_stats(values, bounds, percentiles=DEFAULT_PERCENTILES, thresholds=DEFAULT_THRESHOLDS):
+    """
+    Statistics for every segment values[bounds[i]:bounds[i + 1]] at once.
+
+    One lexsort orders values within their segments; mean and threshold counts come
+    from bincount, and median/percentiles/max are read off the sorted segments by
+    index (linear interpolation, as np.percentile). Empty segments give NaN.
+    """
+    bounds = np.asarray(bounds, dtype=np.int64)
+    nseg = bounds.size - 1
+    n = np.diff(bounds)
+    seg = np.repeat(np.arange(nseg), n)
+    srt = values[np.lexsort((values, seg))]
+    has = n > 0
+    start, last = bounds[:-1], np.maximum(n - 1, 0)
+
+    def quantile(q):
+        pos = last * (q / 100.0)
+        lo = np.floor(pos).astype(np.int64)
+        hi = np.ceil(pos).astype(np.int64)
+        v_lo = srt[np.where(has, start + lo, 0)] if srt.size else np.zeros(nseg)
+        v_hi = srt[np.where(has, start + hi, 0)] if srt.size else np.zeros(nseg)
+        return np.where(has, v_lo + (v_hi - v_lo) * (pos - lo), np.nan)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        out = {"n_vols": n, "mean_fd": np.bincount(seg, weights=values, minlength=nseg) / n}
+    out["median_fd"] = quantile(50)
+    out.update({f"p{p:g}_fd": quantile(p) for p in percentiles})
+    out["max_fd"] = quantile(100)
+    for t in thresholds:
+        out[threshold_label(t)] = np.bincount(seg, weights=values > t, minlength=nseg).astype(np.int64)
+    return out
+
+def find_motion_paths(base, index=None):
+    """
+    Motion files matching MOTION_GLOB under base. If base holds BABS zip archives,
+    their motion.tsv members are returned instead (archive.zip!member paths). With
+    index (a shared SQLite file index, see common/bids_index.py) the index is
+    refreshed and queried instead of globbing the tree.
+    """
+    use_common()
+    from bids_zip import find_members, is_archive_root
+    if is_archive_root(base):
+        return find_members(base, MOTION_GLOB)
+    if not index:
+        return glob.glob(os.path.join(base, MOTION_GLOB))
+    from bids_index import indexed_glob
+    depth = len(PurePath(MOTION_GLOB).parts)
+    return [str(p) for p in indexed_glob(index, base, PurePath(MOTION_GLOB).name)
+            if len(p.relative_to(os.path.abspath(base)).parts) == depth and p.match(MOTION_GLOB)]
+
+def collect_motion_files(base, tasks=None, index=None):
+    """Sorted (sub, ses, task, run, path) for every motion file; tasks=None keeps every task found."""
+    runs = []
+    for p in find_motion_paths(base, index):
+        sub, ses, task, run = key_from_path(p)
+        if not sub or not ses or not task:
+            continue
+        if tasks is not None and task not in tasks:
+            continue
+        runs.append((sub, ses, task, run, p))
+    return sorted(runs)
+
+def _group_bounds(keys, offsets):
+    """Value bounds for runs grouped by consecutive equal keys (runs are pre-sorted)."""
+    starts = [i for i in range(len(keys)) if i == 0 or keys[i] != keys[i - 1]]
+    idx = np.asarray(starts + [len(keys)], dtype=np.int64)
+    return [keys[i] for i in starts], offsets[idx]
+
+def _column(name, suffix):
+    # "mean_fd" -> "mean_fd_<suffix>"; combined n_vols keeps its historical name n_vols_total
+    if name == "n_vols" and suffix == "combined":
+        return "n_vols_total"
+    return f"{name}_{suffix}"
+
+def summarize_runs(runs, values, offsets, tasks=None,
+                   percentiles=DEFAULT_PERCENTILES, thresholds=DEFAULT_THRESHOLDS):
+    """
+    One row per (sub, ses) from packed per-run FD values. runs must be sorted by
+    (sub, ses, task, run), so each (sub, ses, task) and each (sub, ses) is a
+    contiguous block of values and needs no concatenation.
+    """
+    if not runs:
+        return pd.DataFrame()
+    all_tasks = sorted(tasks) if tasks is not None else sorted({r[2] for r in runs})
+
+    ses_keys, ses_bounds = _group_bounds([r[:2] for r in runs], offsets)
+    out = pd.DataFrame(ses_keys, columns=["sub", "ses"])
+    row_of = {k: i for i, k in enumerate(ses_keys)}
+
+    task_keys, task_bounds = _group_bounds([r[:3] for r in runs], offsets)
+    task_stats = segment_stats(values, task_bounds, percentiles, thresholds)
+    for t in all_tasks:
+        sel = np.array([k[2] == t for k in task_keys], dtype=bool)
+        rows = np.array([row_of[k[:2]] for k, s in zip(task_keys, sel) if s], dtype=np.int64)
+        for name, arr in task_stats.items():
+            is_count = name == "n_vols" or name.startswith("n_fd_gt_")
+            col = np.zeros(len(out), dtype=np.int64) if is_count else np.full(len(out), np.nan)
+            col[rows] = arr[sel]
+            out[_column(name, t)] = col
+
+    # Combined = statistics across the contiguous volumes of every task in the session
+    for name, arr in segment_stats(values, ses_bounds, percentiles, thresholds).items():
+        out[_column(name, "combined")] = arr
+
+    paths = {}
+    for sub, ses, task, _, p in runs:
+        paths.setdefault((sub, ses, task), []).append(p)
+    for t in all_tasks:
+        out[f"path_{t}"] = [";".join(paths.get((k[0], k[1], t), [])) for k in ses_keys]
+    return out.sort_values(["sub", "ses"]).reset_index(drop=True)
+
+def summarize_base(base, tasks=None, percentiles=DEFAULT_PERCENTILES, thresholds=DEFAULT_THRESHOLDS,
+                   workers=DEFAULT_WORKERS, store=None, index=None):
+    """
+    One row per (sub, ses) with per-task and combined FD statistics. With store
+    (a Parquet path, see fd_store.py), the store is updated incrementally first and
+    the summary is computed from it. index is passed on to find_motion_paths().
+    """
+    if store:
+        from fd_store import update_store, summarize_store
+        store_df = update_store(store, base, workers=workers, index=index)
+        return summarize_store(store_df, tasks, percentiles, thresholds)
+    runs = collect_motion_files(base, tasks, index)
+    values, offsets = load_fd_runs([r[4] for r in runs], workers)
+    return summarize_runs(runs, values, offsets, tasks, percentiles, thresholds)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compute FD summary statistics from XCP-D motion.tsv files for every task and combined."
+    )
+    parser.add_argument(
+        "--base",
+        required=True,
+        help="Dataset directory containing sub-*/ses-*/func/*motion.tsv, or BABS zip archive(s)",
+    )
+    parser.add_argument(
+        "-o", "--out",
+        default=None,
+        help="Optional output CSV path (if omitted, prints to stdout)."
+    )
+    parser.add_argument(
+        "--tasks", nargs="+", default=None,
+        help="Restrict to these task labels (default: every task found)."
+    )
+    parser.add_argument(
+        "--percentiles", nargs="*", type=float, default=list(DEFAULT_PERCENTILES),
+        help="Percentiles to report besides the median (default: %(default)s)."
+    )
+    parser.add_argument(
+        "--fd-thresholds", nargs="*", type=float, default=list(DEFAULT_THRESHOLDS),
+        help="Report the number of volumes with FD above each threshold (default: %(default)s)."
+    )
+    parser.add_argument(
+        "--workers", type=int, default=DEFAULT_WORKERS,
+        help="Threads used to read motion files (default: %(default)s)."
+    )
+    parser.add_argument(
+        "--store", default=None,
+        help="Optional per-volume FD Parquet store to update incrementally and summarize from."
+    )
+    parser.add_argument(
+        "--index", default=None,
+        help="Shared SQLite file index (common/bids_index.py) to query instead of globbing --base."
+    )
+    args = parser.parse_args()
+
+    out = summarize_base(args.base, args.tasks, args.percentiles, args.fd_thresholds,
+                         args.workers, args.store, args.index)
+
+    if args.out:
+        out.to_csv(args.out, index=False)
+        print(f"Wrote: {args.out} ({len(out)} rows)")
+    else:
+        print(out.to_csv(index=False))
+
+if __name__ == "__main__":
+    main()
@@ -6,8 +6,17 @@ Features:
 - Scan an image directory for `sub-<ID>_ses-<ID>_<VIEW>.png` images
 - Group images by (subject, session) for expected views (default: S1, S3, A2, A3)
 - Produce an HTML with a simple UI to rate each view per (sub, ses)
-- Export ratings to CSV client-side (no backend required)
-- Optional portability: copy referenced images next to the HTML (assets/) and rewrite paths
+- Export ratings to CSV client-side (no backend required); ratings also autosave to the
+  browser's localStorage
+- Optional local server mode (--serve): PNGs streamed from --root, rows paged as JSON and
+  ratings autosaved to SQLite, with no asset copying
+- Optional sharding (--shard-size) into several pages with an index page showing progress;
+  combine the per-shard CSVs with merge_T1_ratings.py
+- Optional portability: link/copy referenced images next to the HTML (assets/) and rewrite
+  paths, showing downscaled WebP/PNG thumbnails (full resolution opens on click; the
+  full-size images are in assets/ too unless --no-full-size)
+- Optional slice rendering straight from MNI-space T1 NIfTIs (--generate-from-nifti), in
+  parallel, instead of running slice_raw_T1.sh's FSL `slicer` step subject by subject
 
 Example:
   python /cbica/projects/bbl_22q/data/scripts/T1_QC_scripts/generate_T1_rating_html.py \
@@ -16,15 +25,25 @@ Example:
     --portable \
     --allow-missing
 
+  # Render S1/S3/A2/A3 slices from the MNI-space T1s first (skips PNGs newer than their T1)
+  python generate_T1_rating_html.py \
+    --generate-from-nifti /cbica/projects/bbl_22q/data/T1_QC/slices \
+    --png-outdir /cbica/projects/bbl_22q/data/T1_QC/slices \
+    --out /cbica/projects/bbl_22q/data/T1_QC/22q_T1_QC_ratings.html --portable
+
 """
 
 import argparse
 import base64
 import glob
+import html
+import math
 import os
 import re
 import shutil
-from typing import Dict, List, Tuple
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
 import json
 
 
@@ -72,10 +91,274 @@ def parse_args() -> argparse.Namespace:
             "Larger images will be linked/copied as files."
         ),
     )
-    return parser.parse_args()
+    parser.add_argument(
+        "--thumb-width",
+        type=int,
+        default=480,
+        help=(
+            "With --portable, write thumbnails at most this many pixels wide into "
+            "assets/thumbs/ and show those; full-size images open on click (0 disables). "
+            "The full-size images are still placed in assets/ (hardlinked where possible), "
+            "so the bundle is larger than the thumbnails alone; see --no-full-size."
+        ),
+    )
+    parser.add_argument(
+        "--no-full-size",
+        action="store_true",
+        help=(
+            "With --portable and thumbnails, do not put full-size images in assets/: the "
+            "bundle holds only thumbnails, and a click opens the original image by relative "
+            "path (which receivers only have with the same directory structure)."
+        ),
+    )
+    parser.add_argument(
+        "--thumb-format",
+        choices=["webp", "png"],
+        default="webp",
+        help="Thumbnail image format",
+    )
+    parser.add_argument(
+        "--shard-size",
+        type=int,
+        default=0,
+        help=(
+            "If >0, write pages of this many sessions each (<out>_shard-NNN.html) "
+            "plus an index page at --out with per-shard progress; shard pages left "
+            "over from an earlier run with more shards are removed"
+        ),
+    )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help=(
+            "Instead of writing a static page, run a local HTTP server that streams "
+            "PNGs from --root and autosaves ratings to --ratings-db"
+        ),
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="Bind address for --serve")
+    parser.add_argument("--port", type=int, default=8765, help="Port for --serve")
+    parser.add_argument(
+        "--ratings-db",
+        default=None,
+        help="SQLite file for --serve ratings (default: <out stem>_ratings.sqlite)",
+    )
+    parser.add_argument(
+        "--generate-from-nifti",
+        default=None,
+        metavar="NIFTI_DIR",
+        help=(
+            "Render slice PNGs from MNI-space T1 NIfTIs in this directory "
+            "(see --nifti-pattern) before building the HTML."
+        ),
+    )
+    parser.add_argument(
+        "--png-outdir",
+        default=None,
+        help="Where rendered PNGs are written (required with --generate-from-nifti)",
+    )
+    parser.add_argument(
+        "--nifti-pattern",
+        default="sub-*_ses-*_space-MNI152NLin6Asym_T1w.nii*",
+        help="Glob pattern (relative to --generate-from-nifti) for T1 images",
+    )
+    parser.add_argument(
+        "--slice",
+        action="append",
+        default=[],
+        metavar="VIEW=AXIS:FRACTION",
+        help=(
+            "With --generate-from-nifti: override or add a slice definition, e.g. S1=x:0.4 "
+            "(axis x=sagittal, y=coronal, z=axial; 0 <= FRACTION <= 1). Defaults match slice_raw_T1.sh."
+        ),
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Worker processes for slice rendering and asset preparation",
+    )
+    parser.add_argument(
+        "--index",
+        default=None,
+        help=(
+            "Shared SQLite file index (common/bids_index.py) to query instead of "
+            "globbing --root / --generate-from-nifti (patterns match file names)"
+        ),
+    )
+    args = parser.parse_args()
+    if args.generate_from_nifti and not args.png_outdir:
+        parser.error("--png-outdir is required with --generate-from-nifti")
+    if args.root is None:
+        if not args.generate_from_nifti:
+            parser.error("--root is required unless --generate-from-nifti is used")
+        args.root = args.png_outdir
+    if args.slice and not args.generate_from_nifti:
+        parser.error("--slice only applies with --generate-from-nifti")
+    # Slice planes are checked here, before any file is read or written
+    args.slice_specs = None
+    if args.generate_from_nifti:
+        try:
+            args.slice_specs = parse_slice_specs(args.slice, args.views)
+        except ValueError as e:
+            parser.error(str(e))
+    return args
 
 
+# Fixed card geometry for the windowed list in the generated page
+IMG_HEIGHT = 220
+ROW_HEIGHT = 330          # one line of views plus the card header
+VIEWS_PER_LINE = 4
+VIEW_LINE_HEIGHT = IMG_HEIGHT + 60    # each further line: image, rating select and grid gap
+
 FilenameRegex = re.compile(r"^(sub-[^_]+)_(ses-[^_]+)_([^.]+)\.png$")
+NiftiRegex = re.compile(r"^(sub-[^_]+)_(ses-[^_]+)_")
+
+# Same planes as slice_raw_T1.sh: `slicer -x 0.4 S1 -x 0.6 S3 -z 0.5 A2 -z 0.6 A3`
+DEFAULT_SLICES: Dict[str, Tuple[str, float]] = {
+    "S1": ("x", 0.4),
+    "S3": ("x", 0.6),
+    "A2": ("z", 0.5),
+    "A3": ("z", 0.6),
+}
+# Display axes (horizontal, vertical) for a plane normal to each world axis
+PLANE_AXES = {0: (1, 2), 1: (0, 2), 2: (0, 1)}
+
+
+def row_height(n_views: int) -> int:
+    """Card pitch for n_views views laid out VIEWS_PER_LINE to a line."""
+    lines = max(1, math.ceil(n_views / VIEWS_PER_LINE))
+    return ROW_HEIGHT + (lines - 1) * VIEW_LINE_HEIGHT
+
+
+def parse_slice_specs(overrides: List[str], views: List[str]) -> Dict[str, Tuple[str, float]]:
+    specs = dict(DEFAULT_SLICES)
+    for item in overrides:
+        m = re.fullmatch(r"([^=]+)=([xyz]):(\d*\.?\d+)", item)
+        if not m or not 0 <= float(m.group(3)) <= 1:
+            raise ValueError(f"Bad --slice '{item}'; expected VIEW=AXIS:FRACTION with 0 <= FRACTION <= 1, e.g. S1=x:0.4")
+        specs[m.group(1)] = (m.group(2), float(m.group(3)))
+    missing = [v for v in views if v not in specs]
+    if missing:
+        raise ValueError(f"No slice definition for view(s) {missing}; add them with --slice")
+    return {v: specs[v] for v in views}
+
+
+def extract_plane(img, axis: str, fraction: float):
+    """
+    Pull one plane out of a (possibly memory-mapped) NIfTI via its array proxy, so
+    only that plane is read. The plane is oriented for display: columns increase
+    along the world axis (R or A), rows run from superior/anterior at the top.
+    """
+    import nibabel as nib
+    import numpy as np
+
+    world = "xyz".index(axis)
+    ornt = nib.io_orientation(img.affine)  # per array axis: (world axis, +1/-1)
+    ax_of = {int(w): i for i, (w, _) in enumerate(ornt)}
+    flip_of = {int(w): f for w, f in ornt}
+
+    n = img.shape[ax_of[world]]
+    k = int(round(fraction * (n - 1)))
+    if flip_of[world] < 0:
+        k = n - 1 - k
+    index = [slice(None)] * 3 + [0] * (len(img.shape) - 3)
+    index[ax_of[world]] = k
+    plane = np.asarray(img.dataobj[tuple(index)], dtype=np.float32)
+
+    remaining = [int(ornt[i, 0]) for i in range(3) if i != ax_of[world]]
+    for j, w in enumerate(remaining):
+        if flip_of[w] < 0:
+            plane = np.flip(plane, axis=j)
+    horiz, vert = PLANE_AXES[world]
+    if remaining == [horiz, vert]:
+        plane = plane.T
+    return plane[::-1]
+
+
+def normalize_intensity(plane, low: float = 1.0, high: float = 99.0):
+    """Robust-window a plane to uint8 using percentiles of its nonzero voxels."""
+    import numpy as np
+
+    vals = plane[np.isfinite(plane) & (plane != 0)]
+    if vals.size == 0:
+        return np.zeros(plane.shape, dtype=np.uint8)
+    lo, hi = np.percentile(vals, [low, high])
+    scaled = (np.nan_to_num(plane) - lo) / max(hi - lo, 1e-6)
+    return (np.clip(scaled, 0.0, 1.0) * 255).astype(np.uint8)
+
+
+def render_slices(
+    nifti_path: str, png_paths: Dict[str, str], specs: Dict[str, Tuple[str, float]]
+) -> int:
+    """Write every PNG that is missing or older than the NIfTI; returns the number written."""
+    src_mtime = os.path.getmtime(nifti_path)
+    todo = [
+        v for v, png in png_paths.items()
+        if not os.path.exists(png) or os.path.getmtime(png) < src_mtime
+    ]
+    if not todo:
+        return 0
+
+    import nibabel as nib
+    from PIL import Image
+
+    img = nib.load(nifti_path, mmap=True)  # memory-mapped when uncompressed
+    for view in todo:
+        axis, fraction = specs[view]
+        pixels = normalize_intensity(extract_plane(img, axis, fraction))
+        tmp = png_paths[view] + ".tmp"
+        Image.fromarray(pixels).save(tmp, format="PNG", optimize=True)
+        os.replace(tmp, png_paths[view])
+    return len(todo)
+
+
+def use_common():
+    """Make the shared modules in ../common importable (a flat deployment needs nothing)."""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "common")
+    if path not in sys.path:
+        sys.path.append(path)
+
+
+def list_files(directory: str, pattern: str, index: Optional[str] = None) -> List[str]:
+    """Files in directory matching pattern, from the shared file index when one is given."""
+    if not index:
+        return sorted(glob.glob(os.path.join(directory, pattern)))
+    use_common()
+    from bids_index import indexed_glob
+
+    return [str(p) for p in indexed_glob(index, directory, pattern, recursive=False)]
+
+
+def generate_pngs_from_nifti(
+    nifti_dir: str,
+    pattern: str,
+    png_outdir: str,
+    specs: Dict[str, Tuple[str, float]],
+    jobs: int,
+    index: Optional[str] = None,
+) -> Tuple[int, int]:
+    """Render slice PNGs for every sub/ses T1 in a process pool. Returns (written, failed)."""
+    os.makedirs(png_outdir, exist_ok=True)
+    tasks = []
+    for path in list_files(nifti_dir, pattern, index):
+        m = NiftiRegex.match(os.path.basename(path))
+        if not m:
+            continue
+        sub, ses = m.groups()
+        pngs = {v: os.path.join(png_outdir, f"{sub}_{ses}_{v}.png") for v in specs}
+        tasks.append((path, pngs))
+
+    written = failed = 0
+    with ProcessPoolExecutor(max_workers=max(1, min(jobs, len(tasks) or 1))) as ex:
+        futs = {ex.submit(render_slices, path, pngs, specs): path for path, pngs in tasks}
+        for fut in as_completed(futs):
+            try:
+                written += fut.result()
+            except Exception as e:
+                failed += 1
+                print(f"[FAIL] {os.path.basename(futs[fut])}: {e}")
+    print(f"Rendered {written} PNGs from {len(tasks)} T1 images ({failed} failed).")
+    return written, failed
 
 
 def natural_sort_key(sub: str, ses: str) -> Tuple:
@@ -88,10 +371,10 @@ def natural_sort_key(sub: str, ses: str) -> Tuple:
 
 
 def collect_rows(
-    root: str, pattern: str, views: List[str], allow_missing: bool
+    root: str, pattern: str, views: List[str], allow_missing: bool, index: Optional[str] = None
 ) -> Tuple[List[Tuple[str, str]], Dict[Tuple[str, str], Dict[str, str]]]:
     pairs: Dict[Tuple[str, str], Dict[str, str]] = {}
-    for path in glob.glob(os.path.join(root, pattern)):
+    for path in list_files(root, pattern, index):
         fn = os.path.basename(path)
         m = FilenameRegex.match(fn)
         if not m:
@@ -107,50 +390,134 @@ def collect_rows(
     return keys, pairs
 
 
+def _same_file_state(src: str, dst: str) -> bool:
+    """True when dst already mirrors src (hardlink or copy2 with same size and mtime)."""
+    try:
+        a, b = os.stat(src), os.stat(dst)
+    except OSError:
+        return False
+    return (a.st_ino == b.st_ino and a.st_dev == b.st_dev) or (
+        a.st_size == b.st_size and a.st_mtime_ns == b.st_mtime_ns
+    )
+
+
+def link_or_copy(src: str, dst: str) -> bool:
+    """Hardlink src to dst (copy if linking fails); returns False if dst was already current."""
+    if _same_file_state(src, dst):
+        return False
+    if os.path.lexists(dst):
+        os.unlink(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+    return True
+
+
+def make_thumbnail(src: str, dst: str, max_width: int, fmt: str) -> bool:
+    """
+    Write a downscaled copy of src (at most max_width pixels wide). The thumbnail
+    takes src's mtime, so an unchanged source is detected by mtime alone.
+    Returns False if dst was already current.
+    """
+    src_mtime = os.stat(src).st_mtime_ns
+    if os.path.exists(dst) and os.stat(dst).st_mtime_ns == src_mtime:
+        return False
+    from PIL import Image
+
+    with Image.open(src) as im:
+        im.thumbnail((max_width, max_width * 16))
+        tmp = dst + ".tmp"
+        if fmt == "webp":
+            im.save(tmp, format="WEBP", quality=85, method=4)
+        else:
+            im.save(tmp, format="PNG", optimize=True)
+    os.replace(tmp, dst)
+    os.utime(dst, ns=(src_mtime, src_mtime))
+    return True
+
+
+def _prepare_asset(src: str, full_dst: str, thumb_dst: str, max_width: int, fmt: str) -> Tuple[bool, bool]:
+    # Worker for the asset pool: optional full-resolution link/copy plus optional thumbnail
+    thumb_done = make_thumbnail(src, thumb_dst, max_width, fmt) if thumb_dst else False
+    return (link_or_copy(src, full_dst) if full_dst else False), thumb_done
+
+
+def _data_uri(path: str) -> str:
+    ext = os.path.splitext(path)[1].lower().lstrip(".")
+    mime = {"webp": "image/webp", "jpg": "image/jpeg", "jpeg": "image/jpeg"}.get(ext, "image/png")
+    with open(path, "rb") as f:
+        return f"data:{mime};base64,{base64.b64encode(f.read()).decode('ascii')}"
+
+
 def ensure_portable_assets(
     keys: List[Tuple[str, str]],
     pairs: Dict[Tuple[str, str], Dict[str, str]],
     out_html: str,
     embed_small_kb: int,
-) -> Tuple[Dict[Tuple[str, str], Dict[str, str]], List[str]]:
+    thumb_width: int = 0,
+    thumb_format: str = "webp",
+    jobs: int = 1,
+    full_size: bool = True,
+) -> Tuple[Dict[Tuple[str, str], Dict[str, str]], Dict[Tuple[str, str], Dict[str, str]], List[str]]:
     """
     Prepare image references for portability:
-    - Create assets/ next to HTML
-    - Copy images there and rewrite paths relative to HTML
-    - For small images (<= embed_small_kb), embed as data URIs
-    Returns updated mapping and list of copied file paths
+    - Hardlink (or copy) full-resolution images into assets/ next to HTML
+    - If thumb_width > 0, also write downscaled thumbnails into assets/thumbs/, named
+      with their width (<stem>_w<width>.<format>) so other settings get their own files;
+      with full_size=False the full-resolution images are then left where they are and
+      referenced by relative path instead of being placed in assets/
+    - Unchanged files are skipped (same size/mtime, or an existing hardlink)
+    - For small display images (<= embed_small_kb), embed as data URIs
+    Work is done in a process pool. Returns (display refs, full-resolution refs,
+    list of files written); display refs point at thumbnails when enabled.
     """
+    out_dir = os.path.dirname(os.path.abspath(out_html))
+    assets_dir = os.path.join(out_dir, "assets")
+    thumbs_dir = os.path.join(assets_dir, "thumbs")
+    os.makedirs(thumbs_dir if thumb_width > 0 else assets_dir, exist_ok=True)
+    thumb_ext = ".webp" if thumb_format == "webp" else ".png"
+
+    jobs_by_src: Dict[str, Tuple[str, str]] = {}
+    for key in keys:
+        for src in pairs[key].values():
+            full_dst = os.path.join(assets_dir, os.path.basename(src))
+            thumb_dst = ""
+            if thumb_width > 0:
+                stem = os.path.splitext(os.path.basename(src))[0]
+                thumb_dst = os.path.join(thumbs_dir, f"{stem}_w{thumb_width}{thumb_ext}")
+                if not full_size:
+                    full_dst = ""
+            jobs_by_src[src] = (full_dst, thumb_dst)
+
     copied: List[str] = []
-    assets_dir = os.path.join(os.path.dirname(os.path.abspath(out_html)), "assets")
-    os.makedirs(assets_dir, exist_ok=True)
+    with ProcessPoolExecutor(max_workers=max(1, min(jobs, len(jobs_by_src) or 1))) as ex:
+        futs = {
+            ex.submit(_prepare_asset, src, full_dst, thumb_dst, thumb_width, thumb_format): src
+            for src, (full_dst, thumb_dst) in jobs_by_src.items()
+        }
+        for fut in as_completed(futs):
+            full_dst, thumb_dst = jobs_by_src[futs[fut]]
+            full_done, thumb_done = fut.result()
+            copied += [full_dst] if full_done else []
+            copied += [thumb_dst] if thumb_done else []
 
-    updated: Dict[Tuple[str, str], Dict[str, str]] = {}
+    display: Dict[Tuple[str, str], Dict[str, str]] = {}
+    full: Dict[Tuple[str, str], Dict[str, str]] = {}
     for key in keys:
-        updated[key] = {}
+        display[key], full[key] = {}, {}
         for view, src in pairs[key].items():
-            try:
-                size_kb = os.path.getsize(src) / 1024.0
-            except OSError:
-                size_kb = float("inf")
-
-            if embed_small_kb > 0 and size_kb <= embed_small_kb:
+            full_dst, thumb_dst = jobs_by_src[src]
+            shown = thumb_dst or full_dst
+            full[key][view] = os.path.relpath(full_dst or src, out_dir)
+            display[key][view] = os.path.relpath(shown, out_dir)
+            if embed_small_kb > 0 and os.path.getsize(shown) / 1024.0 <= embed_small_kb:
                 try:
-                    with open(src, "rb") as f:
-                        b64 = base64.b64encode(f.read()).decode("ascii")
-                    updated[key][view] = f"data:image/png;base64,{b64}"
-                except Exception:
-                    # Fallback to copying
-                    dst = os.path.join(assets_dir, os.path.basename(src))
-                    shutil.copy2(src, dst)
-                    copied.append(dst)
-                    updated[key][view] = os.path.relpath(dst, os.path.dirname(out_html))
-            else:
-                dst = os.path.join(assets_dir, os.path.basename(src))
-                shutil.copy2(src, dst)
-                copied.append(dst)
-                updated[key][view] = os.path.relpath(dst, os.path.dirname(out_html))
-
-    return updated, copied
+                    display[key][view] = _data_uri(shown)
+                except OSError:
+                    pass
+
+    return display, full, copied
 
 
 def make_relative_refs(
@@ -172,24 +539,37 @@ def render_html(
     pairs: Dict[Tuple[str, str], Dict[str, str]],
     views: List[str],
     out_path: str,
-):
+    full_pairs: Optional[Dict[Tuple[str, str], Dict[str, str]]] = None,
+    title: str = "T1 QC Ratings",
+    csv_name: str = "T1-ratings.csv",
+    storage_key: Optional[str] = None,
+    index_href: Optional[str] = None,
+    serve: bool = False,
+) -> str:
     # Minimal CSS + JS for table layout and CSV export
-    css = """
-    body { font-family: system-ui, -apple-system, Segoe UI, Roboto, Arial, sans-serif; margin: 16px; }
-    h1 { font-size: 20px; margin: 0 0 12px 0; }
-    .controls { display: flex; gap: 8px; align-items: center; margin-bottom: 12px; flex-wrap: wrap; }
-    .grid { display: grid; grid-template-columns: 1fr; gap: 16px; }
-    .card { border: 1px solid #ddd; border-radius: 8px; padding: 8px; background: #fff; }
-    .header { display: flex; align-items: baseline; justify-content: space-between; gap: 8px; margin-bottom: 8px; }
-    .views { display: grid; grid-template-columns: repeat(4, minmax(0, 1fr)); gap: 12px; }
-    .view { display: flex; flex-direction: column; gap: 6px; }
-    .view img { width: 100%; height: auto; display: block; border: 1px solid #eee; border-radius: 4px; }
-    .rating { display: flex; gap: 6px; align-items: center; flex-wrap: wrap; }
-    .muted { color: #666; font-size: 12px; }
-    .search { padding: 6px 10px; border: 1px solid #ccc; border-radius: 6px; min-width: 260px; }
-    button { padding: 6px 10px; border: 1px solid #aaa; border-radius: 6px; background: #f7f7f7; cursor: pointer; }
-    button.primary { background: #0b5; color: #fff; border-color: #0a4; }
-    button:disabled { opacity: 0.6; cursor: not-allowed; }
+    row_h = row_height(len(views))
+    css = f"""
+    body {{ font-family: system-ui, -apple-system, Segoe UI, Roboto, Arial, sans-serif; margin: 16px; }}
+    h1 {{ font-size: 20px; margin: 0 0 12px 0; }}
+    .controls {{ display: flex; gap: 8px; align-items: center; margin-bottom: 12px; flex-wrap: wrap; }}
+    .grid {{ position: relative; }}
+    .card {{ position: absolute; left: 0; right: 0; height: {row_h - 16}px; box-sizing: border-box; overflow: hidden;
+             border: 1px solid #ddd; border-radius: 8px; padding: 8px; background: #fff; }}
+    .header {{ display: flex; align-items: baseline; justify-content: space-between; gap: 8px; margin-bottom: 8px; }}
+    .views {{ display: grid; grid-template-columns: repeat({VIEWS_PER_LINE}, minmax(0, 1fr)); gap: 12px; }}
+    .view {{ display: flex; flex-direction: column; gap: 6px; }}
+    .view img {{ width: 100%; height: {IMG_HEIGHT}px; object-fit: contain; display: block; background: #000;
+                 border: 1px solid #eee; border-radius: 4px; cursor: zoom-in; }}
+    #lightbox {{ position: fixed; inset: 0; background: rgba(0,0,0,0.85); display: none; z-index: 10;
+                 flex-direction: column; align-items: center; justify-content: center; gap: 8px; cursor: zoom-out; }}
+    #lightbox img {{ max-width: 95vw; max-height: 90vh; object-fit: contain; }}
+    #lightbox div {{ color: #eee; font-size: 13px; }}
+    .rating {{ display: flex; gap: 6px; align-items: center; flex-wrap: wrap; }}
+    .muted {{ color: #666; font-size: 12px; }}
+    .search {{ padding: 6px 10px; border: 1px solid #ccc; border-radius: 6px; min-width: 260px; }}
+    button {{ padding: 6px 10px; border: 1px solid #aaa; border-radius: 6px; background: #f7f7f7; cursor: pointer; }}
+    button.primary {{ background: #0b5; color: #fff; border-color: #0a4; }}
+    button:disabled {{ opacity: 0.6; cursor: not-allowed; }}
     """
 
     # Data for client-side JS
@@ -197,23 +577,73 @@ def render_html(
     data_rows = []
     for sub, ses in keys:
         images = {v: pairs[(sub, ses)].get(v, "") for v in views}
-        data_rows.append(
-            {
-                "sub": sub,
-                "ses": ses,
-                "images": images,
-            }
-        )
+        row = {
+            "sub": sub,
+            "ses": ses,
+            "images": images,
+        }
+        if full_pairs is not None:
+            # Full-resolution images, loaded only when a thumbnail is clicked
+            row["full"] = {v: full_pairs[(sub, ses)].get(v, "") for v in views}
+        data_rows.append(row)
 
     # Serialize minimal JSON safely
     json_data = json.dumps(data_rows)
     json_views = json.dumps(views)
+    # Ratings autosave to the browser's localStorage under this key (also read by the shard index)
+    storage_key = storage_key or f"t1qc:{os.path.splitext(os.path.basename(out_path or 'served'))[0]}"
 
     js = f"""
     const DATA = {json_data};
     const VIEWS = {json_views};
     let PREFILL = {{}}; // key: `${{sub}}|${{ses}}` -> {{ view: score }}
     let RATINGS = {{}}; // live user selections, same keying as PREFILL
+    const STORAGE_KEY = {json.dumps(storage_key)};
+    const CSV_NAME = {json.dumps(csv_name)};
+    // In --serve mode rows are paged in from the server and ratings are saved to it
+    const SERVE = {json.dumps(serve)};
+
+    async function loadSaved() {{
+      if (SERVE) {{
+        try {{ RATINGS = await (await fetch('api/ratings')).json(); }} catch (e) {{ RATINGS = {{}}; }}
+        refreshMounted();
+        return;
+      }}
+      try {{ RATINGS = JSON.parse(localStorage.getItem(STORAGE_KEY) || '{{}}'); }}
+      catch (e) {{ RATINGS = {{}}; }}
+    }}
+
+    function saveRatings(sub, ses, view) {{
+      if (SERVE) {{
+        const score = RATINGS[makeKey(sub, ses)][view];
+        fetch('api/ratings', {{
+          method: 'POST',
+          headers: {{ 'Content-Type': 'application/json' }},
+          body: JSON.stringify({{ sub, ses, view, score }}),
+        }}).then(r => {{ if (!r.ok) throw new Error(r.status); }})
+          .catch(e => {{
+            const msg = document.getElementById('resumeMsg');
+            if (msg) msg.textContent = `Autosave failed (${{e.message}}); use Download CSV`;
+          }});
+        return;
+      }}
+      try {{ localStorage.setItem(STORAGE_KEY, JSON.stringify(RATINGS)); }} catch (e) {{}}
+    }}
+
+    async function loadRowsFromServer(pageSize = 2000) {{
+      let offset = 0, total = Infinity;
+      while (offset < total) {{
+        const page = await (await fetch(`api/rows?offset=${{offset}}&limit=${{pageSize}}`)).json();
+        total = page.total;
+        if (!page.rows.length) break;
+        for (const r of page.rows) {{
+          DATA.push(r);
+          SEARCH_INDEX.push((r.sub + ' ' + r.ses).toLowerCase());
+        }}
+        offset += page.rows.length;
+        render(document.getElementById('search').value);
+      }}
+    }}
 
     const makeKey = (sub, ses) => sub + '|' + ses;
 
@@ -248,7 +678,7 @@ def render_html(
       const url = URL.createObjectURL(blob);
       const a = document.createElement('a');
       a.href = url;
-      a.download = 'T1-ratings.csv';
+      a.download = CSV_NAME;
       document.body.appendChild(a);
       a.click();
       document.body.removeChild(a);
@@ -304,22 +734,25 @@ def render_html(
     }}
 
     function applyPrefill(prefill) {{
-      const cards = document.querySelectorAll('[data-card]');
+      // Cards are created on demand and read PREFILL when mounted, so only the
+      // currently mounted ones need updating here.
       let applied = 0;
-      for (const card of cards) {{
-        const sub = card.getAttribute('data-sub');
-        const ses = card.getAttribute('data-ses');
-        const key = `${{sub}}|${{ses}}`;
-        const views = prefill[key];
-        if (!views) continue;
+      for (const row of DATA) {{
+        const views = prefill[makeKey(row.sub, row.ses)];
+        if (views) applied += VIEWS.filter(v => views[v] !== undefined).length;
+      }}
+      refreshMounted();
+      return applied;
+    }}
+
+    function refreshMounted() {{
+      for (const card of MOUNTED.values()) {{
+        const key = makeKey(card.getAttribute('data-sub'), card.getAttribute('data-ses'));
         for (const v of VIEWS) {{
-          const val = views[v];
-          if (val === undefined) continue;
           const sel = card.querySelector(`[data-score="${{v}}"]`);
-          if (sel) {{ sel.value = val; applied++; }}
+          if (sel) sel.value = currentScore(key, v);
         }}
       }}
-      return applied;
     }}
 
     function onCsvSelected(file) {{
@@ -335,93 +768,171 @@ def render_html(
       reader.readAsText(file);
     }}
 
-    function render(filter='') {{
+    function showFull(src, caption) {{
+      const box = document.getElementById('lightbox');
+      box.querySelector('img').src = src;
+      box.querySelector('div').textContent = caption;
+      box.style.display = 'flex';
+    }}
+
+    function hideFull() {{
+      const box = document.getElementById('lightbox');
+      box.style.display = 'none';
+      box.querySelector('img').removeAttribute('src');
+    }}
+
+    function currentScore(key, v) {{
+      if (RATINGS[key] && RATINGS[key][v] !== undefined) return RATINGS[key][v];
+      if (PREFILL[key] && PREFILL[key][v] !== undefined) return PREFILL[key][v];
+      return '';
+    }}
+
+    // Windowed list: only rows near the viewport have DOM cards (and therefore
+    // loaded images). Every card has the same height, so a row's position is
+    // just its index in VISIBLE times ROW_H.
+    const ROW_H = {row_h};
+    const OVERSCAN = 3;
+    const SEARCH_INDEX = DATA.map(r => (r.sub + ' ' + r.ses).toLowerCase());
+    let VISIBLE = DATA.map((_, i) => i);   // DATA indices passing the filter
+    const MOUNTED = new Map();             // DATA index -> card element
+
+    function buildCard(row) {{
+      const card = document.createElement('div');
+      card.className = 'card';
+      card.setAttribute('data-card', '');
+      card.setAttribute('data-sub', row.sub);
+      card.setAttribute('data-ses', row.ses);
+
+      const header = document.createElement('div');
+      header.className = 'header';
+      const title = document.createElement('div');
+      title.innerHTML = `<strong>${{row.sub}}</strong> &nbsp; <span class="muted">${{row.ses}}</span>`;
+      const hint = document.createElement('div');
+      hint.className = 'muted';
+      hint.textContent = 'Rate each view: 0=Fail, 1=Pass';
+      header.appendChild(title);
+      header.appendChild(hint);
+      card.appendChild(header);
+
+      const views = document.createElement('div');
+      views.className = 'views';
+      for (const v of VIEWS) {{
+        const box = document.createElement('div');
+        box.className = 'view';
+        const img = document.createElement('img');
+        img.decoding = 'async';
+        const src = row.images[v] || '';
+        if (src) img.src = src;
+        img.alt = `${{row.sub}} ${{row.ses}} ${{v}}`;
+        const full = (row.full && row.full[v]) || src;
+        if (full) img.addEventListener('click', () => showFull(full, img.alt));
+        const label = document.createElement('label');
+        label.textContent = v;
+        const select = document.createElement('select');
+        select.setAttribute('data-score', v);
+        for (const [val, name] of [['', ''], ['0','Fail'], ['1','Pass']]) {{
+          const opt = document.createElement('option');
+          opt.value = val; opt.textContent = name;
+          select.appendChild(opt);
+        }}
+        // initialize from RATINGS or PREFILL
+        const key = makeKey(row.sub, row.ses);
+        select.value = currentScore(key, v);
+        // persist on change
+        select.addEventListener('change', () => {{
+          RATINGS[key] = RATINGS[key] || {{}};
+          RATINGS[key][v] = select.value;
+          saveRatings(row.sub, row.ses, v);
+        }});
+        const rating = document.createElement('div');
+        rating.className = 'rating';
+        rating.appendChild(label);
+        rating.appendChild(select);
+        box.appendChild(img);
+        box.appendChild(rating);
+        views.appendChild(box);
+      }}
+      card.appendChild(views);
+      return card;
+    }}
+
+    function releaseCard(card) {{
+      // Drop image sources so the browser can free decoded pixels
+      for (const img of card.querySelectorAll('img')) img.removeAttribute('src');
+      card.remove();
+    }}
+
+    function updateWindow() {{
       const root = document.getElementById('root');
-      root.innerHTML = '';
-      const q = filter.trim().toLowerCase();
-      const rows = DATA.filter(r => (r.sub + ' ' + r.ses).toLowerCase().includes(q));
-      for (const row of rows) {{
-        const card = document.createElement('div');
-        card.className = 'card';
-        card.setAttribute('data-card', '');
-        card.setAttribute('data-sub', row.sub);
-        card.setAttribute('data-ses', row.ses);
-
-        const header = document.createElement('div');
-        header.className = 'header';
-        const title = document.createElement('div');
-        title.innerHTML = `<strong>${{row.sub}}</strong> &nbsp; <span class="muted">${{row.ses}}</span>`;
-        const hint = document.createElement('div');
-        hint.className = 'muted';
-        hint.textContent = 'Rate each view: 0=Fail, 1=Pass';
-        header.appendChild(title);
-        header.appendChild(hint);
-        card.appendChild(header);
-
-        const views = document.createElement('div');
-        views.className = 'views';
-        for (const v of VIEWS) {{
-          const box = document.createElement('div');
-          box.className = 'view';
-          const img = document.createElement('img');
-          const src = row.images[v] || '';
-          if (src) img.src = src;
-          img.alt = `${{row.sub}} ${{row.ses}} ${{v}}`;
-          const label = document.createElement('label');
-          label.textContent = v;
-          const select = document.createElement('select');
-          select.setAttribute('data-score', v);
-          for (const [val, name] of [['', ''], ['0','Fail'], ['1','Pass']]) {{
-            const opt = document.createElement('option');
-            opt.value = val; opt.textContent = name;
-            select.appendChild(opt);
-          }}
-          // initialize from RATINGS or PREFILL
-          const key = makeKey(row.sub, row.ses);
-          let initVal = '';
-          if (RATINGS[key] && RATINGS[key][v] !== undefined) {{ initVal = RATINGS[key][v]; }}
-          else if (PREFILL[key] && PREFILL[key][v] !== undefined) {{ initVal = PREFILL[key][v]; }}
-          select.value = initVal;
-          // persist on change
-          select.addEventListener('change', () => {{
-            RATINGS[key] = RATINGS[key] || {{}};
-            RATINGS[key][v] = select.value;
-          }});
-          const rating = document.createElement('div');
-          rating.className = 'rating';
-          rating.appendChild(label);
-          rating.appendChild(select);
-          box.appendChild(img);
-          box.appendChild(rating);
-          views.appendChild(box);
+      const top = root.getBoundingClientRect().top;
+      const first = Math.max(0, Math.floor(-top / ROW_H) - OVERSCAN);
+      const last = Math.min(VISIBLE.length, Math.ceil((window.innerHeight - top) / ROW_H) + OVERSCAN);
+      const wanted = new Map();
+      for (let pos = first; pos < last; pos++) wanted.set(VISIBLE[pos], pos);
+      for (const [idx, card] of MOUNTED) {{
+        if (!wanted.has(idx)) {{ releaseCard(card); MOUNTED.delete(idx); }}
+      }}
+      for (const [idx, pos] of wanted) {{
+        let card = MOUNTED.get(idx);
+        if (!card) {{
+          card = buildCard(DATA[idx]);
+          root.appendChild(card);
+          MOUNTED.set(idx, card);
         }}
-        card.appendChild(views);
-        root.appendChild(card);
+        card.style.top = (pos * ROW_H) + 'px';
       }}
-      document.getElementById('count').textContent = rows.length + ' rows';
+    }}
+
+    function render(filter='') {{
+      const q = filter.trim().toLowerCase();
+      VISIBLE = [];
+      for (let i = 0; i < SEARCH_INDEX.length; i++) {{
+        if (!q || SEARCH_INDEX[i].includes(q)) VISIBLE.push(i);
+      }}
+      document.getElementById('root').style.height = (VISIBLE.length * ROW_H) + 'px';
+      document.getElementById('count').textContent = VISIBLE.length + ' rows';
+      updateWindow();
     }}
 
     window.addEventListener('DOMContentLoaded', () => {{
       const search = document.getElementById('search');
-      search.addEventListener('input', () => render(search.value));
+      let debounce = null;
+      search.addEventListener('input', () => {{
+        clearTimeout(debounce);
+        debounce = setTimeout(() => {{ window.scrollTo(0, 0); render(search.value); }}, 120);
+      }});
+      let ticking = false;
+      const onScroll = () => {{
+        if (ticking) return;
+        ticking = true;
+        requestAnimationFrame(() => {{ ticking = false; updateWindow(); }});
+      }};
+      window.addEventListener('scroll', onScroll, {{ passive: true }});
+      window.addEventListener('resize', onScroll);
+      window.addEventListener('keydown', (e) => {{ if (e.key === 'Escape') hideFull(); }});
       const csv = document.getElementById('csvUpload');
       csv.addEventListener('change', () => {{ if (csv.files && csv.files[0]) onCsvSelected(csv.files[0]); }});
+      loadSaved();
       render('');
+      if (SERVE) loadRowsFromServer();
     }});
     """
 
+    back_link = (
+        f' <a class="muted" href="{html.escape(index_href)}">&larr; all shards</a>' if index_href else ""
+    )
     html_doc = f"""
 <!doctype html>
 <html lang="en">
 <head>
   <meta charset="utf-8" />
   <meta name="viewport" content="width=device-width, initial-scale=1" />
-  <title>T1 QC Ratings</title>
+  <title>{html.escape(title)}</title>
   <style>{css}</style>
   <script>{js}</script>
 </head>
 <body>
-  <h1>T1 QC Ratings</h1>
+  <h1>{html.escape(title)}</h1>{back_link}
   <div class="controls">
     <input id="search" class="search" type="search" placeholder="Filter by subject/session (e.g., sub-123 ses-1)" />
     <button class="primary" onclick="downloadCSV()">Download CSV</button>
@@ -430,36 +941,170 @@ def render_html(
     <span id="count" class="muted"></span>
   </div>
   <div id="root" class="grid"></div>
+  <div id="lightbox" onclick="hideFull()"><img alt="" /><div></div></div>
 </body>
 </html>
 """
 
+    if out_path:
+        with open(out_path, "w", encoding="utf-8") as f:
+            f.write(html_doc)
+    return html_doc
+
+
+def shard_path(out_html: str, i: int) -> str:
+    stem, ext = os.path.splitext(out_html)
+    return f"{stem}_shard-{i:03d}{ext or '.html'}"
+
+
+def remove_stale_shards(out_html: str, n_shards: int) -> List[str]:
+    """Delete shard pages of out_html numbered above n_shards, left over from an earlier, larger run."""
+    stem, ext = os.path.splitext(out_html)
+    pattern = re.compile(re.escape(os.path.basename(stem)) + r"_shard-(\d+)" + re.escape(ext or ".html") + "$")
+    removed = []
+    for path in glob.glob(f"{glob.escape(stem)}_shard-*{glob.escape(ext or '.html')}"):
+        m = pattern.match(os.path.basename(path))
+        if m and int(m.group(1)) > n_shards:
+            os.remove(path)
+            removed.append(path)
+    return sorted(removed)
+
+
+def render_index(shards: List[Dict], views: List[str], out_path: str, title: str):
+    """
+    Index page linking every shard. Progress per shard is read from the same
+    localStorage keys the shard pages autosave to, so it reflects ratings made
+    in this browser.
+    """
+    json_shards = json.dumps(shards)
+    json_views = json.dumps(views)
+    doc = f"""
+<!doctype html>
+<html lang="en">
+<head>
+  <meta charset="utf-8" />
+  <title>{html.escape(title)} — shards</title>
+  <style>
+    body {{ font-family: system-ui, -apple-system, Segoe UI, Roboto, Arial, sans-serif; margin: 16px; }}
+    table {{ border-collapse: collapse; }}
+    td, th {{ padding: 4px 10px; border-bottom: 1px solid #eee; text-align: left; }}
+    .bar {{ width: 160px; height: 10px; background: #eee; border-radius: 5px; overflow: hidden; }}
+    .bar > div {{ height: 100%; background: #0b5; }}
+    .muted {{ color: #666; font-size: 12px; }}
+  </style>
+  <script>
+    const SHARDS = {json_shards};
+    const VIEWS = {json_views};
+    function progress(shard) {{
+      let saved = {{}};
+      try {{ saved = JSON.parse(localStorage.getItem(shard.storage_key) || '{{}}'); }} catch (e) {{}}
+      let done = 0;
+      for (const views of Object.values(saved)) {{
+        done += VIEWS.filter(v => views[v] !== undefined && views[v] !== '').length;
+      }}
+      return Math.min(done, shard.rows * VIEWS.length);
+    }}
+    function render() {{
+      const body = document.getElementById('rows');
+      body.innerHTML = '';
+      for (const s of SHARDS) {{
+        const total = s.rows * VIEWS.length;
+        const done = progress(s);
+        const tr = document.createElement('tr');
+        tr.innerHTML = `<td><a href="${{s.href}}">${{s.name}}</a></td>` +
+          `<td>${{s.rows}}</td><td class="muted">${{s.first}} … ${{s.last}}</td>` +
+          `<td><div class="bar"><div style="width:${{(100 * done / total).toFixed(1)}}%"></div></div></td>` +
+          `<td class="muted">${{done}} / ${{total}}</td>`;
+        body.appendChild(tr);
+      }}
+    }}
+    window.addEventListener('DOMContentLoaded', render);
+    window.addEventListener('focus', render);
+  </script>
+</head>
+<body>
+  <h1>{html.escape(title)}</h1>
+  <p class="muted">Progress is read from this browser's saved ratings. Combine the per-shard CSV exports with merge_T1_ratings.py.</p>
+  <table>
+    <thead><tr><th>Shard</th><th>Sessions</th><th>Range</th><th colspan="2">Rated views</th></tr></thead>
+    <tbody id="rows"></tbody>
+  </table>
+</body>
+</html>
+"""
     with open(out_path, "w", encoding="utf-8") as f:
-        f.write(html_doc)
+        f.write(doc)
 
 
 def main() -> None:
     args = parse_args()
 
-    keys, pairs = collect_rows(args.root, args.pattern, args.views, args.allow_missing)
+    if args.generate_from_nifti:
+        generate_pngs_from_nifti(
+            args.generate_from_nifti, args.nifti_pattern, args.png_outdir, args.slice_specs, args.jobs,
+            args.index,
+        )
+
+    keys, pairs = collect_rows(args.root, args.pattern, args.views, args.allow_missing, args.index)
 
     if not keys:
         raise SystemExit(
             "No rows found. Check --root and --pattern, and ensure filenames match 'sub-*_ses-*_VIEW.png'."
         )
 
+    if args.serve:
+        from t1_qc_server import serve
+
+        db = args.ratings_db or os.path.splitext(os.path.abspath(args.out))[0] + "_ratings.sqlite"
+        serve(keys, pairs, args.views, db, args.host, args.port)
+        return
+
     # Rewrite image references according to portability settings
     if args.portable:
-        pairs, copied = ensure_portable_assets(keys, pairs, args.out, args.embed_small)
+        pairs, full_pairs, copied = ensure_portable_assets(
+            keys, pairs, args.out, args.embed_small,
+            args.thumb_width, args.thumb_format, args.jobs,
+            full_size=not args.no_full_size,
+        )
         print(
-            f"Prepared portable assets in 'assets/' next to HTML. Files copied: {len(copied)}"
+            f"Prepared portable assets in 'assets/' next to HTML. Files written: {len(copied)}"
         )
     else:
         pairs = make_relative_refs(keys, pairs, args.out)
+        full_pairs = None
 
     os.makedirs(os.path.dirname(os.path.abspath(args.out)) or ".", exist_ok=True)
-    render_html(keys, pairs, args.views, args.out)
-    print(f"Wrote HTML: {args.out}")
+    if args.shard_size > 0:
+        # Shards sit next to the index, so they all share the same assets/ directory
+        base = os.path.splitext(os.path.basename(args.out))[0]
+        shards = []
+        for i, start in enumerate(range(0, len(keys), args.shard_size), start=1):
+            chunk = keys[start:start + args.shard_size]
+            path = shard_path(args.out, i)
+            name = f"shard-{i:03d}"
+            storage_key = f"t1qc:{base}:{name}"
+            render_html(
+                chunk, pairs, args.views, path, full_pairs,
+                title=f"T1 QC Ratings — {name}",
+                csv_name=f"T1-ratings_{name}.csv",
+                storage_key=storage_key,
+                index_href=os.path.basename(args.out),
+            )
+            shards.append({
+                "name": name, "href": os.path.basename(path), "rows": len(chunk),
+                "first": f"{chunk[0][0]} {chunk[0][1]}", "last": f"{chunk[-1][0]} {chunk[-1][1]}",
+                "storage_key": storage_key,
+            })
+        render_index(shards, args.views, args.out, "T1 QC Ratings")
+        print(f"Wrote index: {args.out} ({len(shards)} shards of up to {args.shard_size} sessions)")
+    else:
+        shards = []
+        render_html(keys, pairs, args.views, args.out, full_pairs)
+        print(f"Wrote HTML: {args.out}")
+    # Shard pages a previous run wrote beyond the current count would still open with stale sessions
+    stale = remove_stale_shards(args.out, len(shards))
+    if stale:
+        print(f"Removed {len(stale)} stale shard page(s): {', '.join(os.path.basename(p) for p in stale)}")
     print(f"Rows: {len(keys)} | Views per row: {len(args.views)}")
     if args.portable:
         print(
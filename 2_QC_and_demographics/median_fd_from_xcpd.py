@@ -2,22 +2,20 @@
 # python median_fd_from_xcpd.py --base /cbica/projects/bbl_22q/data/PNC_xcpd_extracted/xcpd --out /cbica/projects/bbl_22q/data/PNC_xcpd_extracted/PNC_median_fd_summary.csv
 
 #!/usr/bin/env python3
-import os, glob, argparse
-import pandas as pd
-import numpy as np
-import statistics as stat
+# Thin wrapper around fd_summary_from_xcpd.py that keeps the original idemo/rest
+# median-FD columns read by the demographics and motion-distribution Rmds.
+import argparse
+from fd_summary_from_xcpd import summarize_base
+
+TASKS = ("idemo", "rest")
+COLUMNS = [
+    "sub", "ses",
+    "n_vols_idemo", "median_fd_idemo",
+    "n_vols_rest", "median_fd_rest",
+    "n_vols_total", "median_fd_combined",
+    "path_idemo", "path_rest",
+]
 
-# Read just FD column from one motion file
-def read_fd(fp):
-    if not fp or not os.path.isfile(fp):
-        return pd.Series(dtype=float)
-    try:
-        df = pd.read_csv(fp, sep="\t", usecols=["framewise_displacement"])
-        s = pd.to_numeric(df["framewise_displacement"], errors="coerce")
-    except ValueError:
-        return pd.Series(dtype=float)
-    return s.replace([np.inf, -np.inf], np.nan).dropna()
-    
 def main():
     parser = argparse.ArgumentParser(
         description="Compute median FD from XCP-D motion.tsv files for idemo/rest and combined."
@@ -25,65 +23,24 @@ def main():
     parser.add_argument(
         "--base",
         required=True,
-        help="Dataset directory containing sub-*/ses-*/func/*motion.tsv",
+        help="Dataset directory containing sub-*/ses-*/func/*motion.tsv, or BABS zip archive(s)",
     )
     parser.add_argument(
         "-o", "--out",
         default=None,
         help="Optional output CSV path (if omitted, prints to stdout)."
     )
+    parser.add_argument(
+        "--store", default=None,
+        help="Optional per-volume FD Parquet store to update incrementally and summarize from."
+    )
+    parser.add_argument(
+        "--index", default=None,
+        help="Shared SQLite file index (common/bids_index.py) to query instead of globbing --base."
+    )
     args = parser.parse_args()
 
-    BASE = args.base
-
-    # Find motion files for both tasks
-    idemo_paths = glob.glob(os.path.join(BASE, "sub-*", "ses-*", "func", "*task-idemo_*motion.tsv"))
-    rest_paths  = glob.glob(os.path.join(BASE, "sub-*", "ses-*", "func", "*task-rest_*motion.tsv"))
-
-    def key_from_path(p):
-        # expects .../sub-XXX/ses-YYY/func/...motion.tsv
-        parts = p.split(os.sep)
-        sub = next(x for x in parts if x.startswith("sub-"))
-        ses = next(x for x in parts if x.startswith("ses-"))
-        return sub, ses
-
-    # Map (sub, ses) -> file path per task
-    records = {}
-    for p in idemo_paths:
-        records.setdefault(key_from_path(p), {})["idemo"] = p
-    for p in rest_paths:
-        records.setdefault(key_from_path(p), {})["rest"] = p
-
-    rows = []
-    for (sub, ses), tasks in sorted(records.items()):
-        idemo_path = tasks.get("idemo", "")
-        rest_path  = tasks.get("rest", "")
-
-        fd_idemo = read_fd(idemo_path) if idemo_path else pd.Series(dtype=float)
-        fd_rest  = read_fd(rest_path)  if rest_path  else pd.Series(dtype=float)
-
-        median_idemo = stat.median(fd_idemo) if not fd_idemo.empty else float("nan")
-        median_rest  = stat.median(fd_rest)  if not fd_rest.empty  else float("nan")
-
-        # Combined = median FD across concatenated volumes of both scans (or whatever exists)
-        parts = [s for s in (fd_idemo, fd_rest) if not s.empty]
-        fd_all = pd.concat(parts, ignore_index=True) if parts else pd.Series(dtype=float)
-        median_combined = stat.median(fd_all) if not fd_all.empty else float("nan")
-
-        rows.append({
-            "sub": sub,
-            "ses": ses,
-            "n_vols_idemo": int(fd_idemo.size),
-            "median_fd_idemo": median_idemo,
-            "n_vols_rest": int(fd_rest.size),
-            "median_fd_rest": median_rest,
-            "n_vols_total": int(fd_all.size),
-            "median_fd_combined": median_combined,
-            "path_idemo": tasks.get("idemo", ""),
-            "path_rest": tasks.get("rest", ""),
-        })
-
-    out = pd.DataFrame(rows).sort_values(["sub", "ses"]).reset_index(drop=True)
+    out = summarize_base(args.base, tasks=TASKS, store=args.store, index=args.index).reindex(columns=COLUMNS)
 
     if args.out:
         out.to_csv(args.out, index=False)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Merge T1 QC rating CSVs (e.g. the per-shard exports of generate_T1_rating_html.py
+--shard-size) into one table with a single row per (subid, sesid).
+
+Files are applied in the order given: a non-empty score from a later file fills
+or replaces the value from an earlier one, and empty cells never erase a score.
+Conflicting non-empty scores are reported.
+
+Example:
+  python merge_T1_ratings.py \
+    --inputs /cbica/projects/bbl_22q/data/T1_QC/ratings/T1-ratings_shard-*.csv \
+    --out /cbica/projects/bbl_22q/data/T1_QC/22q_T1_QC_ratings.csv
+"""
+
+import argparse
+import csv
+import glob
+from typing import Dict, List, Tuple
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Merge per-shard T1 QC rating CSVs into one deduplicated table"
+    )
+    parser.add_argument(
+        "--inputs",
+        nargs="+",
+        required=True,
+        help="Rating CSVs or glob patterns, applied in order (later wins on conflict)",
+    )
+    parser.add_argument("--out", required=True, help="Merged CSV path")
+    return parser.parse_args()
+
+
+def expand_inputs(patterns: List[str]) -> List[str]:
+    paths: List[str] = []
+    for pat in patterns:
+        matches = sorted(glob.glob(pat))
+        paths.extend(matches if matches else [pat])
+    return paths
+
+
+def merge_ratings(paths: List[str]) -> Tuple[List[str], Dict[Tuple[str, str], Dict[str, str]], int]:
+    """Returns (score columns, merged rows keyed by (subid, sesid), number of conflicts)."""
+    columns: List[str] = []
+    merged: Dict[Tuple[str, str], Dict[str, str]] = {}
+    conflicts = 0
+    for path in paths:
+        with open(path, newline="", encoding="utf-8") as f:
+            reader = csv.DictReader(f)
+            if not reader.fieldnames or "subid" not in reader.fieldnames or "sesid" not in reader.fieldnames:
+                raise SystemExit(f"{path}: expected 'subid' and 'sesid' columns")
+            for col in reader.fieldnames:
+                if col not in ("subid", "sesid") and col not in columns:
+                    columns.append(col)
+            for row in reader:
+                key = (row["subid"], row["sesid"])
+                if not key[0] or not key[1]:
+                    continue
+                target = merged.setdefault(key, {})
+                for col, val in row.items():
+                    if col in ("subid", "sesid") or val in (None, ""):
+                        continue
+                    old = target.get(col, "")
+                    if old and old != val:
+                        conflicts += 1
+                        print(f"[WARN] {key[0]} {key[1]} {col}: {old} -> {val} ({path})")
+                    target[col] = val
+    return columns, merged, conflicts
+
+
+def main() -> None:
+    args = parse_args()
+    paths = expand_inputs(args.inputs)
+    columns, merged, conflicts = merge_ratings(paths)
+
+    with open(args.out, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["subid", "sesid", *columns])
+        for (sub, ses) in sorted(merged):
+            w.writerow([sub, ses, *(merged[(sub, ses)].get(c, "") for c in columns)])
+
+    print(f"Merged {len(paths)} files -> {args.out}")
+    print(f"Rows: {len(merged)} | Conflicts: {conflicts}")
+
+
+if __name__ == "__main__":
+    main()
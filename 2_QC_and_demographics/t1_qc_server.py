@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Local HTTP server for T1 QC ratings (generate_T1_rating_html.py --serve).
+
+Serves the rating page without copying or embedding any images:
+- GET  /                      the rating page (rows are paged in from /api/rows)
+- GET  /api/rows              row metadata as JSON: ?offset=&limit= -> {total, rows}
+- GET  /img/<sub>/<ses>/<view> slice PNG streamed from --root, with ETag/Last-Modified
+- GET  /api/ratings           saved ratings as {"sub|ses": {view: score}}
+- POST /api/ratings           autosave one rating: {sub, ses, view, score}
+- GET  /ratings.csv           all saved ratings in the page's CSV export format
+
+Ratings are written to SQLite on every change, so nothing is lost if the browser
+closes before "Download CSV". Only images collected from --root are served.
+On Ctrl-C or SIGTERM (kill, a job scheduler stopping the job) the ratings are also
+written as a CSV next to the database.
+Standard library only.
+"""
+
+import csv
+import email.utils
+import io
+import json
+import os
+import shutil
+import signal
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple
+from urllib.parse import parse_qs, quote, unquote, urlparse
+
+from generate_T1_rating_html import render_html
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ratings (
+    sub TEXT NOT NULL,
+    ses TEXT NOT NULL,
+    view TEXT NOT NULL,
+    score TEXT NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (sub, ses, view)
+)
+"""
+
+
+class RatingStore:
+    """SQLite-backed ratings; one short-lived connection per call keeps it thread-safe."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)) or ".", exist_ok=True)
+        with self._connect() as con:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def save(self, sub: str, ses: str, view: str, score: str):
+        with self._lock, self._connect() as con:
+            if score == "":
+                con.execute("DELETE FROM ratings WHERE sub=? AND ses=? AND view=?", (sub, ses, view))
+            else:
+                con.execute(
+                    "INSERT INTO ratings VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT(sub, ses, view) DO UPDATE SET score=excluded.score, updated=excluded.updated",
+                    (sub, ses, view, score, time.time()),
+                )
+
+    def all(self) -> Dict[str, Dict[str, str]]:
+        out: Dict[str, Dict[str, str]] = {}
+        with self._connect() as con:
+            for sub, ses, view, score in con.execute("SELECT sub, ses, view, score FROM ratings"):
+                out.setdefault(f"{sub}|{ses}", {})[view] = score
+        return out
+
+
+def make_handler(
+    keys: List[Tuple[str, str]],
+    pairs: Dict[Tuple[str, str], Dict[str, str]],
+    views: List[str],
+    store: RatingStore,
+):
+    page = render_html([], {}, views, None, serve=True, title="T1 QC Ratings").encode("utf-8")
+    valid_views = set(views)
+
+    def image_url(sub: str, ses: str, view: str) -> str:
+        return "img/" + "/".join(quote(x, safe="") for x in (sub, ses, view))
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, fmt, *args):  # keep the terminal quiet; errors still surface
+            pass
+
+        def _send(self, status: int, body: bytes, ctype: str, headers: Dict[str, str] = None):
+            self.send_response(status)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(body)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            if self.command != "HEAD":
+                self.wfile.write(body)
+
+        def _json(self, obj, status: int = 200):
+            self._send(status, json.dumps(obj).encode("utf-8"), "application/json",
+                       {"Cache-Control": "no-store"})
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path in ("/", "/index.html"):
+                return self._send(200, page, "text/html; charset=utf-8", {"Cache-Control": "no-store"})
+            if url.path == "/api/rows":
+                q = parse_qs(url.query)
+                try:
+                    offset = max(0, int(q.get("offset", ["0"])[0]))
+                    limit = max(1, min(10000, int(q.get("limit", ["1000"])[0])))
+                except ValueError:
+                    return self._json({"error": "offset and limit must be integers"}, 400)
+                rows = [
+                    {"sub": sub, "ses": ses,
+                     "images": {v: image_url(sub, ses, v) if v in pairs[(sub, ses)] else "" for v in views}}
+                    for sub, ses in keys[offset:offset + limit]
+                ]
+                return self._json({"total": len(keys), "offset": offset, "rows": rows})
+            if url.path == "/api/ratings":
+                return self._json(store.all())
+            if url.path == "/ratings.csv":
+                return self._send(200, ratings_csv(keys, views, store.all()), "text/csv; charset=utf-8",
+                                  {"Content-Disposition": 'attachment; filename="T1-ratings.csv"'})
+            if url.path.startswith("/img/"):
+                return self._image(url.path[len("/img/"):])
+            self._send(404, b"not found", "text/plain")
+
+        do_HEAD = do_GET
+
+        def _image(self, rest: str):
+            parts = [unquote(p) for p in rest.split("/")]
+            if len(parts) != 3 or parts[2] not in valid_views:
+                return self._send(404, b"not found", "text/plain")
+            src = pairs.get((parts[0], parts[1]), {}).get(parts[2])
+            try:
+                st = os.stat(src) if src else None
+            except OSError:
+                st = None
+            if st is None:
+                return self._send(404, b"not found", "text/plain")
+            etag = f'"{st.st_size:x}-{st.st_mtime_ns:x}"'
+            headers = {
+                "ETag": etag,
+                "Last-Modified": email.utils.formatdate(st.st_mtime, usegmt=True),
+                "Cache-Control": "private, max-age=86400",
+            }
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "image/png")
+            self.send_header("Content-Length", str(st.st_size))
+            for k, v in headers.items():
+                self.send_header(k, v)
+            self.end_headers()
+            if self.command != "HEAD":
+                with open(src, "rb") as f:
+                    shutil.copyfileobj(f, self.wfile)
+
+        def do_POST(self):
+            if urlparse(self.path).path != "/api/ratings":
+                return self._send(404, b"not found", "text/plain")
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", "0"))))
+                sub, ses, view = str(body["sub"]), str(body["ses"]), str(body["view"])
+                score = "" if body.get("score") is None else str(body["score"])
+            except (ValueError, KeyError, TypeError):
+                return self._json({"error": "expected JSON {sub, ses, view, score}"}, 400)
+            if (sub, ses) not in pairs or view not in valid_views:
+                return self._json({"error": "unknown row or view"}, 400)
+            store.save(sub, ses, view, score)
+            self._json({"ok": True})
+
+    return Handler
+
+
+def ratings_csv(keys: List[Tuple[str, str]], views: List[str], saved: Dict[str, Dict[str, str]]) -> bytes:
+    """Same layout as the page's client-side export: subid, sesid, <VIEW>_score..."""
+    buf = io.StringIO()
+    w = csv.writer(buf, lineterminator="\n")
+    w.writerow(["subid", "sesid", *(f"{v}_score" for v in views)])
+    for sub, ses in keys:
+        scores = saved.get(f"{sub}|{ses}", {})
+        w.writerow([sub, ses, *(scores.get(v, "") for v in views)])
+    return buf.getvalue().encode("utf-8")
+
+
+def serve(
+    keys: List[Tuple[str, str]],
+    pairs: Dict[Tuple[str, str], Dict[str, str]],
+    views: List[str],
+    db_path: str,
+    host: str = "127.0.0.1",
+    port: int = 8765,
+):
+    store = RatingStore(db_path)
+    server = ThreadingHTTPServer((host, port), make_handler(keys, pairs, views, store))
+    print(f"Serving {len(keys)} rows on http://{host}:{server.server_port}/ (Ctrl-C to stop)")
+    print(f"Ratings autosave to: {db_path}")
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt    # kill / scheduler stop: shut down like Ctrl-C, so the snapshot is written
+
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, stop)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        csv_path = os.path.splitext(db_path)[0] + ".csv"
+        with open(csv_path, "wb") as f:
+            f.write(ratings_csv(keys, views, store.all()))
+        print(f"\nWrote ratings snapshot: {csv_path}")
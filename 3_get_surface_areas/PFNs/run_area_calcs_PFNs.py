@@ -1,63 +1,164 @@
-from concurrent.futures import ProcessPoolExecutor, as_completed
-import re
+import argparse
 from pathlib import Path
-import os, json
-from area_calc_functions import process_subject
+import os, sys, json, tarfile
+from area_calc_functions import (DEFAULT_STATS, NETWORK_STATS, CohortAggregate, find_surface_jobs, parse_mem,
+                                 network_shape, plan_memory, plan_run, print_plan, read_groups, run_pipeline, use_common)
 
 
-surf_dir = Path("/cbica/projects/bbl_22q/data/derivatives_2025/PNC_fsLR_32k_midthickness")
-roi_dir  = Path("/cbica/projects/bbl_22q/analysis/allometry/inputs")
-net_dir  = Path("/cbica/projects/bbl_22q/analysis/allometry/inputs/PNC_PFN_loadings_normed")
-deriv_dir  = Path("/cbica/projects/bbl_22q/analysis/allometry/outputs/PNC_areas")
-deriv_dir.mkdir(parents=True, exist_ok=True)
+ap = argparse.ArgumentParser(description="Per-subject surface areas of the TC ROI and each network.")
+ap.add_argument("--surf-dir", default="/cbica/projects/bbl_22q/data/derivatives_2025/PNC_fsLR_32k_midthickness",
+                help="Directory of surfaces, or a BABS zip archive / directory of them")
+ap.add_argument("--surf-cache", default=None,
+                help="Where surfaces are extracted from zip inputs (default: <deriv-dir>/surf_cache)")
+ap.add_argument("--surfaces", nargs="+", default=["midthickness"],
+                help="Surface types to measure area on, e.g. midthickness white pial; the loadings are read once "
+                     "for all of them. The first is the primary surface of the summary (default: midthickness)")
+ap.add_argument("--roi-dir", default="/cbica/projects/bbl_22q/analysis/allometry/inputs")
+ap.add_argument("--net-dir", default="/cbica/projects/bbl_22q/analysis/allometry/inputs/PNC_PFN_loadings_normed")
+ap.add_argument("--deriv-dir", default="/cbica/projects/bbl_22q/analysis/allometry/outputs/PNC_areas")
+ap.add_argument("--store", default=None,
+                help="Cohort PFN store (common/pfn_store.py) to read loadings from instead of --net-dir")
+ap.add_argument("--index", default=None,
+                help="Shared SQLite file index (common/bids_index.py) to query instead of globbing --surf-dir")
+ap.add_argument("--stats", nargs="+", choices=list(NETWORK_STATS), default=list(DEFAULT_STATS),
+                help="Per-network statistics: SUM is the network-areas TSV, the others are columns of a separate "
+                     "network_stats TSV (default: SUM)")
+ap.add_argument("--regions", default=None,
+                help="Optional hard-parcel .dlabel.nii (same grayordinates as the area map) for per-region areas")
+ap.add_argument("--scratch", nargs="?", const=os.environ.get("TMPDIR", "/tmp"), default=None,
+                help="Write per-subject intermediates to node-local scratch (default with no value: $TMPDIR) "
+                     "and publish only finished subjects to --deriv-dir")
+ap.add_argument("--publish", choices=["move", "archive"], default="move",
+                help="With --scratch: rename files into --deriv-dir, or write one tar per subject (default: move)")
+ap.add_argument("--workers", type=int, default=8, help="Compute processes (default: %(default)s)")
+ap.add_argument("--mem-budget", default=None,
+                help="Total memory for the run, e.g. 32G (as in the sbatch --mem): vertices are processed in "
+                     "chunks sized to fit, and --workers is lowered if needed")
+ap.add_argument("--io-threads", type=int, default=4,
+                help="Threads prefetching the next subjects' surfaces and loadings (default: %(default)s)")
+ap.add_argument("--prefetch-depth", type=int, default=None,
+                help="Max subjects prefetched but not yet written (default: 2 x --workers)")
+ap.add_argument("--plan", action="store_true",
+                help="Dry run: report subjects to compute or skip, bytes in/out and the wall time estimated "
+                     "from the per-subject timings of the last run, then exit")
+ap.add_argument("--aggregate", default=None,
+                help="Directory for cohort maps: per-vertex mean and variance of the area and weighted-area maps, "
+                     "updated as each subject completes and merged across shards (runs) writing to it")
+ap.add_argument("--aggregate-shard", default=None,
+                help="Name of this run's state in --aggregate; rerunning a shard replaces it (default: --deriv-dir name)")
+ap.add_argument("--groups", default=None,
+                help="Demographics CSV: also aggregate (and sum) per group, e.g. 22q vs PNC")
+ap.add_argument("--group-col", default="group", help="Group column of --groups (default: %(default)s)")
+ap.add_argument("--sub-col", default="participant_id", help="Subject column of --groups (default: %(default)s)")
+ap.add_argument("--no-weighted-maps", dest="weighted_maps", action="store_false",
+                help="Do not write a weighted-area dscalar per subject and network (e.g. with --aggregate)")
+args = ap.parse_args()
+
+surf_dir = Path(args.surf_dir)
+roi_dir  = Path(args.roi_dir)
+net_dir  = Path(args.net_dir)
+deriv_dir  = Path(args.deriv_dir)
+if not args.plan:
+    deriv_dir.mkdir(parents=True, exist_ok=True)
 
 # Discover unique (sub, ses, acq, den) from L-hemi files
-pat = re.compile(
-    r"^sub-(?P<sub>[^_]+)"
-    r"(?:_ses-(?P<ses>[^_]+))?"
-    r"(?:_acq-(?P<acq>[^_]+))?"
-    r"_hemi-L_space-fsLR_den-(?P<den>[^_]+)_midthickness\.surf\.gii$"
-)
-job_keys = []
-for f in surf_dir.glob("sub-*_hemi-L_space-fsLR_den-*_midthickness.surf.gii"):
-    m = pat.match(f.name)
-    if not m:
-        continue
-    job_keys.append( (m["sub"], m["ses"] or "PNC1", m["acq"] or "refaced", m["den"] or "32k") )
-job_keys = sorted(set(job_keys))
+surf_cache = Path(args.surf_cache) if args.surf_cache else deriv_dir / "surf_cache"
+archived = {}    # with --plan: surfaces still inside zip archives, sized there
+surf_dir, job_keys = find_surface_jobs(surf_dir, index=args.index, cache_dir=surf_cache,
+                                       surfaces=args.surfaces, extract_members=not args.plan, archived=archived)
+
+store = None
+if args.store:
+    use_common()
+    from pfn_store import PfnStore
+    store = PfnStore(args.store)
 
 results, failures = [], {}
-with ProcessPoolExecutor(max_workers=min(8, len(job_keys))) as ex:
-    futs = {}   # map Future -> (sub, ses, acq, den)
-    for (sub, ses, acq, den) in job_keys:
-        sub_net_dir = net_dir / f"sub-{sub}"
-        if not sub_net_dir.exists():    # Check if PFNs for subject exist by checking existence of subject dir within net_dir
-            failures[str((sub, ses, acq, den))] = f"Missing net_dir: {sub_net_dir}"
-            print(f"[SKIP] sub-{sub}: PFN dir ({sub_net_dir}) not found")
+jobs = []   # (sub, ses, acq, den) -> process_subject kwargs
+for (sub, ses, acq, den) in job_keys:
+    sub_net_dir = net_dir / f"sub-{sub}"
+    if store is not None:
+        try:
+            store.row(sub, ses)
+        except KeyError as e:
+            failures[str((sub, ses, acq, den))] = f"Not in PFN store: {e}"
+            print(f"[SKIP] sub-{sub}: not in PFN store ({e})")
             continue
-        fut = ex.submit(process_subject, sub, surf_dir, roi_dir, sub_net_dir, deriv_dir,    # Submit process_subject for this subject
-                    ses=ses, acq=acq, density=den, atlas="PFN",)    # atlas is defined as "PFN" string
-        futs[fut] = (sub, ses, acq, den)
+    elif not sub_net_dir.exists():    # Check if PFNs for subject exist by checking existence of subject dir within net_dir
+        failures[str((sub, ses, acq, den))] = f"Missing net_dir: {sub_net_dir}"
+        print(f"[SKIP] sub-{sub}: PFN dir ({sub_net_dir}) not found")
+        continue
+    jobs.append(((sub, ses, acq, den), dict(sub=sub, surf_dir=surf_dir, roi_dir=roi_dir, net_dir=sub_net_dir,
+                                            deriv_dir=deriv_dir, ses=ses, acq=acq, density=den,
+                                            atlas="PFN", stats=tuple(args.stats), regions=args.regions,
+                                            scratch_dir=args.scratch, publish=args.publish,
+                                            surfaces=tuple(args.surfaces), store=args.store,
+                                            weighted_maps=args.weighted_maps, return_maps=bool(args.aggregate))))    # atlas is defined as "PFN" string
 
-    for fut in as_completed(futs):
-        key = futs[fut]
-        try:
-            results.append(fut.result())
-            print(f"[OK] sub-{key[0]} ses-{key[1]} den-{key[3]}")
-        except Exception as e:
-            failures[str(key)] = str(e)
-            print(f"[FAIL] sub-{key}: {e}")
+aggregate = None
+if args.aggregate:
+    aggregate = CohortAggregate(read_groups(args.groups, args.group_col, args.sub_col) if args.groups else None)
+
+workers = args.workers
+if args.mem_budget and jobs:
+    n_net, n_vert = network_shape(jobs[0][1]["net_dir"], store=store)
+    # Cohort maps are kept per (density, surface, group); every subject is also in group "all"
+    n_groups = 1 + len(set(aggregate.groups.values())) if aggregate is not None and aggregate.groups else 1
+    n_aggregates = len({key[3] for key, _ in jobs}) * len(args.surfaces) * n_groups
+    workers, chunk = plan_memory(parse_mem(args.mem_budget), args.workers, n_net, len(args.surfaces), n_vert,
+                                 return_maps=aggregate is not None, depth=args.prefetch_depth,
+                                 n_aggregates=n_aggregates)
+    for _, kwargs in jobs:
+        kwargs["chunk_vertices"] = chunk
+    print(f"Memory budget {args.mem_budget}: {workers} workers, {chunk} vertices per chunk ({n_net} networks)")
+
+if args.plan:
+    print_plan(plan_run(jobs, workers, history=deriv_dir / "summary_PFNs.json", archived=archived), skipped=len(failures))
+    sys.exit(0)
+
+# Prefetch threads read upcoming subjects' inputs while the pool computes; stats TSVs go through one writer thread
+for key, result, error in run_pipeline(jobs, workers=workers, io_threads=args.io_threads,
+                                       depth=args.prefetch_depth):
+    if error is None:
+        if aggregate is not None:    # fold the subject's maps in and drop them
+            try:
+                CohortAggregate.keep_template(result, deriv_dir, args.aggregate)
+                aggregate.add(result)
+            except (OSError, ValueError, KeyError, tarfile.TarError) as e:
+                failures[str(key)] = f"Not aggregated: {e}"
+                print(f"[FAIL] sub-{key}: not aggregated: {e}")
+            else:
+                if args.groups and result["subject"] not in aggregate.groups:
+                    print(f"[WARN] sub-{result['subject']}: not in {args.groups}, only in group 'all'")
+            for k in ("maps", "map_names", "area_map"):
+                result.pop(k)
+        results.append(result)
+        print(f"[OK] sub-{key[0]} ses-{key[1]} den-{key[3]}")
+    else:
+        failures[str(key)] = str(error)
+        print(f"[FAIL] sub-{key}: {error}")
 print(f"Ran {len(results)} subjects, skipped {len(failures)}.")
 
 # Save summary CSV/JSON
 (deriv_dir / "summary_PFNs.json").write_text(json.dumps(results, indent=2))
 
+# Cohort maps over every shard saved so far, this one included
+if aggregate is not None:
+    state = aggregate.save(args.aggregate, args.aggregate_shard or deriv_dir.resolve().name)
+    cohort = CohortAggregate.merge_dir(args.aggregate)
+    written = cohort.write(args.aggregate, atlas="PFN", sums=bool(args.groups))
+    print(f"[DONE] Cohort maps of {len(cohort.subjects)} subjects ({state.name} + other shards): {len(written)} files in {args.aggregate}")
+
 try:
     import pandas as pd
     rows = []
     for r in results:
         row = {"subject": r["subject"], "TC_area": r["TC_area"]}
         row.update(r["network_areas"])
+        row.update(TC_area_L=r["TC_area_L"], TC_area_R=r["TC_area_R"])    # after the networks: Rmds index network columns by position
+        for surf, s in list(r["surfaces"].items())[1:]:    # extra surfaces last, suffixed _<surface>
+            row.update({f"{k}_{surf}": s[k] for k in ("TC_area", "TC_area_L", "TC_area_R")})
+            row.update({f"{k}_{surf}": v for k, v in s["network_areas"].items()})
         rows.append(row)
     df = pd.DataFrame(rows).set_index("subject").sort_index()
     df.to_csv(deriv_dir/"summary_PFNs.csv")
@@ -1,7 +1,87 @@
 from __future__ import annotations
-import subprocess, shutil, os
+import subprocess, shutil, os, re, sys, queue, threading, tarfile, tempfile, time, json
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
 import csv
+import numpy as np
+
+# L-hemisphere midthickness surfaces define the jobs: one per (sub, ses, acq, den)
+SURF_GLOB = "sub-*_hemi-L_space-fsLR_den-*_midthickness.surf.gii"
+SURF_RE = re.compile(
+    r"^sub-(?P<sub>[^_]+)"
+    r"(?:_ses-(?P<ses>[^_]+))?"
+    r"(?:_acq-(?P<acq>[^_]+))?"
+    r"_hemi-L_space-fsLR_den-(?P<den>[^_]+)_midthickness\.surf\.gii$"
+)
+
+def use_common():
+    """Make the shared modules in ../common importable (a flat deployment needs nothing)."""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "common")
+    if path not in sys.path:
+        sys.path.append(path)
+
+# Header parsing and memory-mapped reads of CIFTI maps, shared with the rest of the pipeline
+use_common()
+from cifti_io import CiftiFile, DscalarBlockWriter, load_labels, open_dscalar, write_dscalar_like
+
+def find_surface_jobs(surf_dir: Path, index: str | None = None, cache_dir: Path | None = None,
+                      surfaces=("midthickness",), extract_members: bool = True, archived: dict | None = None):
+    """
+    Return (surf_dir, sorted job keys (sub, ses, acq, den)) from the L-hemi surfaces
+    of the first surface type in surfaces.
+
+    surf_dir may be a flat directory of surfaces (optionally listed through the shared
+    SQLite index), or a BABS zip / directory of zips: then only the L and R members
+    of the requested surface types are extracted, flat, into cache_dir (reused while
+    the archive is unchanged), and cache_dir is returned as the surf_dir to use.
+    extract_members=False only lists the jobs (e.g. for a --plan dry run); cache_dir is
+    still returned, and a dict passed as archived is filled with {cache path: member
+    path} for the surfaces not extracted yet, for plan_run to size them in the archive.
+    """
+    use_common()
+    from bids_zip import extract, find_members, is_archive_root
+    surf_glob = SURF_GLOB.replace("midthickness", surfaces[0])
+    surf_re = re.compile(SURF_RE.pattern.replace("midthickness", re.escape(surfaces[0])))
+    members = {}
+    if is_archive_root(surf_dir):
+        if cache_dir is None:
+            raise ValueError("cache_dir is required when surf_dir holds zip archives")
+        for surf in surfaces:
+            for hemi in ("L", "R"):
+                pattern = SURF_GLOB.replace("hemi-L", f"hemi-{hemi}").replace("midthickness", surf)
+                for m in find_members(surf_dir, pattern):
+                    members[m.rsplit("/", 1)[-1]] = m
+        names = [n for n in members if "_hemi-L_" in n and n.endswith(f"_{surfaces[0]}.surf.gii")]
+    elif index:
+        from bids_index import indexed_glob
+        names = [p.name for p in indexed_glob(index, surf_dir, surf_glob, recursive=False)]
+    else:
+        names = [p.name for p in Path(surf_dir).glob(surf_glob)]
+
+    job_keys = []
+    for name in names:
+        m = surf_re.match(name)
+        if not m:
+            continue
+        job_keys.append( (m["sub"], m["ses"] or "PNC1", m["acq"] or "refaced", m["den"] or "32k") )
+    job_keys = sorted(set(job_keys))
+
+    if members:
+        cache_dir = Path(cache_dir)
+        for name_l in names:
+            for surf in surfaces:
+                name_s = name_l.replace(f"_{surfaces[0]}.surf.gii", f"_{surf}.surf.gii")
+                for name in (name_s, name_s.replace("_hemi-L_", "_hemi-R_")):
+                    if name not in members:
+                        continue
+                    if extract_members:
+                        extract(members[name], str(cache_dir / name))
+                    elif archived is not None and not (cache_dir / name).exists():
+                        archived[cache_dir / name] = members[name]
+        if extract_members:
+            print(f"Extracted/reused {len(job_keys)} subjects' surfaces from archives in {cache_dir}")
+        return cache_dir, job_keys
+    return Path(surf_dir), job_keys
 
 def subject_dir(deriv: Path, sub: str, ses: str | None) -> Path:
     d = deriv / f"sub-{sub}"
@@ -18,17 +98,25 @@ def atlas_dir(deriv: Path, sub: str, ses: str | None, atlas: str) -> Path:
 def stats_dir(deriv: Path, sub: str, ses: str | None) -> Path:
     return subject_dir(deriv, sub, ses) / "stats"
 
-def name_vertex_area_metric(sub, ses, den, hemi):
+def name_surface(sub, ses, acq, den, hemi, surf="midthickness"):
     ses_ent = f"_ses-{ses}" if ses else ""
-    return f"sub-{sub}{ses_ent}_space-fsLR_den-{den}_hemi-{hemi}_vertex_area_metric.func.gii"
+    return f"sub-{sub}{ses_ent}_acq-{acq}_hemi-{hemi}_space-fsLR_den-{den}_{surf}.surf.gii"
+
+def _surf_ent(surf):
+    # Midthickness outputs keep their original names; other surfaces are tagged desc-<surf>
+    return "" if surf == "midthickness" else f"_desc-{surf}"
 
-def name_vertex_area_dscalar(sub, ses, den):
+def name_vertex_area_metric(sub, ses, den, hemi, surf="midthickness"):
     ses_ent = f"_ses-{ses}" if ses else ""
-    return f"sub-{sub}{ses_ent}_space-fsLR_den-{den}_vertex_area_map.dscalar.nii"
+    return f"sub-{sub}{ses_ent}_space-fsLR_den-{den}_hemi-{hemi}{_surf_ent(surf)}_vertex_area_metric.func.gii"
 
-def name_weighted_map(sub, ses, den, atlas, net):
+def name_vertex_area_dscalar(sub, ses, den, surf="midthickness"):
     ses_ent = f"_ses-{ses}" if ses else ""
-    return f"sub-{sub}{ses_ent}_space-fsLR_den-{den}_atlas-{atlas}_net-{net}_weightedarea_map.dscalar.nii"
+    return f"sub-{sub}{ses_ent}_space-fsLR_den-{den}{_surf_ent(surf)}_vertex_area_map.dscalar.nii"
+
+def name_weighted_map(sub, ses, den, atlas, net, surf="midthickness"):
+    ses_ent = f"_ses-{ses}" if ses else ""
+    return f"sub-{sub}{ses_ent}_space-fsLR_den-{den}_atlas-{atlas}_net-{net}{_surf_ent(surf)}_weightedarea_map.dscalar.nii"
 
 def name_total_cortex_area_tsv(sub, ses, den):
     ses_ent = f"_ses-{ses}" if ses else ""
@@ -38,16 +126,71 @@ def name_network_areas_tsv(sub, ses, den, atlas):
     ses_ent = f"_ses-{ses}" if ses else ""
     return f"sub-{sub}{ses_ent}_space-fsLR_den-{den}_atlas-{atlas}_network_areas_stat-SUM.tsv"
 
+def name_network_stats_tsv(sub, ses, den, atlas):
+    ses_ent = f"_ses-{ses}" if ses else ""
+    return f"sub-{sub}{ses_ent}_space-fsLR_den-{den}_atlas-{atlas}_network_stats.tsv"
+
+def name_region_areas_tsv(sub, ses, den, atlas, parc):
+    ses_ent = f"_ses-{ses}" if ses else ""
+    return f"sub-{sub}{ses_ent}_space-fsLR_den-{den}_atlas-{atlas}_parc-{parc}_region_areas_stat-SUM.tsv"
+
+def name_subject_archive(sub, ses, den, atlas):
+    ses_ent = f"_ses-{ses}" if ses else ""
+    return f"sub-{sub}{ses_ent}_space-fsLR_den-{den}_atlas-{atlas}_maps.tar"
+
 def write_tsv(path: Path, rows: list[dict]):
     path.parent.mkdir(parents=True, exist_ok=True)
     if not rows:
         return
     fieldnames = list(rows[0].keys())
-    with path.open("w", newline="") as f:
+    tmp = path.with_name(f".{path.name}.tmp{os.getpid()}")    # rename into place: readers never see a partial TSV
+    with tmp.open("w", newline="") as f:
         w = csv.DictWriter(f, delimiter="\t", fieldnames=fieldnames)
         w.writeheader()
         for r in rows:
             w.writerow(r)
+    os.replace(tmp, path)
+
+def publish_outputs(work: Path, deriv_dir: Path, mode: str = "move", archive: Path | None = None) -> list[Path]:
+    """
+    Publish the files of a scratch tree (laid out like deriv_dir) into deriv_dir.
+
+    mode="move": one bulk copy into a hidden staging dir inside deriv_dir (same filesystem),
+    then an atomic os.replace of each file into its final place.
+    mode="archive": one uncompressed tar of the whole tree, renamed into place at `archive`.
+    Either way, no partially written file ever appears under its final name.
+    """
+    files = sorted(p for p in Path(work).rglob("*") if p.is_file())
+    if not files:
+        return []
+    if mode == "archive":
+        archive = Path(archive)
+        archive.parent.mkdir(parents=True, exist_ok=True)
+        tmp = archive.with_name(f".{archive.name}.tmp{os.getpid()}")
+        with tarfile.open(tmp, "w") as tf:
+            for p in files:
+                tf.add(p, arcname=str(p.relative_to(work)))
+        os.replace(tmp, archive)
+        return [archive]
+    if mode != "move":
+        raise ValueError(f"Unknown publish mode: {mode}")
+    deriv_dir.mkdir(parents=True, exist_ok=True)
+    staging = Path(tempfile.mkdtemp(prefix=".publish_", dir=deriv_dir))
+    try:
+        for p in files:
+            dst = staging / p.relative_to(work)
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(p, dst)
+        published = []
+        for p in files:
+            rel = p.relative_to(work)
+            final = deriv_dir / rel
+            final.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(staging / rel, final)
+            published.append(final)
+        return published
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
 
 def _resolve_wb(wb_command: str | None = None) -> str:
     if wb_command:
@@ -90,6 +233,133 @@ def cifti_math(expr: str, out_dscalar: Path, wb_command: str | None = None, **va
     args += [out_dscalar]
     run_wb(*args, wb_command=wb_command)
 
+# ---------- in-memory reductions ----------
+
+# Per-network statistics, computed in one pass over the area vector and loading matrix.
+# Keys are the names accepted by process_subject(stats=...); values are the TSV columns.
+# SUM (the network area) is always reported, in the stat-SUM TSV; the others go to a
+# separate network_stats TSV.
+NETWORK_STATS = {
+    "SUM": ("area",),
+    "EFFECTIVE_VERTICES": ("effective_vertices",),   # (sum w)^2 / sum w^2
+    "MEAN_LOADING": ("mean_loading",),               # mean w over cortical vertices
+    "ENTROPY": ("area_entropy",),                    # entropy (nats) of area*w normalized over vertices
+    "HEMI_SHARE": ("share_L", "share_R"),            # fraction of the network area in each hemisphere
+    "HEMI_AREA": ("area_L", "area_R"),               # network area in each hemisphere
+}
+DEFAULT_STATS = ("SUM",)
+
+def new_network_accumulator(n_net: int) -> dict:
+    return {k: np.zeros(n_net) for k in ("n", "w", "w2", "x", "xp", "xlogx", "x_L", "x_R")}
+
+def accumulate_network_stats(acc: dict, area: np.ndarray, loadings: np.ndarray, hemi: np.ndarray) -> dict:
+    """
+    Add a block of vertices to acc: area (v,), loadings (n_net, v), hemi (v,) codes.
+    Sums are float64 whatever the input dtype, so blocks can be accumulated in any order.
+    """
+    a = np.asarray(area, dtype=np.float64)
+    W = np.asarray(loadings, dtype=np.float64)
+    x = W * a                                   # per-vertex weighted area
+    xp = np.clip(x, 0.0, None)                  # entropy is defined on the non-negative part
+    acc["n"] += W.shape[1]
+    acc["w"] += W.sum(axis=1)
+    acc["w2"] += np.einsum("ij,ij->i", W, W)
+    acc["x"] += x.sum(axis=1)
+    acc["xp"] += xp.sum(axis=1)
+    acc["xlogx"] += (xp * np.log(np.where(xp > 0, xp, 1.0))).sum(axis=1)
+    acc["x_L"] += x[:, hemi == 0].sum(axis=1)
+    acc["x_R"] += x[:, hemi == 1].sum(axis=1)
+    return acc
+
+def finalize_network_stats(acc: dict, stats=DEFAULT_STATS) -> list[dict]:
+    """One {column: value} dict per network, for the requested stats (SUM always included)."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        values = {
+            "area": acc["x"],
+            "effective_vertices": acc["w"] ** 2 / acc["w2"],
+            "mean_loading": acc["w"] / acc["n"],
+            # H = -sum p log p with p = xp / Sp  ==  log Sp - sum(xp log xp) / Sp
+            "area_entropy": np.log(acc["xp"]) - acc["xlogx"] / acc["xp"],
+            "share_L": acc["x_L"] / acc["x"],
+            "share_R": acc["x_R"] / acc["x"],
+            "area_L": acc["x_L"],
+            "area_R": acc["x_R"],
+        }
+    columns = ["area"] + [c for s in stats if s != "SUM" for c in NETWORK_STATS[s]]
+    return [{c: float(values[c][i]) for c in columns} for i in range(acc["x"].size)]
+
+def region_index(keys: np.ndarray):
+    """Compact region index per grayordinate (-1 for the unlabeled key 0) and the region keys in order."""
+    regions = np.unique(keys[keys != 0])
+    idx = np.searchsorted(regions, keys)
+    idx[keys == 0] = -1
+    return idx, regions
+
+def region_sums(area: np.ndarray, loadings: np.ndarray, idx: np.ndarray, n_regions: int):
+    """
+    Area per region (n_regions,) and weighted network area per region (n_net, n_regions)
+    via bincount over flattened (network, region) bins. Additive over vertex blocks.
+    """
+    keep = idx >= 0
+    a = np.asarray(area, dtype=np.float64)[keep]
+    r = idx[keep]
+    tc = np.bincount(r, weights=a, minlength=n_regions)
+    W = np.asarray(loadings, dtype=np.float64)[:, keep]
+    bins = (np.arange(W.shape[0])[:, None] * n_regions + r[None, :]).ravel()
+    net = np.bincount(bins, weights=(W * a).ravel(), minlength=W.shape[0] * n_regions)
+    return tc, net.reshape(W.shape[0], n_regions)
+
+# ---------- memory budget ----------
+
+WORKER_BASE_BYTES = 512 << 20   # interpreter + nibabel, and wb_command's own whole-map buffers
+DRIVER_BASE_BYTES = 1 << 30     # driver process: interpreter, prefetch/writer threads, results and summary rows
+MIN_CHUNK_VERTICES = 16384
+
+def parse_mem(text: str) -> int:
+    """Bytes from a size like 32G, 1500M, 64000K or a plain byte count (as in sbatch --mem)."""
+    text = str(text).strip().upper().rstrip("B")
+    scale = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}.get(text[-1:], 1)
+    return int(float(text[:-1] if scale > 1 else text) * scale)
+
+def bytes_per_vertex(n_net: int, n_surf: int = 1) -> int:
+    # float32 block storage (one area per surface + loadings + their product for the weighted maps)
+    # + float64 temporaries in the accumulators (surfaces are reduced one after another, so
+    # those are not multiplied)
+    return 4 * (2 * n_net + n_surf) + 8 * 4 * max(n_net, 1)
+
+def map_bytes(n_net: int, n_surf: int, n_vertices: int) -> int:
+    """Full-length float32 maps of one subject with return_maps: area + one per network, per surface."""
+    return 4 * (n_net + 1) * n_surf * n_vertices
+
+def plan_memory(budget: int, workers: int, n_net: int, n_surf: int = 1, n_vertices: int = 0,
+                return_maps: bool = False, depth: int | None = None, n_aggregates: int = 0) -> tuple[int, int]:
+    """
+    (workers, chunk_vertices) that fit budget bytes in total. The driver's share is
+    reserved first: DRIVER_BASE_BYTES and, with return_maps, the results in flight
+    (up to depth, default 2 * workers, as in run_pipeline) and the float64 mean/M2 of
+    n_aggregates cohort maps (CohortAggregate). Each worker needs WORKER_BASE_BYTES, its
+    full-length maps with return_maps, and bytes_per_vertex per vertex of its chunk:
+    fewer workers if even the smallest chunk would not fit, then the largest chunk
+    each worker can afford.
+    """
+    bpv = bytes_per_vertex(n_net, n_surf)
+    maps = map_bytes(n_net, n_surf, n_vertices) if return_maps else 0
+    cohort = 2 * 8 * (n_net + 1) * n_vertices * n_aggregates + 2 * maps if return_maps else 0
+    for workers in range(max(1, workers), 0, -1):
+        driver = DRIVER_BASE_BYTES + (depth or 2 * workers) * maps + cohort
+        per_worker = (budget - driver) // workers
+        if per_worker >= WORKER_BASE_BYTES + maps + MIN_CHUNK_VERTICES * bpv:
+            break
+    chunk = max(MIN_CHUNK_VERTICES, (per_worker - WORKER_BASE_BYTES - maps) // bpv)
+    return int(workers), int(chunk)
+
+def network_shape(net_dir, net_glob: str = "*.dscalar.nii", store=None) -> tuple[int, int]:
+    """(networks, grayordinates) of the loadings, from the PFN store or the first dscalar's header."""
+    if store is not None:
+        return len(store.networks), store.n_vertices
+    nets = sorted(Path(net_dir).glob(net_glob))
+    return len(nets), (CiftiFile(nets[0]).shape[1] if nets else 0)
+
 def process_subject(
     sub: str,
     surf_dir: Path,
@@ -104,58 +374,647 @@ def process_subject(
     acq: str = "refaced",
     density: str = "32k",
     atlas: str = "PNC_group",       # <- atlas label for filenames, default is "PNC_group" but can be overwritten
+    defer_writes: bool = False,     # return the stats TSV rows under "tables" instead of writing them (see run_pipeline; not with scratch_dir)
+    stats=DEFAULT_STATS,            # per-network statistics; non-SUM ones go to a network_stats TSV (see NETWORK_STATS)
+    regions: str | Path | None = None,  # optional hard-parcel .dlabel.nii for per-region areas
+    chunk_vertices: int | None = None,  # process vertices in blocks of this size (see plan_memory); None = one block
+    scratch_dir: str | Path | None = None,  # write intermediates here (e.g. node-local $TMPDIR), then publish
+    publish: str = "move",          # with scratch_dir: "move" files into deriv_dir, or one per-subject "archive"
+    store: str | Path | None = None,  # cohort PFN store (common/pfn_store.py) to read loadings from instead of net_dir
+    surfaces=("midthickness",),     # surface types (e.g. midthickness, white, pial), reduced in one pass over the loadings
+    weighted_maps: bool = True,     # write a weighted-area dscalar per network and surface
+    return_maps: bool = False,      # return the area and weighted-area maps under "maps" (see CohortAggregate)
 ):
-    # Resolve BIDS-like directories
-    ANAT = anat_dir(deriv_dir, sub, ses); ANAT.mkdir(parents=True, exist_ok=True)
-    ATLS = atlas_dir(deriv_dir, sub, ses, atlas); ATLS.mkdir(parents=True, exist_ok=True)
-    STATS = stats_dir(deriv_dir, sub, ses); STATS.mkdir(parents=True, exist_ok=True)
+    unknown = set(stats) - set(NETWORK_STATS)
+    if unknown:
+        raise ValueError(f"Unknown stats: {sorted(unknown)}; choose from {list(NETWORK_STATS)}")
+    t0 = time.perf_counter()
+    archived = archived_outputs(sub, deriv_dir, ses=ses, density=density, atlas=atlas, scratch_dir=scratch_dir,
+                                publish=publish)
+    reused = all(p.exists() or p in archived
+                 for p in expected_outputs(sub, deriv_dir, net_dir, ses=ses, density=density, atlas=atlas,
+                                           net_glob=net_glob, regions=regions, store=store,
+                                           surfaces=surfaces, weighted_maps=weighted_maps, stats=stats))
+    if scratch_dir is None:
+        result = _process_subject(sub, surf_dir, roi_dir, net_dir, Path(deriv_dir), None, roi_l, roi_r, wb_command,
+                                  net_glob, ses, acq, density, atlas, defer_writes, stats, regions, chunk_vertices, store,
+                                  surfaces, weighted_maps, return_maps)
+    else:
+        # Intermediates go to a private scratch tree laid out like deriv_dir; only a finished subject is published
+        Path(scratch_dir).mkdir(parents=True, exist_ok=True)
+        work = Path(tempfile.mkdtemp(prefix=f"sub-{sub}_", dir=scratch_dir))
+        archive = subject_dir(Path(deriv_dir), sub, ses) / name_subject_archive(sub, ses, density, atlas)
+        try:
+            if archived:
+                # The new archive replaces the old one: start from its maps, so only missing ones are computed
+                with tarfile.open(archive) as tf:
+                    tf.extractall(work, **({"filter": "data"} if hasattr(tarfile, "data_filter") else {}))
+            result = _process_subject(sub, surf_dir, roi_dir, net_dir, Path(deriv_dir), work, roi_l, roi_r, wb_command,
+                                      net_glob, ses, acq, density, atlas, defer_writes, stats, regions, chunk_vertices,
+                                      store, surfaces, weighted_maps, return_maps)
+            write_outputs(result)    # stats TSVs are staged with the maps, never written past the scratch tree
+            published = publish_outputs(work, Path(deriv_dir), publish, archive)
+            result["published"] = [str(p) for p in published]
+        finally:
+            shutil.rmtree(work, ignore_errors=True)
 
-    # Input surface paths
-    ses_ent = f"_ses-{ses}" if ses else ""
-    surf_l = Path(surf_dir) / f"sub-{sub}{ses_ent}_acq-{acq}_hemi-L_space-fsLR_den-{density}_midthickness.surf.gii"
-    surf_r = Path(surf_dir) / f"sub-{sub}{ses_ent}_acq-{acq}_hemi-R_space-fsLR_den-{density}_midthickness.surf.gii"
+    # Kept in the summary JSON: plan_run estimates the next run's wall time from these
+    result["seconds"] = round(time.perf_counter() - t0, 3)
+    result["reused_outputs"] = reused
+    return result
+
+def _process_subject(sub, surf_dir, roi_dir, net_dir, deriv_dir, work, roi_l, roi_r, wb_command,
+                     net_glob, ses, acq, density, atlas, defer_writes, stats, regions, chunk_vertices, store,
+                     surfaces, weighted_maps, return_maps):
+    # Resolve BIDS-like directories; with a scratch tree (work), intermediates are written there
+    ANAT = anat_dir(deriv_dir, sub, ses)
+    ATLS = atlas_dir(deriv_dir, sub, ses, atlas)
+    STATS = stats_dir(deriv_dir, sub, ses)
+    if work is None:
+        STATS.mkdir(parents=True, exist_ok=True)
+        ANAT.mkdir(parents=True, exist_ok=True)
+        ATLS.mkdir(parents=True, exist_ok=True)
+
+    def out_path(final: Path) -> Path:
+        # Reuse a published output if there is one; otherwise write in place or under the scratch tree
+        if work is None or final.exists():
+            return final
+        p = work / final.relative_to(deriv_dir)
+        p.parent.mkdir(parents=True, exist_ok=True)
+        return p
+
+    # Input surface paths: one L/R pair per surface type
+    surfaces = tuple(surfaces)
+    surf_paths = {s: (Path(surf_dir) / name_surface(sub, ses, acq, density, "L", s),
+                      Path(surf_dir) / name_surface(sub, ses, acq, density, "R", s)) for s in surfaces}
 
     # ROI paths
     roi_l = Path(roi_l) if roi_l is not None else Path(roi_dir) / f"S1200.L.atlasroi.{density}_fs_LR.shape.gii"
     roi_r = Path(roi_r) if roi_r is not None else Path(roi_dir) / f"S1200.R.atlasroi.{density}_fs_LR.shape.gii"
 
     # Check for inputs
-    for p in (surf_l, surf_r, roi_l, roi_r):
+    for p in (*(p for pair in surf_paths.values() for p in pair), roi_l, roi_r):
         if not Path(p).exists():
             raise FileNotFoundError(f"Missing required file: {p}")
 
-    # Outputs (BIDS-like names)
-    area_l = ANAT / name_vertex_area_metric(sub, ses, density, "L")
-    area_r = ANAT / name_vertex_area_metric(sub, ses, density, "R")
-    area_cifti = ANAT / name_vertex_area_dscalar(sub, ses, density)
-
-    # Compute vertex areas & combined dscalar
-    if not area_l.exists(): surface_vertex_areas(surf_l, area_l, wb_command)  #get areas for L and R hemis
-    if not area_r.exists(): surface_vertex_areas(surf_r, area_r, wb_command)
-    if not area_cifti.exists():
-        cifti_create_dense_scalar(area_cifti, area_l, area_r, roi_l, roi_r, wb_command) #combine L and R hemis into dscalar, excluding medial wall
+    # Per surface: vertex areas & combined dscalar (BIDS-like names), sharing the ROI masks
+    area_ciftis, area_maps = {}, {}
+    for s, (surf_l, surf_r) in surf_paths.items():
+        area_l = out_path(ANAT / name_vertex_area_metric(sub, ses, density, "L", s))
+        area_r = out_path(ANAT / name_vertex_area_metric(sub, ses, density, "R", s))
+        area_cifti = out_path(ANAT / name_vertex_area_dscalar(sub, ses, density, s))
+        if not area_l.exists(): surface_vertex_areas(surf_l, area_l, wb_command)  #get areas for L and R hemis
+        if not area_r.exists(): surface_vertex_areas(surf_r, area_r, wb_command)
+        if not area_cifti.exists():
+            cifti_create_dense_scalar(area_cifti, area_l, area_r, roi_l, roi_r, wb_command) #combine L and R hemis into dscalar, excluding medial wall
+        area_ciftis[s] = area_cifti
+        area_maps[s], hemi = open_dscalar(area_cifti)   # same topology and ROIs, so the same grayordinates
 
-    tc_area = cifti_sum(area_cifti, wb_command) #sum all per-vertex area values for total cortical (TC) area
+    n_vert = area_maps[surfaces[0]].shape[1]
 
-    # Weighted networks
-    weighted_sums = {}
-    for net in sorted(Path(net_dir).glob(net_glob)):
+    # Network loadings, from the cohort store or one dscalar per network
+    net_labels, loadings = [], []
+    if store is not None:
+        use_common()
+        from pfn_store import PfnStore
+        pfn = PfnStore(store)
+        if pfn.n_vertices != n_vert:
+            raise ValueError(f"PFN store {store}: {pfn.n_vertices} grayordinates, area map has {n_vert}")
+        W_all = pfn.loadings(sub, ses)
+        for i, net_label in enumerate(pfn.networks):
+            net_labels.append(net_label)
+            loadings.append(W_all[i:i + 1])
+    for net in (sorted(Path(net_dir).glob(net_glob)) if store is None else []):
         # derive network label for filename, e.g., PFN1_soft_parcel_normed -> PFN1
         # adjust regex to your actual filenames
         net_label = net.name.replace(".dscalar.nii", "")
-        net_weighted_cifti = ATLS / name_weighted_map(sub, ses, density, atlas, net_label)
-        if not net_weighted_cifti.exists():
-            cifti_math("area * loading", net_weighted_cifti, wb_command, area=area_cifti, loading=net) # weight surface area values based on soft parcellation of each network
-        weighted_sums[net_label] = cifti_sum(net_weighted_cifti, wb_command) # sum all per-vertex weighted area values for network area
-
-    # Write subject-level stats TSVs
-    write_tsv(STATS / name_total_cortex_area_tsv(sub, ses, density),
-              [ {"subject": sub, "session": ses or "", "space": "fsLR", "den": density, "stat": "SUM", "TC_area": tc_area} ])
-
-    rows = []
-    for k, v in sorted(weighted_sums.items()):
-        rows.append({"subject": sub, "session": ses or "", "space": "fsLR", "den": density,
-                     "atlas": atlas, "network": k, "stat": "SUM", "area": v})
-    write_tsv(STATS / name_network_areas_tsv(sub, ses, density, atlas), rows)
-
-    return {"subject": sub, "TC_area": tc_area, "network_areas": weighted_sums}
\ No newline at end of file
+        loading = open_dscalar(net)[0]
+        if loading.shape[1] != n_vert:
+            raise ValueError(f"{net.name}: {loading.shape[1]} grayordinates, area map has {n_vert}")
+        net_labels.append(net_label)
+        loadings.append(loading)
+
+    # Weighted-area maps (area * loading), filled block by block in the pass below rather than by one
+    # wb_command per network and surface: {(network index, surface): writer} for the missing ones
+    writers = {}
+    for i, net_label in enumerate(net_labels if weighted_maps else []):
+        for s in surfaces:
+            net_weighted_cifti = out_path(ATLS / name_weighted_map(sub, ses, density, atlas, net_label, s))
+            if not net_weighted_cifti.exists():
+                writers[i, s] = net_weighted_cifti
+
+    # Optional hard parcellation on the same grayordinates
+    if regions is not None:
+        keys, names = load_labels(regions)
+        if keys.size != n_vert:
+            raise ValueError(f"{Path(regions).name}: {keys.size} grayordinates, area map has {n_vert}")
+        idx, region_keys = region_index(keys)
+        reg_tc = {s: np.zeros(region_keys.size) for s in surfaces}
+        reg_net = {s: np.zeros((len(loadings), region_keys.size)) for s in surfaces}
+
+    # All statistics in one pass over the (n_net, v) loading matrix, block by block: each block of
+    # loadings is read once and reduced against every surface's area vector. float32 storage per
+    # block, float64 accumulators across blocks
+    acc = {s: new_network_accumulator(len(loadings)) for s in surfaces}
+    tc_area = dict.fromkeys(surfaces, 0.0)
+    tc_hemi = {s: np.zeros(2) for s in surfaces}
+    # Full maps (area, then area * loading per network) for cohort aggregates, filled block by block
+    maps = {s: np.empty((len(loadings) + 1, n_vert), dtype=np.float32) for s in surfaces} if return_maps else None
+    step = max(1, chunk_vertices or n_vert)
+    writers = {k: DscalarBlockWriter(area_ciftis[k[1]], p) for k, p in writers.items()}
+    try:
+        for start in range(0, n_vert, step):
+            stop = min(n_vert, start + step)
+            h = hemi[start:stop]
+            W = np.empty((len(loadings), stop - start), dtype=np.float32)
+            for i, loading in enumerate(loadings):
+                W[i] = np.asarray(loading[0:1, start:stop], dtype=np.float32)[0]
+            for s in surfaces:
+                area = np.asarray(area_maps[s][0:1, start:stop], dtype=np.float32)[0]
+                tc_area[s] += float(area.sum(dtype=np.float64)) #sum all per-vertex area values for total cortical (TC) area
+                tc_hemi[s] += np.bincount(h[h >= 0], weights=area[h >= 0].astype(np.float64), minlength=2)
+                if maps is not None or writers:
+                    weighted = area * W
+                    if maps is not None:
+                        maps[s][0, start:stop] = area
+                        maps[s][1:, start:stop] = weighted
+                    for i in range(len(loadings)):
+                        if (i, s) in writers:
+                            writers[i, s][start:stop] = weighted[i]
+                if loadings:
+                    accumulate_network_stats(acc[s], area, W, h)
+                if regions is not None:
+                    t, n = region_sums(area, W, idx[start:stop], region_keys.size)
+                    reg_tc[s] += t
+                    reg_net[s] += n
+        for w in writers.values():
+            w.close()
+    except BaseException:
+        for w in writers.values():
+            w.discard()
+        raise
+
+    net_stats = {s: dict(zip(net_labels, finalize_network_stats(acc[s], stats))) if loadings else {}
+                 for s in surfaces}
+    weighted_sums = {s: {k: v["area"] for k, v in net_stats[s].items()} for s in surfaces}
+
+    # Row identifiers; a "surface" column only when several surfaces are measured, so the
+    # default single-surface TSVs keep their columns
+    def ids(s):
+        return {"subject": sub, "session": ses or "", "space": "fsLR", "den": density,
+                **({"surface": s} if len(surfaces) > 1 else {})}
+
+    # Optional per-region breakdown
+    region_rows = []
+    if regions is not None:
+        for s in surfaces:
+            for j, key in enumerate(region_keys.tolist()):
+                for net_label, value in [("TC", reg_tc[s][j])] + [(n, reg_net[s][i, j]) for i, n in enumerate(net_labels)]:
+                    region_rows.append({**ids(s), "atlas": atlas, "region": key,
+                                        "region_name": names.get(key, ""),
+                                        "network": net_label, "stat": "SUM", "area": float(value)})
+
+    # Subject-level stats TSVs, one row (set) per surface. total_cortex appends the hemisphere
+    # split (TC_area_L, TC_area_R) after TC_area, so the earlier columns keep their positions
+    tables = {}
+    tables[STATS / name_total_cortex_area_tsv(sub, ses, density)] = \
+        [ {**ids(s), "stat": "SUM",
+           "TC_area": tc_area[s], "TC_area_L": float(tc_hemi[s][0]), "TC_area_R": float(tc_hemi[s][1])}
+          for s in surfaces ]
+
+    rows, stat_rows = [], []
+    for s in surfaces:
+        for k, v in sorted(net_stats[s].items()):
+            net_ids = {**ids(s), "atlas": atlas, "network": k}
+            rows.append({**net_ids, "stat": "SUM", "area": v["area"]})
+            stat_rows.append({**net_ids, **{c: x for c, x in v.items() if c != "area"}})
+    tables[STATS / name_network_areas_tsv(sub, ses, density, atlas)] = rows
+    if set(stats) - {"SUM"}:
+        tables[STATS / name_network_stats_tsv(sub, ses, density, atlas)] = stat_rows
+    if regions is not None:
+        parc = Path(regions).name.split(".")[0]
+        tables[STATS / name_region_areas_tsv(sub, ses, density, atlas, parc)] = region_rows
+    if work is not None:
+        tables = {work / p.relative_to(deriv_dir): rows for p, rows in tables.items()}
+
+    # Top-level values are the first (primary) surface's; every surface is under "surfaces"
+    s0 = surfaces[0]
+    result = {"subject": sub, "TC_area": tc_area[s0], "TC_area_L": float(tc_hemi[s0][0]),
+              "TC_area_R": float(tc_hemi[s0][1]), "network_areas": weighted_sums[s0], "network_stats": net_stats[s0],
+              "surfaces": {s: {"TC_area": tc_area[s], "TC_area_L": float(tc_hemi[s][0]),
+                               "TC_area_R": float(tc_hemi[s][1]), "network_areas": weighted_sums[s]}
+                           for s in surfaces}}
+    if maps is not None:
+        result.update(session=ses or "", acq=acq, density=density, maps=maps, map_names=["vertex_area"] + net_labels,
+                      area_map=str((ANAT / name_vertex_area_dscalar(sub, ses, density, surfaces[0])).relative_to(deriv_dir)))
+    if defer_writes:
+        result["tables"] = tables
+    else:
+        write_outputs({"tables": tables})
+    return result
+
+def write_outputs(result: dict) -> dict:
+    """Write (and drop) the deferred "tables" of a process_subject result."""
+    for path, rows in result.pop("tables", {}).items():
+        write_tsv(Path(path), rows)
+    return result
+
+# ---------- staged driver pipeline ----------
+
+def subject_inputs(sub, surf_dir, roi_dir, net_dir, ses="PNC1", acq="refaced", density="32k",
+                   net_glob="*.dscalar.nii", roi_l=None, roi_r=None, store=None, surfaces=("midthickness",),
+                   **_) -> list[Path]:
+    """Input files process_subject will read for one subject (surfaces, ROIs, loadings)."""
+    paths = [Path(surf_dir) / name_surface(sub, ses, acq, density, h, s) for s in surfaces for h in ("L", "R")]
+    paths.append(Path(roi_l) if roi_l is not None else Path(roi_dir) / f"S1200.L.atlasroi.{density}_fs_LR.shape.gii")
+    paths.append(Path(roi_r) if roi_r is not None else Path(roi_dir) / f"S1200.R.atlasroi.{density}_fs_LR.shape.gii")
+    if store is None:
+        paths.extend(sorted(Path(net_dir).glob(net_glob)))
+    return paths
+
+def expected_outputs(sub, deriv_dir, net_dir=None, ses="PNC1", density="32k", atlas="PNC_group",
+                     net_glob="*.dscalar.nii", regions=None, store=None, surfaces=("midthickness",),
+                     weighted_maps=True, stats=DEFAULT_STATS, **_) -> list[Path]:
+    """Files process_subject leaves under deriv_dir for one subject (area maps, weighted maps, stats TSVs)."""
+    if store is not None:
+        use_common()
+        from pfn_store import PfnStore
+        nets = PfnStore(store).networks
+    else:
+        nets = [p.name.replace(".dscalar.nii", "") for p in sorted(Path(net_dir).glob(net_glob))]
+    deriv_dir = Path(deriv_dir)
+    ANAT, ATLS, STATS = anat_dir(deriv_dir, sub, ses), atlas_dir(deriv_dir, sub, ses, atlas), stats_dir(deriv_dir, sub, ses)
+    paths = []
+    for s in surfaces:
+        paths += [ANAT / name_vertex_area_metric(sub, ses, density, h, s) for h in ("L", "R")]
+        paths.append(ANAT / name_vertex_area_dscalar(sub, ses, density, s))
+        if weighted_maps:
+            paths += [ATLS / name_weighted_map(sub, ses, density, atlas, net, s) for net in nets]
+    paths += [STATS / name_total_cortex_area_tsv(sub, ses, density), STATS / name_network_areas_tsv(sub, ses, density, atlas)]
+    if set(stats) - {"SUM"}:
+        paths.append(STATS / name_network_stats_tsv(sub, ses, density, atlas))
+    if regions is not None:
+        paths.append(STATS / name_region_areas_tsv(sub, ses, density, atlas, Path(regions).name.split(".")[0]))
+    return paths
+
+def archived_outputs(sub, deriv_dir, ses="PNC1", density="32k", atlas="PNC_group", scratch_dir=None,
+                     publish="move", **_) -> dict:
+    """{path under deriv_dir: size} of the files in the subject's published tar (publish="archive")."""
+    if scratch_dir is None or publish != "archive":
+        return {}
+    archive = subject_dir(Path(deriv_dir), sub, ses) / name_subject_archive(sub, ses, density, atlas)
+    if not archive.exists():
+        return {}
+    with tarfile.open(archive) as tf:
+        return {Path(deriv_dir) / m.name: m.size for m in tf.getmembers() if m.isfile()}
+
+# ---------- dry-run planning ----------
+
+def format_bytes(n: float) -> str:
+    for unit in ("B", "K", "M", "G", "T"):
+        if abs(n) < 1024 or unit == "T":
+            return f"{n:.0f}{unit}" if unit == "B" else f"{n:.1f}{unit}"
+        n /= 1024
+
+def format_seconds(s: float) -> str:
+    s = int(round(s))
+    return f"{s // 3600}h{s % 3600 // 60:02d}m" if s >= 3600 else f"{s // 60}m{s % 60:02d}s"
+
+def _file_size(p: Path) -> int | None:
+    try:
+        return p.stat().st_size
+    except OSError:
+        return None
+
+def _input_size(p: Path, archived: dict | None = None) -> int | None:
+    n = _file_size(p)
+    if n is None and archived and Path(p) in archived:
+        from bids_zip import path_exists, stat_path
+        if path_exists(archived[Path(p)]):
+            n = stat_path(archived[Path(p)]).st_size
+    return n
+
+def plan_run(jobs, workers: int, history: Path | None = None, archived: dict | None = None) -> dict:
+    """
+    Dry-run estimate for run_pipeline(jobs): which subjects compute everything ("new"),
+    which find some or all of their maps and only fill the gaps / recompute the stats
+    ("partial", "complete"), and the bytes read and written.
+
+    Bytes in are the files each subject prefetches (subject_inputs). Bytes out are the
+    missing outputs, each sized like the same output of subjects that have it, or else
+    like one of the subject's loading maps (same grayordinates, float32; from a store,
+    4 bytes per grayordinate). Wall time uses
+    the per-subject "seconds" recorded in a previous run's summary JSON (history), with
+    separate medians for subjects that did and did not reuse their maps. Inputs not
+    extracted from zip archives yet (archived, see find_surface_jobs) are sized in the archive.
+    """
+    rows, sizes_by_kind, store_sizes = [], {}, {}
+    for key, kwargs in jobs:
+        store = kwargs.get("store")
+        if store is not None and store not in store_sizes:
+            use_common()
+            from pfn_store import PfnStore
+            store_sizes[store] = 4 * PfnStore(store).n_vertices
+        outputs = expected_outputs(**kwargs)
+        published = archived_outputs(**kwargs)
+        sizes = [n if (n := _file_size(p)) is not None else published.get(p) for p in outputs]
+        for p, n in zip(outputs, sizes):
+            if n is not None:
+                sizes_by_kind.setdefault(p.name.split("_space-", 1)[-1], []).append(n)
+        inputs = [_input_size(p, archived) for p in subject_inputs(**kwargs)]
+        n_have = sum(n is not None for n in sizes)
+        status = "complete" if n_have == len(outputs) else "partial" if n_have else "new"
+        rows.append(dict(key=key, status=status, outputs=outputs, sizes=sizes,
+                         bytes_in=sum(n for n in inputs if n is not None),
+                         missing_inputs=sum(n is None for n in inputs),
+                         ref_size=store_sizes[store] if store is not None else
+                         max((n for n in inputs[-1:] if n is not None), default=0)))
+
+    kinds = {k: float(np.median(v)) for k, v in sizes_by_kind.items()}
+    bytes_out, unsized = 0.0, 0
+    for r in rows:
+        for p, n in zip(r["outputs"], r["sizes"]):
+            if n is not None:
+                continue
+            est = kinds.get(p.name.split("_space-", 1)[-1])
+            if est is None and not p.name.endswith(".tsv"):
+                est = r["ref_size"] or None
+            if est is None:
+                unsized += not p.name.endswith(".tsv")
+            else:
+                bytes_out += est
+
+    # Per-subject seconds from the last run, split by whether the maps were already there
+    timed = {True: [], False: []}
+    if history is not None and Path(history).exists():
+        for rec in json.loads(Path(history).read_text()):
+            if "seconds" in rec:
+                timed[bool(rec.get("reused_outputs"))].append(rec["seconds"])
+    t_new = float(np.median(timed[False])) if timed[False] else None
+    t_reused = float(np.median(timed[True])) if timed[True] else None
+    counts = {s: sum(r["status"] == s for r in rows) for s in ("new", "partial", "complete")}
+    wall = None
+    if t_new is not None or t_reused is not None:
+        busy = (counts["new"] + counts["partial"]) * (t_new if t_new is not None else t_reused) \
+               + counts["complete"] * (t_reused if t_reused is not None else t_new)
+        wall = busy / max(1, min(workers, len(rows)))
+    return {"jobs": len(rows), **counts, "bytes_in": sum(r["bytes_in"] for r in rows),
+            "missing_inputs": sum(r["missing_inputs"] for r in rows), "bytes_out": bytes_out,
+            "unsized_outputs": unsized, "workers": workers, "seconds_new": t_new, "seconds_reused": t_reused,
+            "timed_subjects": len(timed[True]) + len(timed[False]), "wall_seconds": wall,
+            "subjects": {str(r["key"]): r["status"] for r in rows}}
+
+def print_plan(plan: dict, skipped: int = 0):
+    print(f"[PLAN] {plan['jobs']} jobs: {plan['new']} new, {plan['partial']} partial, "
+          f"{plan['complete']} complete (stats recomputed from existing maps); {skipped} skipped")
+    note = f" ({plan['missing_inputs']} input files not found)" if plan["missing_inputs"] else ""
+    print(f"[PLAN] read ~{format_bytes(plan['bytes_in'])}{note}")
+    note = f" (+{plan['unsized_outputs']} maps of unknown size)" if plan["unsized_outputs"] else ""
+    print(f"[PLAN] write ~{format_bytes(plan['bytes_out'])}{note}")
+    if plan["wall_seconds"] is None:
+        print("[PLAN] wall time: no per-subject timings recorded yet (run once to record them)")
+    else:
+        per = ", ".join(f"{label} {format_seconds(t)}" for label, t in
+                        (("new", plan["seconds_new"]), ("reused maps", plan["seconds_reused"])) if t is not None)
+        print(f"[PLAN] wall time ~{format_seconds(plan['wall_seconds'])} with {plan['workers']} workers "
+              f"(median per subject: {per}; {plan['timed_subjects']} subjects timed)")
+
+def prefetch_files(paths, chunk: int = 1 << 22) -> int:
+    """Read files end to end (data discarded) so wb_command finds them in cache. Returns bytes read."""
+    n = 0
+    for p in paths:
+        try:
+            with open(p, "rb", buffering=0) as f:
+                while True:
+                    b = f.read(chunk)
+                    if not b:
+                        break
+                    n += len(b)
+        except OSError:
+            pass    # missing inputs are reported by process_subject itself
+    return n
+
+def run_pipeline(jobs, fn=None, inputs_of=None, workers: int = 8, io_threads: int = 4,
+                 depth: int | None = None):
+    """
+    Run fn(**kwargs) for every (key, kwargs) in jobs as a three-stage pipeline and
+    yield (key, result, error) in completion order:
+
+      I/O threads  -> prefetch each subject's inputs (inputs_of(**kwargs))
+      process pool -> fn(**kwargs, defer_writes=True)
+      writer       -> one thread writing the deferred stats TSVs
+
+    At most `depth` subjects (default 2 * workers) are prefetched but not yet
+    written, which bounds memory/page cache use while keeping the pool fed, so
+    throughput approaches the slower of I/O and compute rather than their sum.
+    """
+    fn = fn or process_subject
+    inputs_of = inputs_of or subject_inputs
+    jobs = list(jobs)
+    depth = max(1, depth or 2 * workers)
+    slots = threading.Semaphore(depth)
+    done: queue.Queue = queue.Queue()
+    if not jobs:
+        return
+
+    def finish(key, result=None, error=None):
+        slots.release()
+        done.put((key, result, error))
+
+    def warm(key, kwargs):
+        slots.acquire()
+        try:
+            prefetch_files(inputs_of(**kwargs))
+        except Exception:
+            pass    # prefetching is only an optimisation
+        return key, kwargs
+
+    with ThreadPoolExecutor(max_workers=max(1, io_threads)) as io, \
+         ProcessPoolExecutor(max_workers=max(1, min(workers, len(jobs)))) as pool, \
+         ThreadPoolExecutor(max_workers=1) as writer:
+
+        def written(key, fut):
+            try:
+                finish(key, fut.result())
+            except Exception as e:
+                finish(key, error=e)
+
+        def computed(key, fut):
+            try:
+                result = fut.result()
+            except Exception as e:
+                return finish(key, error=e)
+            writer.submit(write_outputs, result).add_done_callback(lambda f: written(key, f))
+
+        def prefetched(fut):
+            key, kwargs = fut.result()
+            try:
+                pool.submit(fn, **kwargs, defer_writes=True).add_done_callback(lambda f: computed(key, f))
+            except Exception as e:    # e.g. broken pool
+                finish(key, error=e)
+
+        for key, kwargs in jobs:
+            io.submit(warm, key, kwargs).add_done_callback(prefetched)
+        for _ in range(len(jobs)):
+            yield done.get()
+
+# ---------- cohort aggregates ----------
+
+def read_groups(csv_path: str | Path, group_col: str = "group", sub_col: str = "participant_id") -> dict:
+    """{subject label (no "sub-"): group} from a demographics CSV, e.g. 22q vs PNC."""
+    groups = {}
+    with open(csv_path, newline="") as f:
+        for row in csv.DictReader(f):
+            sub, group = (row.get(sub_col) or "").strip(), (row.get(group_col) or "").strip()
+            if sub and group:
+                groups[sub.removeprefix("sub-")] = group
+    if not groups:
+        raise ValueError(f"{csv_path}: no rows with both {sub_col!r} and {group_col!r}")
+    return groups
+
+def name_cohort_map(den, atlas, surf, group, stat):
+    group = re.sub(r"[^A-Za-z0-9]", "", str(group))
+    return f"cohort_space-fsLR_den-{den}_atlas-{atlas}{_surf_ent(surf)}_group-{group}_stat-{stat}_areas.dscalar.nii"
+
+class CohortAggregate:
+    """
+    Running per-vertex count, mean and variance (Welford) of the vertex area map and each
+    network's weighted-area map, per (density, surface, group). Subjects are added as they
+    complete (process_subject(..., return_maps=True) results), so no per-subject map has to
+    be kept. Every subject counts towards group "all" and, given groups, towards its own.
+
+    Separate runs (shards) save() their state to one directory; merge_dir() combines them
+    (Chan et al. pairwise update) and write() produces one multi-map dscalar per statistic,
+    with maps vertex_area, then the networks.
+    """
+    def __init__(self, groups: dict | None = None):
+        self.groups = dict(groups or {})
+        self.subjects = set()     # "sub|ses|acq|den", one per driver job
+        self.names = {}           # (den, surf) -> map names
+        self.count, self.mean, self.m2 = {}, {}, {}    # (den, surf, group) -> n, (n_maps, v) float64 x2
+
+    def add(self, result: dict):
+        den, group = result["density"], self.groups.get(result["subject"])
+        sid = f"{result['subject']}|{result.get('session', '')}|{result.get('acq', '')}|{den}"
+        if sid in self.subjects:
+            raise ValueError(f"sub-{result['subject']} ses-{result.get('session', '')} acq-{result.get('acq', '')} "
+                             f"den-{den} already aggregated")
+        for s in result["maps"]:    # check every surface before updating any
+            names = self.names.get((den, s), list(result["map_names"]))
+            if names != list(result["map_names"]):
+                raise ValueError(f"sub-{result['subject']}: networks {result['map_names'][1:]} differ from {names[1:]}")
+        for s, x in result["maps"].items():
+            self.names.setdefault((den, s), list(result["map_names"]))
+            x = np.asarray(x, dtype=np.float64)
+            for g in ("all",) + ((group,) if group else ()):
+                k = (den, s, g)
+                if k not in self.count:
+                    self.count[k], self.mean[k], self.m2[k] = 0, np.zeros_like(x), np.zeros_like(x)
+                self.count[k] += 1
+                delta = x - self.mean[k]
+                self.mean[k] += delta / self.count[k]
+                self.m2[k] += delta * (x - self.mean[k])
+        self.subjects.add(sid)
+
+    def merge(self, other: "CohortAggregate"):
+        overlap = self.subjects & other.subjects
+        if overlap:
+            raise ValueError(f"{len(overlap)} subjects in more than one shard, e.g. {sorted(overlap)[0]}")
+        for key, names in other.names.items():
+            if self.names.setdefault(key, names) != names:
+                raise ValueError(f"den-{key[0]} {key[1]}: shards have different networks")
+        for k, nb in other.count.items():
+            if k not in self.count:
+                self.count[k], self.mean[k], self.m2[k] = nb, other.mean[k].copy(), other.m2[k].copy()
+                continue
+            na = self.count[k]
+            n = na + nb
+            delta = other.mean[k] - self.mean[k]
+            self.mean[k] += delta * (nb / n)
+            self.m2[k] += other.m2[k] + delta ** 2 * (na * nb / n)
+            self.count[k] = n
+        self.subjects |= other.subjects
+        self.groups.update(other.groups)
+        return self
+
+    def save(self, out_dir: Path, shard: str) -> Path:
+        """Write the state to out_dir/state_<shard>.npz (temp file + rename)."""
+        out_dir = Path(out_dir)
+        out_dir.mkdir(parents=True, exist_ok=True)
+        keys = sorted(self.count)
+        meta = {"subjects": sorted(self.subjects), "groups": self.groups,
+                "names": [[den, s, n] for (den, s), n in self.names.items()],
+                "keys": [[*k, self.count[k]] for k in keys]}
+        arrays = {f"mean{i}": self.mean[k] for i, k in enumerate(keys)}
+        arrays.update({f"m2{i}": self.m2[k] for i, k in enumerate(keys)})
+        out = out_dir / f"state_{shard}.npz"
+        tmp = out.with_name(f".{out.name}.tmp{os.getpid()}")
+        with open(tmp, "wb") as f:
+            np.savez(f, meta=np.array(json.dumps(meta)), **arrays)
+        os.replace(tmp, out)
+        return out
+
+    @classmethod
+    def load(cls, path: Path) -> "CohortAggregate":
+        with np.load(path) as z:
+            meta = json.loads(str(z["meta"]))
+            agg = cls(meta["groups"])
+            agg.subjects = set(meta["subjects"])
+            agg.names = {(den, s): n for den, s, n in meta["names"]}
+            for i, (den, s, g, n) in enumerate(meta["keys"]):
+                agg.count[(den, s, g)], agg.mean[(den, s, g)], agg.m2[(den, s, g)] = n, z[f"mean{i}"], z[f"m2{i}"]
+        return agg
+
+    @classmethod
+    def merge_dir(cls, out_dir: Path) -> "CohortAggregate":
+        """All shards' states in out_dir merged into one."""
+        total = cls()
+        for p in sorted(Path(out_dir).glob("state_*.npz")):
+            total.merge(cls.load(p))
+        return total
+
+    @staticmethod
+    def keep_template(result: dict, deriv_dir: Path, out_dir: Path) -> Path:
+        """
+        Copy the subject's area dscalar to out_dir as the grayordinate template of its density
+        (from deriv_dir, or from the subject's tar with --publish archive), once per density.
+        """
+        template = Path(out_dir) / f"template_den-{result['density']}.dscalar.nii"
+        if template.exists():
+            return template
+        template.parent.mkdir(parents=True, exist_ok=True)
+        tmp = template.with_name(f".{template.stem}.tmp{os.getpid()}.dscalar.nii")
+        src = Path(deriv_dir) / result["area_map"]
+        if src.exists():
+            shutil.copyfile(src, tmp)
+        else:
+            for archive in (p for p in result.get("published", []) if p.endswith(".tar")):
+                with tarfile.open(archive) as tf, open(tmp, "wb") as f:
+                    shutil.copyfileobj(tf.extractfile(result["area_map"]), f)
+                break
+            else:
+                raise FileNotFoundError(f"Missing area map for the cohort template: {src}")
+        os.replace(tmp, template)
+        return template
+
+    def write(self, out_dir: Path, atlas: str, sums: bool = False) -> list[Path]:
+        """
+        Write mean and variance (n - 1 denominator; NaN with one subject) dscalars, and with
+        sums also the per-group sums, for every (density, surface, group), plus counts TSV.
+        """
+        out_dir = Path(out_dir)
+        written, rows = [], []
+        for (den, s, g), n in sorted(self.count.items()):
+            template = out_dir / f"template_den-{den}.dscalar.nii"
+            maps = {"mean": self.mean[(den, s, g)],
+                    "var": self.m2[(den, s, g)] / (n - 1) if n > 1 else np.full_like(self.m2[(den, s, g)], np.nan)}
+            if sums:
+                maps["sum"] = self.mean[(den, s, g)] * n
+            for stat, data in maps.items():
+                out = out_dir / name_cohort_map(den, atlas, s, g, stat)
+                write_dscalar_like(template, data, out, names=self.names[(den, s)])
+                written.append(out)
+            rows.append({"den": den, "surface": s, "atlas": atlas, "group": g, "n_subjects": n})
+        counts = out_dir / f"cohort_atlas-{atlas}_counts.tsv"
+        write_tsv(counts, rows)
+        return written + [counts]
@@ -5,6 +5,30 @@ merge_dtseries_by_session.py
 Concatenate dtseries within each (sub, ses) using Connectome Workbench
 (wb_command -cifti-merge) and compile a global scan list of merged outputs for pNet.
 
+Re-runs are incremental: the manifest records the size and mtime of every input
+(and optionally a content hash) plus the size of the output, and groups whose
+inputs, input order and build method are unchanged are skipped. Use --force to
+rebuild everything. Before a group is built its inputs are checked from their
+CIFTI headers (common/cifti_io.py): a truncated file, or inputs on different
+grayordinates, skip the group with status "invalid_input".
+
+With --fd-threshold, each scan's XCP-D motion TSV is matched by its BIDS entities
+and only volumes with framewise_displacement <= threshold are written into the
+merged dtseries (via -cifti-merge -column/-up-to ranges); per-scan kept/dropped
+counts are recorded in the manifest. A scan whose motion TSV has a different number
+of rows than it has volumes skips its group with status "motion_mismatch".
+
+With --fd-summary (the CSV from fd_summary_from_xcpd.py) and any of --max-mean-fd,
+--max-median-fd and --min-vols, sessions (or, with --qc-level scan, single scans)
+that fail the motion criteria are left out before merging; the manifest records
+the criteria, the excluded inputs and why (status "excluded_motion" when nothing
+is left). See common/motion_qc.py.
+
+With --precision int16 (or int16-grayordinate), merged outputs are rewritten as
+int16 with a per-file (or per-grayordinate) scale and offset, about half the size
+of float32; the manifest records the precision and the max absolute quantization
+error of each output. See common/reduced_precision.py.
+
 Example:
   python merge_dtseries_by_session.py \
     --root /cbica/projects/PFN_ABCD/abcd-hcp-pipeline_0.1.4_timeseries \
@@ -13,16 +37,43 @@ Example:
 
 import argparse
 import csv
+import hashlib
+import math
 import os
 import re
 import shutil
 import subprocess
 import sys
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
+
+
+def use_common():
+    """Make the shared modules in ../common importable (a flat deployment needs nothing)."""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "common")
+    if path not in sys.path:
+        sys.path.append(path)
+
+
+use_common()
+from motion_qc import MotionGate, add_motion_args, scan_task
+
+# Same as reduced_precision.PRECISIONS; cifti_io and reduced_precision need numpy,
+# so they are imported where used and a float32 merge runs on the standard library
+PRECISIONS = ("float32", "int16", "int16-grayordinate")
 
 BIDS_SUB_RE = re.compile(r"(sub-[A-Za-z0-9]+)")
 BIDS_SES_RE = re.compile(r"(ses-[A-Za-z0-9]+)")
+# Entities that must agree between a scan and its motion file (when present in the scan name)
+MATCH_ENTITIES = ("sub", "ses", "task", "acq", "dir", "run", "echo")
+ENTITY_RE = re.compile(r"(?:^|_)([a-z]+)-([A-Za-z0-9]+)")
+
+MANIFEST_FIELDS = [
+    "subject", "session", "n_inputs", "output_path", "inputs",
+    "method", "input_sizes", "input_mtimes", "input_hashes", "output_size", "status",
+    "fd_threshold", "motion_inputs", "motion_mtimes", "n_kept", "n_dropped",
+    "motion_qc", "excluded_inputs", "qc_reasons", "precision", "max_quant_error", "input_error",
+]
 
 def which(cmd: str) -> str:
     p = shutil.which(cmd)
@@ -52,6 +103,27 @@ def parse_args() -> argparse.Namespace:
                     help="Path to write 19_Scan_List_Concat.txt "
                          "(default: <pnet_inputs>/19_Scan_List_Concat.txt if <out> is inside pnet_inputs; "
                          "otherwise <out>/19_Scan_List_Concat.txt).")
+    ap.add_argument("--force", action="store_true",
+                    help="Rebuild every group, even if the manifest says it is up to date.")
+    ap.add_argument("--hash", action="store_true",
+                    help="Record a SHA-256 of each input; when only mtimes changed, "
+                         "a matching hash still counts as up to date.")
+    ap.add_argument("--fd-threshold", type=float, default=None,
+                    help="If set, drop volumes with framewise_displacement above this value "
+                         "(read from each scan's XCP-D motion TSV) before merging.")
+    ap.add_argument("--motion-root", default=None,
+                    help="Directory to search for motion TSVs (default: each scan's own directory).")
+    ap.add_argument("--motion-pattern", default="*_motion.tsv",
+                    help="Glob pattern for motion TSVs (default: %(default)s).")
+    ap.add_argument("--index", default=None,
+                    help="Shared SQLite file index (common/bids_index.py); refreshed and queried "
+                         "instead of walking --root and --motion-root.")
+    ap.add_argument("--precision", choices=PRECISIONS, default="float32",
+                    help="Storage precision of merged outputs: int16 uses the standard NIfTI scl_slope/scl_inter "
+                         "(read transparently by wb_command, nibabel and pNet); int16-grayordinate keeps a scale "
+                         "and offset per grayordinate in the CIFTI metadata (smaller error; read with "
+                         "reduced_precision.load_dtseries). Default: %(default)s.")
+    add_motion_args(ap)
     return ap.parse_args()
 
 def extract_sub_ses(p: Path) -> Tuple[str, str]:
@@ -63,6 +135,72 @@ def extract_sub_ses(p: Path) -> Tuple[str, str]:
             ses = part
     return sub, ses
 
+def entities(name: str) -> Dict[str, str]:
+    return {k: v for k, v in ENTITY_RE.findall(name)}
+
+def find_motion_file(scan: Path, motion_index: Optional[Dict[Tuple[str, str], List[Path]]],
+                     pattern: str) -> Optional[Path]:
+    """Return the motion TSV whose entities match the scan's, or None if there is no unique match."""
+    ents = entities(scan.name)
+    if motion_index is not None:
+        cands = motion_index.get(extract_sub_ses(scan), [])
+    else:
+        cands = sorted(scan.parent.glob(pattern))
+    keys = [k for k in MATCH_ENTITIES if k in ents]
+    hits = [m for m in cands if all(entities(m.name).get(k) == ents[k] for k in keys)]
+    return hits[0] if len(hits) == 1 else None
+
+def read_fd_column(path: Path) -> List[float]:
+    """Per-volume FD; unparsable entries (e.g. 'n/a' on the first volume) become NaN."""
+    fd = []
+    with open(path, newline="") as f:
+        for r in csv.DictReader(f, delimiter="\t"):
+            try:
+                fd.append(float(r["framewise_displacement"]))
+            except (TypeError, ValueError):
+                fd.append(float("nan"))
+    return fd
+
+def kept_ranges(fd: List[float], threshold: float) -> List[Tuple[int, int]]:
+    """1-based inclusive runs of retained volumes; NaN FD is kept (first volume)."""
+    ranges: List[Tuple[int, int]] = []
+    for i, v in enumerate(fd, start=1):
+        if math.isnan(v) or v <= threshold:
+            if ranges and ranges[-1][1] == i - 1:
+                ranges[-1] = (ranges[-1][0], i)
+            else:
+                ranges.append((i, i))
+    return ranges
+
+def n_frames(path: Path) -> int:
+    from cifti_io import CiftiFile
+    return CiftiFile(path).shape[0]
+
+def preflight(paths: List[Path]) -> Optional[str]:
+    """
+    None if every input is a readable dtseries on the first one's grayordinates; else the
+    problem. Without numpy (needed by cifti_io) the check is skipped.
+    """
+    try:
+        from cifti_io import CiftiFile
+    except ImportError:
+        return None
+    first = None
+    for p in paths:
+        try:
+            img = CiftiFile(p)
+            img.data    # checks that the data block is complete
+        except (OSError, ValueError) as e:
+            return str(e)
+        if img.series is None:
+            return f"{p.name}: not a dtseries ({img.index_type(0)} rows)"
+        key = img.grayordinates_key()
+        if first is None:
+            first = key
+        elif key != first:
+            return f"{p.name}: grayordinates differ from {paths[0].name}"
+    return None
+
 def sort_key(name: str, keywords: List[str]) -> Tuple[int, str]:
     lower = name.lower()
     rank = len(keywords)
@@ -72,6 +210,73 @@ def sort_key(name: str, keywords: List[str]) -> Tuple[int, str]:
             break
     return (rank, name)
 
+def file_hash(p: Path, chunk: int = 1 << 24) -> str:
+    h = hashlib.sha256()
+    with open(p, "rb") as f:
+        for block in iter(lambda: f.read(chunk), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def fingerprint(paths: List[Path]) -> Tuple[str, str]:
+    """Return ';'-joined sizes and mtimes (ns) of the given files."""
+    stats = [p.stat() for p in paths]
+    return (";".join(str(st.st_size) for st in stats),
+            ";".join(str(st.st_mtime_ns) for st in stats))
+
+def read_manifest(path: Path) -> Dict[Tuple[str, str], Dict[str, str]]:
+    """Load a previous manifest keyed by (sub, ses); empty if absent or from an older version."""
+    if not path.exists():
+        return {}
+    with open(path, newline="") as f:
+        reader = csv.DictReader(f)
+        if not reader.fieldnames or "input_sizes" not in reader.fieldnames:
+            return {}
+        return {(r["subject"], r["session"]): r for r in reader}
+
+def write_manifest(path: Path, rows: List[Dict[str, str]]):
+    # Write to a temp file and rename, so an interrupted run never leaves a truncated manifest
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w", newline="") as f:
+        w = csv.DictWriter(f, fieldnames=MANIFEST_FIELDS, extrasaction="ignore")
+        w.writeheader()
+        w.writerows(rows)
+    os.replace(tmp, path)
+
+def output_size(out: Path) -> str:
+    try:
+        return str(out.stat().st_size)
+    except OSError:
+        return ""
+
+def is_up_to_date(prev: Optional[Dict[str, str]], row: Dict[str, str], out: Path,
+                  use_hash: bool) -> bool:
+    """
+    A group is up to date when the previous manifest row lists the same inputs in the
+    same order, built with the same method, and the output still exists with the
+    recorded size. Sizes and mtimes must match; with --hash, a matching content hash
+    also accepts inputs whose mtime changed (e.g. after a DataLad re-get).
+    """
+    if not prev or prev.get("status") not in ("built", "up-to-date"):
+        return False
+    if any(prev.get(k, "") != row.get(k, "")
+           for k in ("inputs", "method", "output_path", "fd_threshold", "motion_inputs", "motion_mtimes",
+                     "motion_qc", "precision")):
+        return False
+    if not out.exists() or output_size(out) != prev.get("output_size"):
+        return False
+    if prev.get("input_sizes") != row["input_sizes"]:
+        return False
+    if prev.get("input_mtimes") == row["input_mtimes"]:
+        row["input_hashes"] = prev.get("input_hashes", "")
+        if use_hash and not row["input_hashes"]:
+            row["input_hashes"] = ";".join(file_hash(Path(p)) for p in row["inputs"].split(";"))
+        return True
+    if use_hash and prev.get("input_hashes"):
+        row["input_hashes"] = ";".join(file_hash(Path(p)) for p in row["inputs"].split(";"))
+        return row["input_hashes"] == prev["input_hashes"]
+    return False
+
 def run(cmd: List[str], dry: bool):
     pretty = " ".join(f"'{c}'" if " " in c else c for c in cmd)
     print(">>", pretty)
@@ -106,16 +311,34 @@ def main():
     print(f"[INFO] scan-list-out={scan_list_path}")
     if args.custom_order:
         print(f"[INFO] custom-order={args.custom_order}")
+    if args.precision != "float32":
+        print(f"[INFO] precision={args.precision}")
+    if args.fd_threshold is not None:
+        print(f"[INFO] fd-threshold={args.fd_threshold}  motion-root={args.motion_root or '<scan dir>'}")
+    try:
+        gate = MotionGate.from_args(args, args.fd_threshold)
+    except (OSError, ValueError, KeyError) as e:
+        sys.exit(f"[ERROR] --fd-summary: {e}")
+    if gate is not None:
+        print(f"[INFO] motion-qc={gate.describe()}  fd-summary={args.fd_summary}")
 
     # Discover files
-    files = sorted(root.rglob(args.pattern))
+    if args.index:
+        from bids_index import indexed_glob
+        print(f"[INFO] index={args.index}")
+
+    def find(base: Path, pattern: str) -> List[Path]:
+        if args.index:
+            return indexed_glob(args.index, base, pattern)
+        return sorted(base.rglob(pattern))
+
+    files = find(root, args.pattern)
     if not files:
         print(f"[WARN] No files found under {root} matching {args.pattern}")
         # still produce empty artifacts
         if not args.dry_run:
-            manifest_path.parent.mkdir(parents=True, exist_ok=True)
+            write_manifest(manifest_path, [])
             scan_list_path.parent.mkdir(parents=True, exist_ok=True)
-            manifest_path.write_text("subject,session,n_inputs,output_path,inputs\n")
             scan_list_path.write_text("")
         print("[DONE] Nothing to merge.")
         return
@@ -132,8 +355,37 @@ def main():
     if skipped:
         print(f"[WARN] Skipped {skipped} files without clear sub/ses in path.")
 
+    motion_index: Optional[Dict[Tuple[str, str], List[Path]]] = None
+    if args.fd_threshold is not None and args.motion_root:
+        motion_index = {}
+        for m in find(Path(args.motion_root).resolve(), args.motion_pattern):
+            motion_index.setdefault(extract_sub_ses(m), []).append(m)
+
+    previous = {} if args.force else read_manifest(manifest_path)
+    # Rows of the manifest as it stands; starts from the previous run so that a
+    # checkpoint written mid-run still covers groups we have not reached yet.
+    current: Dict[Tuple[str, str], Dict[str, str]] = dict(previous)
     merged_outputs: List[Path] = []
-    rows = []
+    n_built = n_current = n_excluded = 0
+
+    def publish(tmp: Path, out: Path, row: Dict[str, str], keep_src: bool = False):
+        # Rename the finished float32 file into place, or rewrite it at reduced precision
+        if args.dry_run:
+            return
+        if args.precision == "float32":
+            os.replace(tmp, out)
+            return
+        from reduced_precision import write_reduced
+        err = write_reduced(tmp, out, args.precision)
+        if not keep_src:
+            tmp.unlink()
+        row["max_quant_error"] = f"{err:.6g}"
+        print(f"      {args.precision}: max quantization error {err:.6g}")
+
+    def drop_output(out: Path):
+        # A session that no longer qualifies must not leave its earlier merge behind
+        if not args.dry_run and (out.exists() or out.is_symlink()):
+            out.unlink()
 
     # Process each group deterministically
     for (sub, ses) in sorted(groups.keys()):
@@ -148,47 +400,184 @@ def main():
 
         if n == 0:
             print(f"[WARN] {sub} {ses}: 0 files — skipping.")
-            rows.append([sub, ses, 0, "", ""])
+            current[(sub, ses)] = {"subject": sub, "session": ses, "n_inputs": "0", "status": "empty"}
+            continue
+
+        # Motion QC: drop the whole session, or single scans at --qc-level scan, before any merge
+        excluded: List[Path] = []
+        reasons: List[str] = []
+        if gate is not None:
+            if gate.level == "session":
+                reason = gate.check(sub, ses)
+                if reason:
+                    excluded, reasons = list(cands), [reason]
+            else:
+                for p in cands:
+                    reason = gate.check(sub, ses, scan_task(p.name))
+                    if reason:
+                        excluded.append(p)
+                        reasons.append(f"{p.name}: {reason}")
+            cands = [p for p in cands if p not in excluded]
+            n = len(cands)
+        qc = {"motion_qc": gate.describe() if gate is not None else "",
+              "excluded_inputs": ";".join(str(p) for p in excluded), "qc_reasons": ";".join(reasons)}
+        if excluded:
+            print(f"[QC] {sub} {ses}: excluded {len(excluded)} scan{'s' if len(excluded) > 1 else ''} "
+                  f"({'; '.join(reasons)})")
+        if n == 0:
+            n_excluded += 1
+            drop_output(out)
+            current[(sub, ses)] = dict({"subject": sub, "session": ses, "n_inputs": "0",
+                                        "output_path": str(out), "status": "excluded_motion"}, **qc)
+            continue
+
+        if args.fd_threshold is not None:
+            method = "censor"
+        elif n == 1:
+            # A reduced-precision output is always a rewritten file, never a link to the input
+            method = "symlink" if args.link_single and args.precision == "float32" else "copy"
+        else:
+            method = "merge"
+
+        sizes, mtimes = fingerprint(cands)
+        row = {
+            "subject": sub, "session": ses, "n_inputs": str(n), "output_path": str(out),
+            "inputs": ";".join(str(p) for p in cands), "method": method,
+            "input_sizes": sizes, "input_mtimes": mtimes, "input_hashes": "", **qc,
+            "precision": args.precision,
+        }
+        if method == "censor":
+            motion = [find_motion_file(p, motion_index, args.motion_pattern) for p in cands]
+            missing = [p.name for p, m in zip(cands, motion) if m is None]
+            if missing:
+                print(f"[WARN] {sub} {ses}: no unique motion file for {', '.join(missing)} — skipping.")
+                current[(sub, ses)] = dict(row, status="no_motion")
+                continue
+            row["fd_threshold"] = str(args.fd_threshold)
+            row["motion_inputs"] = ";".join(str(m) for m in motion)
+            row["motion_mtimes"] = fingerprint(motion)[1]
+        merged_outputs.append(out)
+
+        prev = previous.get((sub, ses))
+        if is_up_to_date(prev, row, out, args.hash):
+            row["output_size"] = output_size(out)
+            row["n_kept"] = prev.get("n_kept", "")
+            row["n_dropped"] = prev.get("n_dropped", "")
+            row["max_quant_error"] = prev.get("max_quant_error", "")
+            row["status"] = "up-to-date"
+            current[(sub, ses)] = row
+            n_current += 1
+            continue
+
+        # Check the inputs from their headers before wb_command starts on them
+        problem = preflight(cands)
+        if problem:
+            print(f"[WARN] {sub} {ses}: {problem} — skipping.")
+            merged_outputs.remove(out)
+            current[(sub, ses)] = dict(row, status="invalid_input", input_error=problem)
             continue
 
-        if n == 1:
+        print(f"[INFO] {sub} {ses}: {n} file{'s' if n > 1 else ''} → {method} → {out.name}")
+        for p in cands:
+            print(f"      - {p.name}")
+
+        if method == "censor":
+            # Select retained columns per scan; a scan with no retained volumes is left out
+            args_list, kept, dropped = [], [], []
+            qc_after = False  # motion QC rejected scans or the session on their exact retained counts
+            mismatch = None
+            for pth, mot in zip(cands, motion):
+                fd = read_fd_column(mot)
+                n_vols = n_frames(pth)
+                if len(fd) != n_vols:
+                    mismatch = f"{pth.name}: {n_vols} volumes but {len(fd)} rows in {mot.name}"
+                    break
+                ranges = kept_ranges(fd, args.fd_threshold)
+                n_keep = sum(b - a + 1 for a, b in ranges)
+                kept.append(str(n_keep))
+                dropped.append(str(n_vols - n_keep))
+                print(f"      {pth.name}: keep {n_keep}/{n_vols}")
+                if gate is not None and gate.level == "scan" and gate.min_vols is not None \
+                        and 0 < n_keep < gate.min_vols:
+                    # Exact retained count after censoring, in case the summary was computed differently
+                    reasons.append(f"{pth.name}: retained_vols={n_keep}<{gate.min_vols}")
+                    excluded.append(pth)
+                    qc_after = True
+                    continue
+                if not ranges:
+                    continue
+                args_list.extend(["-cifti", str(pth)])
+                for a, b in ranges:
+                    args_list.extend(["-column", str(a)] + (["-up-to", str(b)] if b > a else []))
+            if mismatch:
+                print(f"[WARN] {sub} {ses}: {mismatch} — skipping.")
+                merged_outputs.remove(out)
+                current[(sub, ses)] = dict(row, status="motion_mismatch", input_error=mismatch)
+                continue
+            row["n_kept"] = ";".join(kept)
+            row["n_dropped"] = ";".join(dropped)
+            n_total = sum(int(k) for k in kept)
+            if gate is not None and gate.level == "session" and gate.min_vols is not None \
+                    and 0 < n_total < gate.min_vols:
+                reasons.append(f"retained_vols={n_total}<{gate.min_vols}")
+                excluded.extend(cands)
+                args_list, qc_after = [], True
+            row["excluded_inputs"] = ";".join(str(p) for p in excluded)
+            row["qc_reasons"] = ";".join(reasons)
+            if not args_list and qc_after:
+                print(f"[QC] {sub} {ses}: {reasons[-1]} after censoring — no output.")
+                merged_outputs.remove(out)
+                drop_output(out)
+                n_excluded += 1
+                current[(sub, ses)] = dict(row, status="excluded_motion")
+                continue
+            if not args_list:
+                print(f"[WARN] {sub} {ses}: every volume exceeds the FD threshold — no output.")
+                merged_outputs.remove(out)
+                if not args.dry_run and out.exists():
+                    out.unlink()
+                current[(sub, ses)] = dict(row, status="all_censored")
+                continue
+            tmp = out.with_name(f".tmp_{out.name}")
+            run([wb, "-cifti-merge", str(tmp)] + args_list, args.dry_run)
+            publish(tmp, out, row)
+        elif n == 1:
             src = cands[0]
-            print(f"[INFO] {sub} {ses}: 1 file → {'symlink' if args.link_single else 'copy'} → {out.name}")
-            print(f"      - {src.name}")
             if not args.dry_run:
-                if out.exists():
+                if out.exists() or out.is_symlink():
                     out.unlink()
                 out.parent.mkdir(parents=True, exist_ok=True)
-                if args.link_single:
+                if method == "symlink":
                     rel = os.path.relpath(src, start=out.parent)
                     out.symlink_to(rel)
+                elif args.precision != "float32":
+                    publish(src, out, row, keep_src=True)
                 else:
                     shutil.copy2(src, out)
-            merged_outputs.append(out)
-            rows.append([sub, ses, 1, str(out), str(src)])
-            continue
-
-        # n >= 2 → merge
-        print(f"[INFO] {sub} {ses}: {n} files → merge → {out.name}")
-        for p in cands:
-            print(f"      - {p.name}")
-
-        args_list = []
-        for pth in cands:
-            args_list.extend(["-cifti", str(pth)])
+        else:
+            # Merge into a temp name and rename, so an interrupted merge never looks complete
+            tmp = out.with_name(f".tmp_{out.name}")
+            args_list = []
+            for pth in cands:
+                args_list.extend(["-cifti", str(pth)])
+            run([wb, "-cifti-merge", str(tmp)] + args_list, args.dry_run)
+            publish(tmp, out, row)
 
-        cmd = [wb, "-cifti-merge", str(out)] + args_list
-        run(cmd, args.dry_run)
-        merged_outputs.append(out)
-        rows.append([sub, ses, n, str(out), ";".join(str(p) for p in cands)])
+        n_built += 1
+        if args.dry_run:
+            continue
+        if args.hash:
+            row["input_hashes"] = ";".join(file_hash(p) for p in cands)
+        row["output_size"] = output_size(out)
+        row["status"] = "built"
+        current[(sub, ses)] = row
+        # Checkpoint after every build so a killed job resumes where it stopped
+        write_manifest(manifest_path, [current[k] for k in sorted(current)])
 
     # Write manifest + scan list
     if not args.dry_run:
-        manifest_path.parent.mkdir(parents=True, exist_ok=True)
-        with open(manifest_path, "w", newline="") as f:
-            w = csv.writer(f)
-            w.writerow(["subject", "session", "n_inputs", "output_path", "inputs"])
-            w.writerows(rows)
+        # Drop rows for groups that no longer exist under --root
+        write_manifest(manifest_path, [current[k] for k in sorted(groups) if k in current])
 
         scan_list_path.parent.mkdir(parents=True, exist_ok=True)
         # Only include outputs that we created/would create
@@ -196,7 +585,9 @@ def main():
             for p in sorted({p.resolve() for p in merged_outputs}):
                 f.write(str(p) + "\n")
 
-    print(f"[DONE] Groups: {len(groups)}")
+    print(f"[DONE] Groups: {len(groups)}  |  {'would build' if args.dry_run else 'built'}: {n_built}"
+          f"  |  up to date: {n_current}"
+          + (f"  |  excluded by motion QC: {n_excluded}" if gate is not None else ""))
     print(f"[DONE] Manifest: {manifest_path}")
     if not args.dry_run:
         print(f"[DONE] Scan list: {scan_list_path}")
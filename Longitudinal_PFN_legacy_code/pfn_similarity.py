@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+"""
+pfn_similarity.py
+
+All-pairs similarity of personalized functional networks (PFNs) across sessions,
+the batch counterpart of PFN_Similarity_ARI.R.
+
+Every pNet output found (FN.mat under sub-<ID>_ses-<LABEL> directories of --root,
+and optionally final_UV.mat under sub-<ID> directories of --old-root) is loaded
+once and reduced to a hard parcellation (argmax over networks; vertices with no
+non-zero loading are unassigned), stored as one compact uint8 matrix
+(sessions x vertices). Requested pairs are then compared in batches:
+
+  - within:  every pair of outputs from the same subject (across sessions/pipelines)
+  - between: every pair of different subjects within the same pipeline+session
+
+For each pair: adjusted Rand index (ARI, unassigned vertices excluded, as
+mclust::adjustedRandIndex on the R side), Dice per network, and with
+--correlations the Pearson correlation of each network's soft loadings. The
+contingency tables of a whole batch of pairs come from a single bincount, and
+batches run in parallel worker processes that memory-map the label/loading
+matrices from --workdir. Output is one table, one row per pair.
+
+Example:
+  python pfn_similarity.py \
+      --root /cbica/projects/PFN_ABCD/long_PFN_scripts/pnet_outputs/Personalized_FN \
+      --old-root /cbica/projects/PFN_ABCD/old_pipeline/Personalized_FN \
+      --sessions baselineYear1Arm1 2YearFollowUpYArm1 \
+      --pairs within between --correlations \
+      --out /cbica/projects/PFN_ABCD/long_PFN_scripts/PFN_similarity.csv
+
+With --store, hard parcels and loadings are read from a cohort PFN store
+(common/pfn_store.py) instead of the .mat files. Either way --sessions filters
+new-pipeline sessions only; old-pipeline "baseline" entries are always kept.
+
+Requires scipy (MAT v5) or h5py (MAT v7.3), numpy and pandas.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+def use_common():
+    """Make the shared modules in ../common importable (a flat deployment needs nothing)."""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "common")
+    if path not in sys.path:
+        sys.path.append(path)
+
+
+# MAT readers and hard parcels are shared with the cohort store (../common/pfn_store.py)
+use_common()
+from pfn_store import N_NETWORKS, N_VERTICES, PfnStore, find_pfn_mats, hard_labels, keep_session, read_pfn_mat
+
+Record = Tuple[str, str, str, str]  # (subject, session, pipeline, path)
+
+
+def parse_args() -> argparse.Namespace:
+    ap = argparse.ArgumentParser(
+        description="All-pairs PFN similarity (ARI, per-network Dice, loading correlations)."
+    )
+    src = ap.add_mutually_exclusive_group(required=True)
+    src.add_argument("--root", help="pNet Personalized_FN directory with sub-<ID>_ses-<LABEL>/**/FN.mat.")
+    src.add_argument("--store", help="Cohort PFN store (common/pfn_store.py) to read instead of the .mat files.")
+    ap.add_argument("--old-root", default=None,
+                    help="Optional old-pipeline directory with sub-<ID>/**/final_UV.mat (session 'baseline'); "
+                         "with --store, the store's old-pipeline entries are used instead.")
+    ap.add_argument("--sessions", nargs="*", default=None,
+                    help="Keep only these new-pipeline session labels; old-pipeline 'baseline' entries are "
+                         "always kept (default: all).")
+    ap.add_argument("--pairs", nargs="+", choices=["within", "between"], default=["within", "between"],
+                    help="Which pairs to compare (default: %(default)s).")
+    ap.add_argument("--correlations", action="store_true",
+                    help="Also correlate soft loadings per network (keeps n_sessions x %d x %d float32 on disk)."
+                         % (N_NETWORKS, N_VERTICES))
+    ap.add_argument("--vertices", type=int, default=N_VERTICES,
+                    help="Vertices per PFN matrix (default: %(default)s).")
+    ap.add_argument("--networks", type=int, default=N_NETWORKS,
+                    help="Networks per PFN matrix (default: %(default)s).")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                    help="Worker processes for loading and pair batches (default: %(default)s).")
+    ap.add_argument("--batch", type=int, default=64,
+                    help="Pairs per bincount batch (default: %(default)s).")
+    ap.add_argument("--workdir", default=None,
+                    help="Directory for the memory-mapped label/loading matrices (default: a temp dir).")
+    ap.add_argument("--out", required=True, help="Output table (.csv or .parquet).")
+    args = ap.parse_args()
+    if args.store and args.old_root:
+        ap.error("--old-root cannot be used with --store (the store holds any old-pipeline entries)")
+    return args
+
+
+# ---------- loading ----------
+
+def unit_columns(M: np.ndarray) -> np.ndarray:
+    """(networks, vertices) centered, unit-norm loadings: the dot product of two is their Pearson r."""
+    X = np.where(np.isfinite(M), M, np.nan).astype(np.float64).T
+    X = X - np.nanmean(X, axis=1, keepdims=True)
+    X = np.nan_to_num(X)
+    norm = np.linalg.norm(X, axis=1, keepdims=True)
+    return (X / np.where(norm > 0, norm, np.nan)).astype(np.float32)
+
+
+def _load_one(args) -> Tuple[Optional[np.ndarray], Optional[np.ndarray], Optional[str]]:
+    """(labels, unit columns or None, None), or (None, None, error) if the file cannot be read."""
+    path, n_vertices, n_networks, with_loadings = args
+    try:
+        M = read_pfn_mat(path, n_vertices, n_networks)
+    except Exception as e:
+        return None, None, str(e)
+    return hard_labels(M), (unit_columns(M) if with_loadings else None), None
+
+
+def _compact(path: Path, keep: np.ndarray):
+    """Rewrite the .npy at path with only the rows in keep, one row at a time."""
+    src = np.load(path, mmap_mode="r")
+    tmp = path.with_name(f".compact_{path.name}")
+    dst = np.lib.format.open_memmap(tmp, mode="w+", dtype=src.dtype, shape=(keep.size,) + src.shape[1:])
+    for j, i in enumerate(keep):
+        dst[j] = src[i]
+    dst.flush()
+    del src, dst
+    os.replace(tmp, path)
+
+
+def load_cohort(records: List[Record], workdir: Path, n_vertices: int, n_networks: int,
+                with_loadings: bool, workers: int) -> Tuple[List[Record], Path, Optional[Path]]:
+    """
+    Load every record into memory-mappable .npy matrices in workdir:
+    labels.npy (sessions, vertices) uint8 and, optionally, loadings.npy
+    (sessions, networks, vertices) float32. Records that fail to load are dropped.
+    Results are written as they arrive, so only a few sessions are in memory at once.
+    """
+    labels_path = workdir / "labels.npy"
+    loadings_path = workdir / "loadings.npy" if with_loadings else None
+    labels = np.lib.format.open_memmap(labels_path, mode="w+", dtype=np.uint8,
+                                       shape=(len(records), n_vertices))
+    Z = (np.lib.format.open_memmap(loadings_path, mode="w+", dtype=np.float32,
+                                   shape=(len(records), n_networks, n_vertices))
+         if with_loadings else None)
+    ok = np.zeros(len(records), dtype=bool)
+    tasks = [(r[3], n_vertices, n_networks, with_loadings) for r in records]
+    with ProcessPoolExecutor(max_workers=max(1, workers)) as ex:
+        # map yields in order and drops each result once consumed
+        for i, (lab, z, err) in enumerate(ex.map(_load_one, tasks, chunksize=4)):
+            if err is not None:
+                print(f"[WARN] {records[i][3]}: {err}")
+                continue
+            labels[i] = lab
+            if Z is not None:
+                Z[i] = z
+            ok[i] = True
+    labels.flush()
+    if Z is not None:
+        Z.flush()
+    del labels, Z
+    if ok.all():
+        return records, labels_path, loadings_path
+
+    # Compact away the failures so row i always matches records[i]
+    keep = np.flatnonzero(ok)
+    _compact(labels_path, keep)
+    if loadings_path is not None:
+        _compact(loadings_path, keep)
+    return [records[i] for i in keep], labels_path, loadings_path
+
+
+def load_cohort_from_store(store: PfnStore, records: List[Record], workdir: Path,
+                           with_loadings: bool) -> Tuple[List[Record], Path, Optional[Path]]:
+    """As load_cohort, reading hard parcels and loadings from the store rows (records[i][3])."""
+    _, store_labels = store.arrays()
+    rows = np.array([int(r[3]) for r in records], dtype=np.int64)
+    labels_path = workdir / "labels.npy"
+    np.save(labels_path, store_labels[rows])
+    loadings_path = None
+    if with_loadings:
+        loadings_path = workdir / "loadings.npy"
+        Z = np.lib.format.open_memmap(loadings_path, mode="w+", dtype=np.float32,
+                                      shape=(len(records), len(store.networks), store.n_vertices))
+        for i, r in enumerate(records):
+            Z[i] = unit_columns(np.asarray(store.loadings(r[0], r[1], r[2]), dtype=np.float32).T)
+        Z.flush()
+    return records, labels_path, loadings_path
+
+
+# ---------- pairs ----------
+
+def make_pairs(records: List[Record], kinds: List[str]) -> Tuple[np.ndarray, List[str]]:
+    """(pairs (P, 2) of record indices with i < j, comparison kind per pair)."""
+    pairs: List[Tuple[int, int]] = []
+    kind: List[str] = []
+    if "within" in kinds:
+        by_sub: Dict[str, List[int]] = {}
+        for i, r in enumerate(records):
+            by_sub.setdefault(r[0], []).append(i)
+        for idx in by_sub.values():
+            for i, j in combinations(idx, 2):
+                pairs.append((i, j))
+                kind.append("within")
+    if "between" in kinds:
+        by_group: Dict[Tuple[str, str], List[int]] = {}
+        for i, r in enumerate(records):
+            by_group.setdefault((r[2], r[1]), []).append(i)
+        for idx in by_group.values():
+            for i, j in combinations(idx, 2):
+                if records[i][0] != records[j][0]:
+                    pairs.append((i, j))
+                    kind.append("between")
+    return np.array(pairs, dtype=np.int64).reshape(-1, 2), kind
+
+
+def _comb2(x: np.ndarray) -> np.ndarray:
+    return x * (x - 1) / 2.0
+
+
+def pair_metrics(a: np.ndarray, b: np.ndarray, n_networks: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    ARI (P,) and per-network Dice (P, networks) for label rows a, b (P, vertices).
+    All P contingency tables come from one bincount over (pair, label_a, label_b) bins;
+    vertices unassigned in either parcellation are left out.
+    """
+    P = a.shape[0]
+    nb = n_networks + 1
+    a = a.astype(np.int64)
+    b = b.astype(np.int64)
+    ok = (a > 0) & (b > 0)
+    bins = (np.arange(P, dtype=np.int64)[:, None] * (nb * nb) + a * nb + b)[ok]
+    ct = np.bincount(bins, minlength=P * nb * nb).reshape(P, nb, nb)[:, 1:, 1:].astype(np.float64)
+
+    rows, cols = ct.sum(axis=2), ct.sum(axis=1)
+    n = rows.sum(axis=1)
+    sum_ij = _comb2(ct).sum(axis=(1, 2))
+    sum_a = _comb2(rows).sum(axis=1)
+    sum_b = _comb2(cols).sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        expected = sum_a * sum_b / _comb2(n)
+        ari = (sum_ij - expected) / ((sum_a + sum_b) / 2.0 - expected)
+        diag = ct[:, np.arange(n_networks), np.arange(n_networks)]
+        dice = 2.0 * diag / (rows + cols)
+    return ari, dice
+
+
+_LABELS = None
+_LOADINGS = None
+
+
+def _init_worker(labels_path: str, loadings_path: Optional[str]):
+    global _LABELS, _LOADINGS
+    _LABELS = np.load(labels_path, mmap_mode="r")
+    _LOADINGS = np.load(loadings_path, mmap_mode="r") if loadings_path else None
+
+
+def _run_batch(args) -> Tuple[int, np.ndarray, np.ndarray, Optional[np.ndarray]]:
+    start, pairs, n_networks = args
+    i, j = pairs[:, 0], pairs[:, 1]
+    ari, dice = pair_metrics(np.asarray(_LABELS[i]), np.asarray(_LABELS[j]), n_networks)
+    corr = None
+    if _LOADINGS is not None:
+        corr = np.einsum("pkv,pkv->pk", np.asarray(_LOADINGS[i], dtype=np.float64),
+                         np.asarray(_LOADINGS[j], dtype=np.float64))
+    return start, ari, dice, corr
+
+
+def compare_pairs(pairs: np.ndarray, labels_path: Path, loadings_path: Optional[Path], n_networks: int,
+                  workers: int, batch: int):
+    """(ARI (P,), Dice (P, networks), correlations (P, networks) or None), computed in parallel batches."""
+    P = len(pairs)
+    ari = np.full(P, np.nan)
+    dice = np.full((P, n_networks), np.nan)
+    corr = np.full((P, n_networks), np.nan) if loadings_path else None
+    tasks = [(s, pairs[s:s + batch], n_networks) for s in range(0, P, max(1, batch))]
+    with ProcessPoolExecutor(max_workers=max(1, workers), initializer=_init_worker,
+                             initargs=(str(labels_path), str(loadings_path) if loadings_path else None)) as ex:
+        for k, (s, a, d, c) in enumerate(ex.map(_run_batch, tasks, chunksize=4)):
+            ari[s:s + len(a)] = a
+            dice[s:s + len(a)] = d
+            if corr is not None:
+                corr[s:s + len(a)] = c
+            if (k + 1) % 100 == 0:
+                print(f"[INFO] {min(P, s + len(a))}/{P} pairs")
+    return ari, dice, corr
+
+
+def main():
+    args = parse_args()
+    import pandas as pd
+
+    if args.store:
+        store = PfnStore(args.store)
+        records = [(sub, ses, pipeline, str(store.row(sub, ses, pipeline))) for sub, ses, pipeline in store.keys()
+                   if keep_session(ses, pipeline, args.sessions)]
+        args.networks = len(store.networks)
+        print(f"[INFO] {len(records)} entries in store {args.store}")
+    else:
+        records = find_pfn_mats(Path(args.root), Path(args.old_root) if args.old_root else None, args.sessions)
+        print(f"[INFO] Found {len(records)} PFN files")
+    if not records:
+        raise SystemExit("[ERROR] No FN.mat / final_UV.mat files found.")
+
+    with tempfile.TemporaryDirectory(dir=args.workdir) as tmp:
+        workdir = Path(tmp)
+        if args.store:
+            records, labels_path, loadings_path = load_cohort_from_store(store, records, workdir, args.correlations)
+        else:
+            records, labels_path, loadings_path = load_cohort(
+                records, workdir, args.vertices, args.networks, args.correlations, args.workers
+            )
+        print(f"[INFO] Loaded {len(records)} hard parcellations into {labels_path.name}")
+
+        pairs, kind = make_pairs(records, args.pairs)
+        print(f"[INFO] Comparing {len(pairs)} pairs ({', '.join(args.pairs)})")
+        ari, dice, corr = compare_pairs(pairs, labels_path, loadings_path, args.networks,
+                                        args.workers, args.batch)
+
+    rec = np.array(records, dtype=object).reshape(-1, 4)
+    table = {}
+    for side, col in (("i", 0), ("j", 1)):
+        r = rec[pairs[:, col]] if len(pairs) else np.empty((0, 4), dtype=object)
+        table[f"subject_{side}"] = r[:, 0]
+        table[f"session_{side}"] = r[:, 1]
+        table[f"pipeline_{side}"] = r[:, 2]
+    table["comparison"] = kind
+    table["ARI"] = ari
+    for k in range(args.networks):
+        table[f"dice_net{k + 1:02d}"] = dice[:, k]
+    if corr is not None:
+        for k in range(args.networks):
+            table[f"corr_net{k + 1:02d}"] = corr[:, k]
+    out = pd.DataFrame(table)
+
+    Path(args.out).parent.mkdir(parents=True, exist_ok=True)
+    if args.out.endswith(".parquet"):
+        out.to_parquet(args.out, index=False)
+    else:
+        out.to_csv(args.out, index=False)
+    print(f"[DONE] Wrote {len(out)} pairs -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
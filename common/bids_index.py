@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+bids_index.py
+
+Shared, persistent index of the files under one or more derivatives roots, so the
+pipeline stages query one SQLite file instead of each re-walking the same GPFS trees
+with its own glob/regex.
+
+Each file is stored with its path, parsed BIDS entities (sub, ses, task, acq, run,
+space, den, hemi, desc), suffix, extension, size and mtime. Refreshes are
+incremental by directory mtime: a directory whose mtime is unchanged since the
+last scan is not listed again (only stat'ed), so a refresh costs one stat per
+directory plus a listing of directories where files were added, removed or
+renamed. Note that an in-place rewrite of a file does not change its directory's
+mtime; use --full to re-stat everything after such changes.
+
+Build or refresh from the command line:
+  python bids_index.py --index /cbica/projects/bbl_22q/data/bids_index.sqlite \
+    --root /cbica/projects/bbl_22q/data/22q_xcpd_extracted \
+    --root /cbica/projects/bbl_22q/data/PNC_xcpd_extracted/xcpd
+
+Scripts use it through their --index option, e.g.
+  idx = BidsIndex(args.index); idx.refresh(root); files = idx.glob(root, pattern)
+"""
+
+import argparse
+import os
+import re
+import sqlite3
+import stat
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+ENTITIES = ("sub", "ses", "task", "acq", "run", "space", "den", "hemi", "desc")
+ENTITY_RE = re.compile(r"(?:^|_)(" + "|".join(ENTITIES) + r")-([A-Za-z0-9.]+?)(?=_|\.|$)")
+SUFFIX_RE = re.compile(r"_([A-Za-z0-9]+)((?:\.[A-Za-z0-9]+)+)$")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    dir TEXT NOT NULL,
+    name TEXT NOT NULL,
+    sub TEXT, ses TEXT, task TEXT, acq TEXT, run TEXT, space TEXT, den TEXT, hemi TEXT, desc TEXT,
+    suffix TEXT, ext TEXT,
+    size INTEGER, mtime_ns INTEGER
+);
+CREATE INDEX IF NOT EXISTS files_dir ON files(dir);
+CREATE INDEX IF NOT EXISTS files_sub_ses ON files(sub, ses);
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    parent TEXT,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS dirs_parent ON dirs(parent);
+"""
+
+
+def parse_entities(path: str) -> Dict[str, Optional[str]]:
+    """BIDS entities, suffix and extension from a filename; sub/ses fall back to path components."""
+    name = os.path.basename(path)
+    ents: Dict[str, Optional[str]] = {k: None for k in ENTITIES}
+    for k, v in ENTITY_RE.findall(name):
+        ents.setdefault(k, None)
+        if ents[k] is None:
+            ents[k] = v
+    for part in Path(path).parts[:-1]:
+        for k in ("sub", "ses"):
+            if ents[k] is None and re.fullmatch(rf"{k}-[A-Za-z0-9]+", part):
+                ents[k] = part[len(k) + 1:]
+    m = SUFFIX_RE.search(name)
+    ents["suffix"] = m.group(1) if m else None
+    ents["ext"] = m.group(2) if m else os.path.splitext(name)[1] or None
+    return ents
+
+
+def _under(d: str) -> str:
+    # Exact, case-sensitive prefix of everything below d (LIKE would be case-insensitive and treat _ as a wildcard)
+    return d.rstrip(os.sep) + os.sep
+
+
+class BidsIndex:
+    def __init__(self, db_path: str):
+        self.db_path = str(db_path)
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+        self.con = sqlite3.connect(self.db_path, timeout=60)
+        self.con.row_factory = sqlite3.Row
+        self.con.executescript(SCHEMA)
+
+    def close(self):
+        self.con.close()
+
+    # ---------- refresh ----------
+    def refresh(self, root, full: bool = False) -> Dict[str, int]:
+        """Bring the index in line with the tree under root; returns counters."""
+        root = os.path.abspath(str(root))
+        stats = {"dirs": 0, "listed": 0, "files": 0, "removed_dirs": 0}
+        stack = [(root, None)]
+        with self.con:
+            while stack:
+                d, parent = stack.pop()
+                try:
+                    st = os.stat(d)
+                except OSError:
+                    st = None
+                if st is None or not stat.S_ISDIR(st.st_mode):
+                    self._drop_dir(d)
+                    stats["removed_dirs"] += 1
+                    continue
+                stats["dirs"] += 1
+                mtime = st.st_mtime_ns
+                row = self.con.execute("SELECT mtime_ns FROM dirs WHERE path=?", (d,)).fetchone()
+                if row is not None and row["mtime_ns"] == mtime and not full:
+                    # Unchanged listing: reuse the known subdirectories
+                    for sub in self.con.execute("SELECT path FROM dirs WHERE parent=?", (d,)):
+                        stack.append((sub["path"], d))
+                    continue
+                subdirs = self._list_dir(d, stats)
+                known = {r["path"] for r in self.con.execute("SELECT path FROM dirs WHERE parent=?", (d,))}
+                for gone in known - set(subdirs):
+                    self._drop_dir(gone)
+                    stats["removed_dirs"] += 1
+                self.con.execute(
+                    "INSERT INTO dirs(path, parent, mtime_ns) VALUES (?, ?, ?) "
+                    "ON CONFLICT(path) DO UPDATE SET parent=excluded.parent, mtime_ns=excluded.mtime_ns",
+                    (d, parent, mtime),
+                )
+                stack.extend((s, d) for s in subdirs)
+        return stats
+
+    def _list_dir(self, d: str, stats: Dict[str, int]) -> List[str]:
+        subdirs, rows = [], []
+        try:
+            entries = list(os.scandir(d))
+        except OSError:
+            entries = []
+        for e in entries:
+            if e.is_dir(follow_symlinks=False):
+                subdirs.append(e.path)
+                continue
+            try:
+                st = e.stat()  # follows symlinks (e.g. DataLad annexed files)
+                size, mtime = st.st_size, st.st_mtime_ns
+            except OSError:
+                size = mtime = None  # broken symlink / content not retrieved
+            ents = parse_entities(e.path)
+            rows.append((e.path, d, e.name, *(ents[k] for k in ENTITIES), ents["suffix"], ents["ext"], size, mtime))
+        self.con.execute("DELETE FROM files WHERE dir=?", (d,))
+        self.con.executemany(
+            f"INSERT OR REPLACE INTO files VALUES ({','.join('?' * (5 + len(ENTITIES) + 2))})", rows
+        )
+        stats["listed"] += 1
+        stats["files"] += len(rows)
+        return subdirs
+
+    def _drop_dir(self, d: str):
+        prefix = _under(d)
+        self.con.execute("DELETE FROM files WHERE dir=? OR substr(dir, 1, ?)=?", (d, len(prefix), prefix))
+        self.con.execute("DELETE FROM dirs WHERE path=? OR substr(path, 1, ?)=?", (d, len(prefix), prefix))
+
+    # ---------- queries ----------
+    def glob(self, root, pattern: str, recursive: bool = True) -> List[Path]:
+        """Files under root whose *name* matches pattern (like Path.rglob, or glob in root if not recursive)."""
+        root = os.path.abspath(str(root))
+        if recursive:
+            prefix = _under(root)
+            cur = self.con.execute(
+                "SELECT path FROM files WHERE (dir=? OR substr(dir, 1, ?)=?) AND name GLOB ? ORDER BY path",
+                (root, len(prefix), prefix, pattern),
+            )
+        else:
+            cur = self.con.execute(
+                "SELECT path FROM files WHERE dir=? AND name GLOB ? ORDER BY path", (root, pattern)
+            )
+        return [Path(r["path"]) for r in cur]
+
+    def query(self, root=None, name_glob: Optional[str] = None, **entities) -> List[sqlite3.Row]:
+        """Rows filtered by entity values (e.g. sub="01", suffix="motion"); None means unconstrained."""
+        where, params = [], []
+        if root is not None:
+            root = os.path.abspath(str(root))
+            prefix = _under(root)
+            where.append("(dir=? OR substr(dir, 1, ?)=?)")
+            params += [root, len(prefix), prefix]
+        if name_glob:
+            where.append("name GLOB ?")
+            params.append(name_glob)
+        for k, v in entities.items():
+            if k not in ENTITIES + ("suffix", "ext"):
+                raise ValueError(f"Unknown entity: {k}")
+            if v is not None:
+                where.append(f"{k}=?")
+                params.append(v)
+        sql = "SELECT * FROM files" + (" WHERE " + " AND ".join(where) if where else "") + " ORDER BY path"
+        return list(self.con.execute(sql, params))
+
+
+def indexed_glob(index_path: str, root, pattern: str, recursive: bool = True) -> List[Path]:
+    """Refresh the index for root and return matching files: a drop-in for sorted(root.rglob(pattern))."""
+    idx = BidsIndex(index_path)
+    try:
+        idx.refresh(root)
+        return idx.glob(root, pattern, recursive=recursive)
+    finally:
+        idx.close()
+
+
+def main(argv: Optional[Iterable[str]] = None):
+    ap = argparse.ArgumentParser(description="Build or incrementally refresh a BIDS file index (SQLite).")
+    ap.add_argument("--index", required=True, help="SQLite index path (created if missing).")
+    ap.add_argument("--root", action="append", required=True, help="Root directory to index (repeatable).")
+    ap.add_argument("--full", action="store_true",
+                    help="Re-list every directory, ignoring directory mtimes.")
+    args = ap.parse_args(argv)
+
+    idx = BidsIndex(args.index)
+    for root in args.root:
+        t0 = time.time()
+        s = idx.refresh(root, full=args.full)
+        print(f"[OK] {root}: {s['dirs']} dirs ({s['listed']} re-listed), {s['files']} files updated, "
+              f"{s['removed_dirs']} dirs removed in {time.time() - t0:.1f}s")
+    idx.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+bids_zip.py
+
+Read BABS output archives (one zip per subject/session, e.g.
+sub-X_ses-Y_xcpd-0-0-0.zip) in place, without unpacking them first.
+
+Members are listed from each archive's central directory and addressed as
+"<archive>.zip!<member>" (e.g. .../sub-1_ses-1_xcpd-0-0-0.zip!xcpd/sub-1/ses-1/func/..._motion.tsv),
+so they can travel through the same code paths as ordinary file paths:
+
+  find_members(root, pattern)   member paths matching a BIDS-relative glob
+  read_bytes(path)              member (or plain file) contents, in memory
+  stat_path(path)               size / mtime_ns (member size, archive mtime)
+  extract(path, dest)           copy one member to disk, for tools like wb_command
+                                that need a real file; skipped if already cached
+
+A root is treated as archives if it is a .zip file, or a directory holding *.zip
+files at its top level. With DataLad datasets, run `datalad get` on the archives
+first; archives that cannot be opened are reported and skipped.
+"""
+
+import fnmatch
+import glob
+import os
+import zipfile
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import PurePosixPath
+from typing import List, Optional, Tuple
+
+MEMBER_SEP = "!"
+FileStat = namedtuple("FileStat", ["st_size", "st_mtime_ns"])
+
+
+def list_archives(root: str) -> List[str]:
+    root = str(root)
+    if root.endswith(".zip") and os.path.isfile(root):
+        return [os.path.abspath(root)]
+    if os.path.isdir(root):
+        return sorted(os.path.abspath(p) for p in glob.glob(os.path.join(root, "*.zip")))
+    return []
+
+
+def is_archive_root(root) -> bool:
+    return bool(list_archives(str(root)))
+
+
+def split_member(path: str) -> Tuple[str, Optional[str]]:
+    """(archive, member) for an archive member path, (path, None) for a plain file."""
+    path = str(path)
+    head, sep, tail = path.partition(".zip" + MEMBER_SEP)
+    if not sep:
+        return path, None
+    return head + ".zip", tail
+
+
+def _archive_members(archive: str, pattern: str) -> List[str]:
+    try:
+        with zipfile.ZipFile(archive) as zf:
+            infos = zf.infolist()
+    except (OSError, zipfile.BadZipFile) as e:
+        print(f"[WARN] Cannot read archive {archive}: {e}")
+        return []
+    # A pattern without "/" matches member names; otherwise it is matched against
+    # the trailing components of the member path (as PurePath.match does)
+    by_name = "/" not in pattern
+    out = []
+    for info in infos:
+        if info.is_dir():
+            continue
+        member = PurePosixPath(info.filename)
+        if fnmatch.fnmatchcase(member.name, pattern) if by_name else member.match(pattern):
+            out.append(archive + MEMBER_SEP + info.filename)
+    return out
+
+
+def find_members(root, pattern: str, workers: int = 8) -> List[str]:
+    """Sorted member paths matching pattern across every archive under root."""
+    archives = list_archives(str(root))
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(archives) or 1))) as ex:
+        found = ex.map(lambda a: _archive_members(a, pattern), archives)
+    return sorted(p for members in found for p in members)
+
+
+def read_bytes(path: str) -> bytes:
+    archive, member = split_member(path)
+    if member is None:
+        with open(archive, "rb") as f:
+            return f.read()
+    with zipfile.ZipFile(archive) as zf:
+        return zf.read(member)
+
+
+def stat_path(path: str) -> FileStat:
+    archive, member = split_member(path)
+    st = os.stat(archive)
+    if member is None:
+        return FileStat(st.st_size, st.st_mtime_ns)
+    with zipfile.ZipFile(archive) as zf:
+        return FileStat(zf.getinfo(member).file_size, st.st_mtime_ns)
+
+
+def path_exists(path: str) -> bool:
+    try:
+        stat_path(path)
+    except (OSError, KeyError, zipfile.BadZipFile):
+        return False
+    return True
+
+
+def extract(path: str, dest: str) -> str:
+    """
+    Write one member to dest (temp file + rename) and stamp it with the archive's
+    mtime, so a later call with an unchanged archive reuses the cached copy.
+    """
+    archive, member = split_member(path)
+    if member is None:
+        raise ValueError(f"Not an archive member path: {path}")
+    mtime = os.stat(archive).st_mtime_ns
+    with zipfile.ZipFile(archive) as zf:
+        info = zf.getinfo(member)
+        try:
+            st = os.stat(dest)
+            if st.st_size == info.file_size and st.st_mtime_ns == mtime:
+                return dest
+        except OSError:
+            pass
+        os.makedirs(os.path.dirname(os.path.abspath(dest)) or ".", exist_ok=True)
+        tmp = f"{dest}.tmp{os.getpid()}"
+        with zf.open(info) as src, open(tmp, "wb") as out:
+            while True:
+                chunk = src.read(1 << 20)
+                if not chunk:
+                    break
+                out.write(chunk)
+    os.utime(tmp, ns=(mtime, mtime))
+    os.replace(tmp, dest)
+    return dest
@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+"""
+cifti_io.py
+
+Lazy readers for CIFTI-2 (.dtseries/.dscalar/.dlabel.nii) and GIFTI (.gii) files,
+shared by the area engine, the PFN store, the merge tool and reduced_precision, so
+that looking at a header or a slice of data never needs a wb_command process.
+
+  CiftiFile(path)   reads only the NIfTI-2 header and the CIFTI XML extension.
+                    .shape is (rows, grayordinates); .series, .map_names,
+                    .label_tables and .brain_models describe the two axes; .data
+                    memory-maps the (uncompressed) data block and applies
+                    scl_slope/scl_inter only to the slices that are read.
+  GiftiFile(path)   parses the XML; each DataArray's header is available at once
+                    and its data is decoded (or memory-mapped, for external
+                    binary files) on first access.
+
+open_dscalar, load_labels and read_network_dscalars are the readers the pipeline
+scripts use; write_dscalar_like writes through nibabel, like every other writer here,
+and DscalarBlockWriter fills a single-map dscalar block by block.
+
+  python cifti_io.py FILE...   prints a one-line summary of each file's header.
+"""
+
+import base64
+import os
+import struct
+import sys
+import xml.etree.ElementTree as ET
+import zlib
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+NIFTI2_HEADER_SIZE = 540
+CIFTI_ECODE = 32
+NIFTI_DTYPES = {2: "u1", 4: "i2", 8: "i4", 16: "f4", 64: "f8", 256: "i1", 512: "u2", 768: "u4",
+                1024: "i8", 1280: "u8"}
+GIFTI_DTYPES = {"NIFTI_TYPE_UINT8": "u1", "NIFTI_TYPE_INT8": "i1", "NIFTI_TYPE_INT16": "i2",
+                "NIFTI_TYPE_UINT16": "u2", "NIFTI_TYPE_INT32": "i4", "NIFTI_TYPE_UINT32": "u4",
+                "NIFTI_TYPE_INT64": "i8", "NIFTI_TYPE_FLOAT32": "f4", "NIFTI_TYPE_FLOAT64": "f8"}
+HEMI_CODES = {"CIFTI_STRUCTURE_CORTEX_LEFT": 0, "CIFTI_STRUCTURE_CORTEX_RIGHT": 1}
+
+
+# ---------- CIFTI-2 ----------
+
+class BrainModel:
+    """One structure of a brain-models axis; vertex/voxel indices are parsed on first use."""
+
+    def __init__(self, elem: ET.Element):
+        self.structure = elem.get("BrainStructure")
+        self.model_type = elem.get("ModelType")
+        self.offset = int(elem.get("IndexOffset"))
+        self.count = int(elem.get("IndexCount"))
+        n = elem.get("SurfaceNumberOfVertices")
+        self.n_vertices = int(n) if n is not None else None
+        self._elem = elem
+
+    @property
+    def slice(self) -> slice:
+        return slice(self.offset, self.offset + self.count)
+
+    @property
+    def vertices(self) -> Optional[np.ndarray]:
+        node = self._elem.find("VertexIndices")
+        return None if node is None else np.array((node.text or "").split(), dtype=np.int64)
+
+    @property
+    def voxels(self) -> Optional[np.ndarray]:
+        node = self._elem.find("VoxelIndicesIJK")
+        return None if node is None else np.array((node.text or "").split(), dtype=np.int64).reshape(-1, 3)
+
+    def __repr__(self):
+        return f"BrainModel({self.structure}, {self.offset}+{self.count})"
+
+
+class LazyData:
+    """(rows, columns) view of a memory-mapped CIFTI data block; slicing reads only what is asked for."""
+
+    def __init__(self, raw: np.memmap, slope: float, inter: float):
+        self.raw = raw
+        self.shape = raw.shape
+        self.ndim = 2
+        self.scaled = not (slope in (0.0, 1.0) or np.isnan(slope)) or (inter != 0.0 and not np.isnan(inter))
+        self.slope = 1.0 if slope == 0.0 or np.isnan(slope) else slope
+        self.inter = 0.0 if np.isnan(inter) else inter
+        self.dtype = np.dtype(np.float64) if self.scaled else raw.dtype.newbyteorder("=")
+
+    def __getitem__(self, idx) -> np.ndarray:
+        block = self.raw[idx]
+        if self.scaled:
+            return np.asarray(block, dtype=np.float64) * self.slope + self.inter
+        return np.asarray(block, dtype=self.dtype)
+
+    def __array__(self, dtype=None, copy=None):
+        out = self[:, :]
+        return out if dtype is None else out.astype(dtype, copy=False)
+
+
+class CiftiFile:
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            hdr = f.read(NIFTI2_HEADER_SIZE + 4)
+            if len(hdr) < NIFTI2_HEADER_SIZE:
+                raise ValueError(f"{self.path}: too short for a NIfTI-2 header")
+            if hdr[:2] == b"\x1f\x8b":
+                raise ValueError(f"{self.path}: gzipped; CIFTI data must be uncompressed")
+            for endian in ("<", ">"):
+                if struct.unpack(endian + "i", hdr[:4])[0] == NIFTI2_HEADER_SIZE:
+                    break
+            else:
+                raise ValueError(f"{self.path}: not a NIfTI-2 file")
+            self.endian = endian
+            datatype = struct.unpack(endian + "h", hdr[12:14])[0]
+            dim = struct.unpack(endian + "8q", hdr[16:80])
+            self.vox_offset = struct.unpack(endian + "q", hdr[168:176])[0]
+            self.slope, self.inter = struct.unpack(endian + "2d", hdr[176:192])
+            self.intent_code = struct.unpack(endian + "i", hdr[504:508])[0]
+            if datatype not in NIFTI_DTYPES:
+                raise ValueError(f"{self.path}: unsupported NIfTI datatype {datatype}")
+            self.dtype = np.dtype(endian + NIFTI_DTYPES[datatype])
+            # CIFTI: dim[5] rows (maps / time points), dim[6] columns (grayordinates)
+            self.shape = (int(dim[5]), int(dim[6]) if dim[0] >= 6 else 1)
+
+            xml = None
+            if len(hdr) == NIFTI2_HEADER_SIZE + 4 and hdr[NIFTI2_HEADER_SIZE] != 0:
+                pos = NIFTI2_HEADER_SIZE + 4
+                while pos + 8 <= self.vox_offset:
+                    f.seek(pos)
+                    esize, ecode = struct.unpack(endian + "2i", f.read(8))
+                    if esize < 8:
+                        break
+                    if ecode == CIFTI_ECODE:
+                        xml = f.read(esize - 8).rstrip(b"\x00")
+                        break
+                    pos += esize
+        if xml is None:
+            raise ValueError(f"{self.path}: no CIFTI extension")
+        root = ET.fromstring(xml)
+        self.version = root.get("Version")
+        self.matrix = root.find("Matrix")
+        self.maps: Dict[int, ET.Element] = {}
+        for m in self.matrix.findall("MatrixIndicesMap"):
+            for d in m.get("AppliesToMatrixDimension").split(","):
+                self.maps[int(d)] = m
+        self._data = None
+
+    # --- axes ---
+    def index_type(self, dim: int) -> str:
+        return self.maps[dim].get("IndicesMapToDataType").replace("CIFTI_INDEX_TYPE_", "")
+
+    @property
+    def metadata(self) -> Dict[str, str]:
+        return _metadata(self.matrix.find("MetaData"))
+
+    @property
+    def series(self) -> Optional[Dict[str, float]]:
+        """start, step, n and unit of a series row axis (dtseries), else None."""
+        m = self.maps.get(0)
+        if m is None or self.index_type(0) != "SERIES":
+            return None
+        scale = 10.0 ** int(m.get("SeriesExponent", "0"))
+        return {"start": float(m.get("SeriesStart")) * scale, "step": float(m.get("SeriesStep")) * scale,
+                "n": int(m.get("NumberOfSeriesPoints")), "unit": m.get("SeriesUnit")}
+
+    @property
+    def map_names(self) -> List[str]:
+        m = self.maps.get(0)
+        if m is None or self.index_type(0) not in ("SCALARS", "LABELS"):
+            return []
+        return [(nm.findtext("MapName") or "") for nm in m.findall("NamedMap")]
+
+    @property
+    def label_tables(self) -> List[Dict[int, str]]:
+        """{key: label name} per map of a dlabel file."""
+        m = self.maps.get(0)
+        if m is None or self.index_type(0) != "LABELS":
+            return []
+        return [{int(lb.get("Key")): (lb.text or "") for lb in nm.iter("Label")} for nm in m.findall("NamedMap")]
+
+    @property
+    def brain_models(self) -> List[BrainModel]:
+        m = self.maps.get(1)
+        if m is None or self.index_type(1) != "BRAIN_MODELS":
+            return []
+        return [BrainModel(bm) for bm in m.findall("BrainModel")]
+
+    def hemi(self) -> np.ndarray:
+        """Hemisphere code per grayordinate: 0=L, 1=R, -1=other."""
+        hemi = np.full(self.shape[1], -1, dtype=np.int8)
+        for bm in self.brain_models:
+            if bm.structure in HEMI_CODES:
+                hemi[bm.slice] = HEMI_CODES[bm.structure]
+        return hemi
+
+    def grayordinates_key(self) -> Tuple:
+        """Structures and sizes of the brain-models axis, for checking that files can be combined."""
+        return tuple((bm.structure, bm.count) for bm in self.brain_models)
+
+    # --- data ---
+    @property
+    def data(self) -> LazyData:
+        if self._data is None:
+            need = self.vox_offset + self.shape[0] * self.shape[1] * self.dtype.itemsize
+            if os.path.getsize(self.path) < need:
+                raise ValueError(f"{self.path}: data block is truncated")
+            # NIfTI order: the row index (time / map) varies fastest
+            raw = np.memmap(self.path, dtype=self.dtype, mode="r", offset=self.vox_offset,
+                            shape=self.shape, order="F")
+            self._data = LazyData(raw, self.slope, self.inter)
+        return self._data
+
+    def describe(self) -> str:
+        kind = self.index_type(0) if 0 in self.maps else "?"
+        s = self.series
+        extra = f" TR={s['step']:g}{s['unit'][0].lower()}" if s else ""
+        structs = ", ".join(f"{bm.structure.replace('CIFTI_STRUCTURE_', '')}:{bm.count}" for bm in self.brain_models)
+        return f"{self.path.name}: {kind} {self.shape[0]}x{self.shape[1]} {self.dtype.name}{extra} [{structs}]"
+
+
+def _metadata(node: Optional[ET.Element]) -> Dict[str, str]:
+    if node is None:
+        return {}
+    return {md.findtext("Name") or "": md.findtext("Value") or "" for md in node.findall("MD")}
+
+
+# ---------- GIFTI ----------
+
+class GiftiArray:
+    def __init__(self, elem: ET.Element, base: Path):
+        self.intent = elem.get("Intent")
+        self.dtype = np.dtype(("<" if elem.get("Endian", "LittleEndian") == "LittleEndian" else ">")
+                              + GIFTI_DTYPES[elem.get("DataType")])
+        n_dim = int(elem.get("Dimensionality", "1"))
+        self.shape = tuple(int(elem.get(f"Dim{i}")) for i in range(n_dim))
+        self.order = "F" if elem.get("ArrayIndexingOrder") == "ColumnMajorOrder" else "C"
+        self.encoding = elem.get("Encoding")
+        self.metadata = _metadata(elem.find("MetaData"))
+        self._external = (base / elem.get("ExternalFileName", ""), int(elem.get("ExternalFileOffset") or 0))
+        self._text = elem.findtext("Data") or ""
+        self._data = None
+
+    @property
+    def data(self) -> np.ndarray:
+        if self._data is None:
+            n = int(np.prod(self.shape))
+            if self.encoding == "ExternalFileBinary":
+                path, offset = self._external
+                arr = np.memmap(path, dtype=self.dtype, mode="r", offset=offset, shape=self.shape, order=self.order)
+            elif self.encoding == "ASCII":
+                arr = np.array(self._text.split(), dtype=self.dtype)[:n].reshape(self.shape, order=self.order)
+            else:
+                raw = base64.b64decode(self._text)
+                if self.encoding == "GZipBase64Binary":
+                    raw = zlib.decompress(raw)
+                arr = np.frombuffer(raw, dtype=self.dtype, count=n).reshape(self.shape, order=self.order)
+            self._data = arr
+            self._text = ""
+        return self._data
+
+
+class GiftiFile:
+    def __init__(self, path):
+        self.path = Path(path)
+        root = ET.parse(self.path).getroot()
+        self.metadata = _metadata(root.find("MetaData"))
+        self.labels = {int(lb.get("Key")): (lb.text or "") for lb in root.iterfind("LabelTable/Label")}
+        self.arrays = [GiftiArray(e, self.path.parent) for e in root.findall("DataArray")]
+
+    def describe(self) -> str:
+        arrays = ", ".join(f"{(a.intent or '').replace('NIFTI_INTENT_', '')}{list(a.shape)}" for a in self.arrays)
+        return f"{self.path.name}: GIFTI [{arrays}]"
+
+
+def open_image(path):
+    return GiftiFile(path) if str(path).endswith(".gii") else CiftiFile(path)
+
+
+# ---------- pipeline helpers ----------
+
+def open_dscalar(path):
+    """
+    (lazy array of shape (n_maps, n_grayordinates), hemisphere code per grayordinate:
+    0=L, 1=R, -1=other). Slicing the array reads only the requested vertices from disk.
+    """
+    img = CiftiFile(path)
+    return img.data, img.hemi()
+
+
+def load_labels(path):
+    """Hard parcellation from a .dlabel.nii: (label key per grayordinate, {key: name})."""
+    img = CiftiFile(path)
+    keys = np.asarray(img.data[0]).astype(np.int64)
+    tables = img.label_tables
+    return keys, (tables[0] if tables else {})
+
+
+def read_network_dscalars(paths) -> np.ndarray:
+    """(networks, vertices) float32 from one single-map dscalar per network."""
+    return np.stack([np.asarray(CiftiFile(p).data[0], dtype=np.float32) for p in paths])
+
+
+def write_dscalar_like(template, data: np.ndarray, out_dscalar, names: Optional[List[str]] = None):
+    """
+    Write one map (n_grayordinates,), or several (n_maps, n_grayordinates) named by names,
+    as a dscalar with the template's grayordinates (temp file + rename).
+    """
+    import nibabel as nib
+    out_dscalar = Path(out_dscalar)
+    img = nib.load(str(template))
+    data = np.asarray(data, dtype=np.float32)
+    if data.ndim == 1:
+        data = data[None, :]
+    if names is None and data.shape[0] == 1:
+        header = img.header
+    else:
+        names = names or [f"#{i + 1}" for i in range(data.shape[0])]
+        if len(names) != data.shape[0]:
+            raise ValueError(f"{len(names)} map names for {data.shape[0]} maps")
+        header = nib.cifti2.Cifti2Header.from_axes((nib.cifti2.ScalarAxis(names), img.header.get_axis(1)))
+    out = nib.Cifti2Image(data, header=header, nifti_header=img.nifti_header)
+    tmp = out_dscalar.with_name(f".{out_dscalar.stem}.tmp{os.getpid()}.dscalar.nii")
+    nib.save(out, str(tmp))
+    os.replace(tmp, out_dscalar)
+
+class DscalarBlockWriter:
+    """
+    A single-map float32 dscalar with the template's grayordinates, written block by
+    block: writer[start:stop] = values, then close() renames it into place (discard()
+    drops it). nibabel writes the header and a zero data block from a broadcast view,
+    so no full-length map is ever allocated.
+    """
+
+    def __init__(self, template, out_dscalar):
+        import nibabel as nib
+        self.path = Path(out_dscalar)
+        self.tmp = self.path.with_name(f".{self.path.stem}.tmp{os.getpid()}.dscalar.nii")
+        img = nib.load(str(template))
+        n = img.header.get_axis(1).size
+        nib.save(nib.Cifti2Image(np.broadcast_to(np.float32(0), (1, n)), header=img.header,
+                                 nifti_header=img.nifti_header), str(self.tmp))
+        written = CiftiFile(self.tmp)
+        self.data = np.memmap(self.tmp, dtype=written.dtype, mode="r+", offset=written.vox_offset,
+                              shape=written.shape, order="F")
+
+    def __setitem__(self, idx, values):
+        self.data[0, idx] = values
+
+    def close(self):
+        self.data.flush()
+        del self.data
+        os.replace(self.tmp, self.path)
+
+    def discard(self):
+        self.data = None
+        self.tmp.unlink(missing_ok=True)
+
+
+if __name__ == "__main__":
+    status = 0
+    for p in sys.argv[1:]:
+        try:
+            print(open_image(p).describe())
+        except (OSError, ValueError, KeyError, ET.ParseError) as e:
+            print(f"[FAIL] {p}: {e}")
+            status = 1
+    sys.exit(status)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+motion_qc.py
+
+Motion-based inclusion criteria for staging and merging dtseries, read from the FD
+summary CSV written by 2_QC_and_demographics/fd_summary_from_xcpd.py (or its
+mean/median wrappers): one row per (sub, ses) with per-task columns
+(mean_fd_<task>, median_fd_<task>, n_vols_<task>, n_fd_gt_<t>_<task>) and
+session-wide ones (mean_fd_combined, median_fd_combined, n_vols_total, ...).
+
+Criteria (each optional): mean FD, median FD and a minimum number of retained
+volumes. At --qc-level session the combined columns decide for the whole session;
+at --qc-level scan each scan is judged by the columns of its task- entity. When
+volumes will be censored at an FD threshold t and the summary has n_fd_gt_<t>
+columns, retained volumes are counted as n_vols - n_fd_gt_<t>.
+
+Scans or sessions without a summary row are excluded, since they cannot be checked.
+
+Scripts add the options with add_motion_args(ap) and build a gate with
+MotionGate.from_args(args); gate.check(sub, ses, task) returns None to keep, or the
+reason for excluding.
+"""
+
+import argparse
+import csv
+import math
+import re
+from typing import Dict, List, Optional, Tuple
+
+TASK_RE = re.compile(r"(?:^|_)task-([A-Za-z0-9]+)")
+
+
+def add_motion_args(ap: argparse.ArgumentParser):
+    g = ap.add_argument_group("motion QC (needs --fd-summary)")
+    g.add_argument("--fd-summary", default=None,
+                   help="FD summary CSV from fd_summary_from_xcpd.py; enables the criteria below.")
+    g.add_argument("--max-mean-fd", type=float, default=None,
+                   help="Exclude if mean FD is above this value.")
+    g.add_argument("--max-median-fd", type=float, default=None,
+                   help="Exclude if median FD is above this value.")
+    g.add_argument("--min-vols", type=int, default=None,
+                   help="Exclude if fewer volumes than this are retained.")
+    g.add_argument("--qc-level", choices=["session", "scan"], default="session",
+                   help="Judge whole sessions (combined columns) or each scan by its task's columns "
+                        "(default: %(default)s).")
+
+
+def _prefixed(label: str, prefix: str) -> str:
+    return label if label.startswith(prefix + "-") else f"{prefix}-{label}"
+
+
+def _float(x) -> float:
+    try:
+        return float(x)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def load_fd_summary(path: str) -> Tuple[Dict[Tuple[str, str], Dict[str, str]], List[str]]:
+    """(rows keyed by ("sub-X", "ses-Y"), column names) of an FD summary CSV."""
+    with open(path, newline="") as f:
+        reader = csv.DictReader(f)
+        rows = {(_prefixed(r["sub"], "sub"), _prefixed(r["ses"], "ses")): r for r in reader}
+        return rows, list(reader.fieldnames or [])
+
+
+class MotionGate:
+    def __init__(self, summary_path: str, max_mean_fd: Optional[float] = None,
+                 max_median_fd: Optional[float] = None, min_vols: Optional[int] = None,
+                 level: str = "session", fd_threshold: Optional[float] = None):
+        self.rows, self.columns = load_fd_summary(summary_path)
+        self.max_mean_fd = max_mean_fd
+        self.max_median_fd = max_median_fd
+        self.min_vols = min_vols
+        self.level = level
+        self.fd_threshold = fd_threshold
+        self.by_sub: Dict[str, List[Tuple[str, str]]] = {}
+        for key in self.rows:
+            self.by_sub.setdefault(key[0], []).append(key)
+        if level == "session":
+            needed = [c for c, v in (("mean_fd_combined", max_mean_fd), ("median_fd_combined", max_median_fd),
+                                     ("n_vols_total", min_vols)) if v is not None]
+            missing = [c for c in needed if c not in self.columns]
+            if missing:
+                raise ValueError(f"{summary_path}: missing column(s) {', '.join(missing)}")
+
+    @classmethod
+    def from_args(cls, args, fd_threshold: Optional[float] = None) -> Optional["MotionGate"]:
+        if not args.fd_summary:
+            return None
+        return cls(args.fd_summary, args.max_mean_fd, args.max_median_fd, args.min_vols,
+                   args.qc_level, fd_threshold)
+
+    def describe(self) -> str:
+        """Criteria as a compact string, recorded in manifests so changed criteria force a rebuild."""
+        parts = [f"level={self.level}"]
+        for name, v in (("max_mean_fd", self.max_mean_fd), ("max_median_fd", self.max_median_fd),
+                        ("min_vols", self.min_vols)):
+            if v is not None:
+                parts.append(f"{name}={v:g}")
+        return ",".join(parts)
+
+    def row(self, sub: str, ses: Optional[str]) -> Optional[Dict[str, str]]:
+        """Summary row for (sub, ses); without a session, the subject's only row (if unique)."""
+        sub = _prefixed(sub, "sub")
+        if ses:
+            return self.rows.get((sub, _prefixed(ses, "ses")))
+        keys = self.by_sub.get(sub, [])
+        return self.rows[keys[0]] if len(keys) == 1 else None
+
+    def check(self, sub: str, ses: Optional[str], task: Optional[str] = None) -> Optional[str]:
+        """None if (sub, ses) — or, at scan level, its task — meets every criterion; else the reason."""
+        row = self.row(sub, ses)
+        if row is None:
+            return "no FD summary row"
+        if self.level == "scan":
+            if not task:
+                return "no task entity"
+            suffix, n_col = task, f"n_vols_{task}"
+        else:
+            suffix, n_col = "combined", "n_vols_total"
+
+        reasons = []
+        for stat, limit in (("mean_fd", self.max_mean_fd), ("median_fd", self.max_median_fd)):
+            if limit is None:
+                continue
+            col = f"{stat}_{suffix}"
+            v = _float(row.get(col))
+            if math.isnan(v):
+                reasons.append(f"no {col}")
+            elif v > limit:
+                reasons.append(f"{col}={v:.3f}>{limit:g}")
+        if self.min_vols is not None:
+            n = _float(row.get(n_col))
+            if math.isnan(n):
+                reasons.append(f"no {n_col}")
+            else:
+                censored = _float(row.get(f"n_fd_gt_{self.fd_threshold:g}_{suffix}")) \
+                    if self.fd_threshold is not None else math.nan
+                kept = n - censored if not math.isnan(censored) else n
+                if kept < self.min_vols:
+                    reasons.append(f"retained_vols={kept:.0f}<{self.min_vols}")
+        return ", ".join(reasons) or None
+
+
+def scan_task(name: str) -> Optional[str]:
+    m = TASK_RE.search(name)
+    return m.group(1) if m else None
@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+"""
+pfn_store.py
+
+Cohort-level store of personalized functional network (PFN) loadings, so area
+weighting, similarity and later analyses read one memory-mapped array instead of
+re-parsing thousands of FN.mat files or per-network dscalars.
+
+A store is a directory:
+  store.json    network labels, vertex count, loading dtype, row capacity
+  subjects.tsv  subject index, append-only: row, sub, ses, pipeline, source, size, mtime_ns
+                (a re-added entry is written to a fresh row and appends a new line; the
+                last line for a key wins, and its old row is left unused)
+  loadings.npy  (capacity, networks, vertices) soft loadings, float16 (default) or float32
+  labels.npy    (capacity, vertices) uint8 hard parcels: argmax network, 1-based; 0 = unassigned
+
+Each subject's loadings are one contiguous block, so reading a subject, or a vertex
+slice of it, touches only those bytes. The arrays grow by doubling their capacity.
+Entries are filled incrementally: data is written before its index line, and inputs
+whose size and mtime match the index are skipped on re-runs. One writer at a time.
+
+Fill from pNet outputs (sub-<ID>_ses-<LABEL>/**/FN.mat) or from per-network dscalars
+(<dir>/sub-<ID>/*.dscalar.nii, as read by the area scripts):
+  python pfn_store.py --store /cbica/projects/PFN_ABCD/pfn_store \
+    --mat-root /cbica/projects/PFN_ABCD/long_PFN_scripts/pnet_outputs/Personalized_FN
+  python pfn_store.py --store /cbica/projects/bbl_22q/analysis/allometry/inputs/PNC_PFN_store \
+    --dscalar-root /cbica/projects/bbl_22q/analysis/allometry/inputs/PNC_PFN_loadings_normed --ses PNC1
+
+Read:
+  store = PfnStore(path)
+  W = store.loadings("0001", "PNC1")     # (networks, vertices) memory-mapped view
+  labels = store.labels("0001", "PNC1")  # (vertices,) uint8
+"""
+
+import argparse
+import csv
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from cifti_io import read_network_dscalars
+
+INDEX_FIELDS = ["row", "sub", "ses", "pipeline", "source", "size", "mtime_ns"]
+Key = Tuple[str, str, str]  # (sub, ses, pipeline)
+
+N_VERTICES = 59412
+N_NETWORKS = 17
+PREFERRED_KEYS = ("FN", "final_UV", "U", "UV", "V")
+SUB_SES_DIR_RE = re.compile(r"sub-([A-Za-z0-9]+)[_+]ses-([A-Za-z0-9]+)")
+SUB_DIR_RE = re.compile(r"^sub-([A-Za-z0-9]+)$")
+
+
+# ---------- readers ----------
+
+def _pick_matrix(cands: Dict[str, np.ndarray], n_vertices: int, n_networks: int) -> np.ndarray:
+    """The (vertices, networks) matrix among the candidates, transposing if stored the other way."""
+    low = [k.lower() for k in PREFERRED_KEYS]
+
+    def rank(name: str) -> int:
+        return low.index(name.lower()) if name.lower() in low else len(low)
+
+    for name in sorted(cands, key=rank):
+        M = cands[name]
+        if M.shape == (n_vertices, n_networks):
+            return M
+        if M.shape == (n_networks, n_vertices):
+            return M.T
+    dims = ", ".join(sorted({"x".join(map(str, M.shape)) for M in cands.values()})) or "<none>"
+    raise ValueError(f"No {n_vertices}x{n_networks} (or transposed) matrix found. Candidates: {dims}")
+
+
+def read_pfn_mat(path: str, n_vertices: int = N_VERTICES, n_networks: int = N_NETWORKS) -> np.ndarray:
+    """Soft loadings (vertices, networks) as float32 from a MAT v5 (scipy) or v7.3/HDF5 (h5py) file."""
+    try:
+        from scipy.io import loadmat
+        data = loadmat(path)
+        cands = {k: np.asarray(v) for k, v in data.items()
+                 if not k.startswith("__") and isinstance(v, np.ndarray) and v.ndim == 2
+                 and np.issubdtype(v.dtype, np.number)}
+    except (NotImplementedError, ValueError):
+        import h5py  # MAT v7.3; MATLAB stores arrays transposed, which _pick_matrix handles
+        cands = {}
+        with h5py.File(path, "r") as f:
+            def visit(name, obj):
+                if isinstance(obj, h5py.Dataset) and obj.ndim == 2 and np.issubdtype(obj.dtype, np.number):
+                    cands[name.rsplit("/", 1)[-1]] = obj[()]
+            f.visititems(visit)
+    return np.asarray(_pick_matrix(cands, n_vertices, n_networks), dtype=np.float32)
+
+
+def hard_labels(M: np.ndarray) -> np.ndarray:
+    """Argmax network (1-based, uint8) per vertex of a (vertices, networks) matrix; 0 where no loading is finite and non-zero."""
+    A = np.where(np.isfinite(M), M, -np.inf)
+    labels = (np.argmax(A, axis=1) + 1).astype(np.uint8)  # first max wins, as max.col(ties="first")
+    labels[~(np.isfinite(M) & (M != 0)).any(axis=1)] = 0
+    return labels
+
+
+def keep_session(ses: str, pipeline: str, sessions: Optional[List[str]] = None) -> bool:
+    """--sessions filter: applies to new-pipeline sessions; old-pipeline ("baseline") entries are always kept."""
+    return not sessions or pipeline == "old" or ses in sessions
+
+
+def find_pfn_mats(root: Optional[Path], old_root: Optional[Path] = None,
+                  sessions: Optional[List[str]] = None) -> List[Tuple[str, str, str, str]]:
+    """
+    (sub, ses, pipeline, path) for FN.mat under sub-<ID>_ses-<LABEL> directories of root
+    (pipeline "new") and final_UV.mat under sub-<ID> directories of old_root (pipeline "old",
+    session "baseline"). sessions filters the former only (see keep_session).
+    """
+    records = []
+    for dirpath, dirnames, _ in (os.walk(root) if root is not None else ()):
+        m = SUB_SES_DIR_RE.search(os.path.basename(dirpath))
+        if not m:
+            continue
+        dirnames[:] = []  # FN.mat is searched below this directory only
+        sub, ses = m.groups()
+        if not keep_session(ses, "new", sessions):
+            continue
+        for f in sorted(Path(dirpath).rglob("FN.mat")):
+            records.append((sub, ses, "new", str(f)))
+    if old_root is not None:
+        for dirpath, dirnames, _ in os.walk(old_root):
+            m = SUB_DIR_RE.match(os.path.basename(dirpath))
+            if not m:
+                continue
+            dirnames[:] = []
+            for f in sorted(Path(dirpath).rglob("final_UV.mat")):
+                records.append((m.group(1), "baseline", "old", str(f)))
+    return sorted(records)
+
+
+# ---------- store ----------
+
+class PfnStore:
+    def __init__(self, path, mode: str = "r", dtype: str = "float16"):
+        """mode "r" reads an existing store; "a" also creates it if missing and allows add()."""
+        self.path = Path(path)
+        self.mode = mode
+        self.dtype = dtype
+        self.meta: Optional[dict] = None
+        self.index: Dict[Key, dict] = {}
+        self._next_row = 0    # first row no index line has used, superseded ones included
+        self._loadings = self._labels = None
+        meta_path = self.path / "store.json"
+        if meta_path.exists():
+            self.meta = json.loads(meta_path.read_text())
+            self.dtype = self.meta["dtype"]
+            self._read_index()
+        elif mode == "r":
+            raise FileNotFoundError(f"No PFN store at {self.path}")
+
+    @property
+    def networks(self) -> List[str]:
+        return list(self.meta["networks"]) if self.meta else []
+
+    @property
+    def n_vertices(self) -> int:
+        return int(self.meta["vertices"]) if self.meta else 0
+
+    def _read_index(self):
+        index_path = self.path / "subjects.tsv"
+        if not index_path.exists():
+            return
+        with open(index_path, newline="") as f:
+            for row in csv.DictReader(f, delimiter="\t"):
+                if row.get("mtime_ns") is None:  # line cut short by an interrupted writer
+                    continue
+                self.index[(row["sub"], row["ses"], row["pipeline"])] = row
+                self._next_row = max(self._next_row, int(row["row"]) + 1)
+
+    def arrays(self):
+        """(loadings, labels) memory-mapped over all rows; see row() for a subject's row."""
+        if self._loadings is None:
+            mmap_mode = "r+" if self.mode == "a" else "r"
+            self._loadings = np.load(self.path / "loadings.npy", mmap_mode=mmap_mode)
+            self._labels = np.load(self.path / "labels.npy", mmap_mode=mmap_mode)
+        return self._loadings, self._labels
+
+    # ---------- lookup ----------
+    def keys(self) -> List[Key]:
+        return sorted(self.index)
+
+    def row(self, sub: str, ses: Optional[str] = None, pipeline: Optional[str] = None) -> int:
+        """
+        Array row for a subject. ses/pipeline of None match anything; entries stored
+        without a session match any session. Raises KeyError unless exactly one entry matches.
+        """
+        hits = [k for k in self.index
+                if k[0] == sub and (pipeline is None or k[2] == pipeline)
+                and (ses is None or k[1] in (ses, ""))]
+        exact = [k for k in hits if ses is None or k[1] == ses]
+        hits = exact or hits
+        if len(hits) != 1:
+            raise KeyError(f"{len(hits)} store entries match sub={sub} ses={ses} pipeline={pipeline}")
+        return int(self.index[hits[0]]["row"])
+
+    def loadings(self, sub: str, ses: Optional[str] = None, pipeline: Optional[str] = None) -> np.ndarray:
+        return self.arrays()[0][self.row(sub, ses, pipeline)]
+
+    def labels(self, sub: str, ses: Optional[str] = None, pipeline: Optional[str] = None) -> np.ndarray:
+        return self.arrays()[1][self.row(sub, ses, pipeline)]
+
+    def is_current(self, key: Key, source: str, size: int, mtime_ns: int) -> bool:
+        row = self.index.get(key)
+        return (row is not None and row["source"] == source
+                and int(row["size"]) == size and int(row["mtime_ns"]) == mtime_ns)
+
+    # ---------- filling ----------
+    def _create(self, networks: List[str], n_vertices: int, capacity: int):
+        self.path.mkdir(parents=True, exist_ok=True)
+        np.lib.format.open_memmap(self.path / "loadings.npy", mode="w+", dtype=self.dtype,
+                                  shape=(capacity, len(networks), n_vertices))
+        np.lib.format.open_memmap(self.path / "labels.npy", mode="w+", dtype=np.uint8,
+                                  shape=(capacity, n_vertices))
+        self.meta = {"networks": list(networks), "vertices": int(n_vertices), "dtype": self.dtype,
+                     "capacity": int(capacity)}
+        self._write_meta()
+        with open(self.path / "subjects.tsv", "w", newline="") as f:
+            csv.writer(f, delimiter="\t", lineterminator="\n").writerow(INDEX_FIELDS)
+
+    def _write_meta(self):
+        tmp = self.path / ".store.json.tmp"
+        tmp.write_text(json.dumps(self.meta, indent=2))
+        os.replace(tmp, self.path / "store.json")
+
+    def _grow(self, capacity: int):
+        """Copy both arrays into files with the new capacity (temp file + rename)."""
+        self.flush()
+        for name in ("loadings.npy", "labels.npy"):
+            old = np.load(self.path / name, mmap_mode="r")
+            tmp = self.path / f".{name}.tmp"
+            new = np.lib.format.open_memmap(tmp, mode="w+", dtype=old.dtype, shape=(capacity,) + old.shape[1:])
+            new[:old.shape[0]] = old
+            new.flush()
+            del new
+            os.replace(tmp, self.path / name)
+        self._loadings = self._labels = None
+        self.meta["capacity"] = int(capacity)
+        self._write_meta()
+
+    def add(self, sub: str, ses: str, W: np.ndarray, networks: List[str], pipeline: str = "",
+            source: str = "", size: int = 0, mtime_ns: int = 0, capacity: int = 1024) -> int:
+        """
+        Write one subject's (networks, vertices) loadings and hard parcels; returns its row.
+        Always a fresh row: an existing entry keeps its data until the new index line
+        replaces it, so an interrupted re-add leaves the old entry intact.
+        """
+        if self.mode != "a":
+            raise ValueError("PfnStore opened read-only; use mode=\"a\" to add entries")
+        W = np.asarray(W)
+        if self.meta is None:
+            self._create(networks, W.shape[1], capacity)
+        if list(networks) != self.networks or W.shape != (len(self.networks), self.n_vertices):
+            raise ValueError(f"sub-{sub} ses-{ses}: {W.shape[0]}x{W.shape[1]} loadings ({', '.join(networks)}) "
+                             f"do not match the store ({len(self.networks)}x{self.n_vertices}: "
+                             f"{', '.join(self.networks)})")
+        key = (sub, ses, pipeline)
+        row = self._next_row
+        if row >= self.meta["capacity"]:
+            self._grow(2 * self.meta["capacity"])
+        loadings, labels = self.arrays()
+        loadings[row] = W.astype(loadings.dtype)
+        labels[row] = hard_labels(W.T)
+        loadings.flush()
+        labels.flush()
+        entry = {"row": row, "sub": sub, "ses": ses, "pipeline": pipeline, "source": source,
+                 "size": size, "mtime_ns": mtime_ns}
+        with open(self.path / "subjects.tsv", "a", newline="") as f:
+            csv.writer(f, delimiter="\t", lineterminator="\n").writerow([entry[k] for k in INDEX_FIELDS])
+        self.index[key] = {k: str(v) for k, v in entry.items()}
+        self._next_row = row + 1
+        return row
+
+    def flush(self):
+        for a in (self._loadings, self._labels):
+            if a is not None and self.mode == "a":
+                a.flush()
+
+
+# ---------- CLI ----------
+
+def _source_stat(paths: List[Path]) -> Tuple[int, int]:
+    st = [os.stat(p) for p in paths]
+    return sum(s.st_size for s in st), max((s.st_mtime_ns for s in st), default=0)
+
+
+def _read_job(job) -> Tuple[Optional[np.ndarray], Optional[str]]:
+    """((networks, vertices) loadings, None), or (None, error) if the input cannot be read."""
+    kind, paths, n_vertices, n_networks = job
+    try:
+        if kind == "mat":
+            return read_pfn_mat(str(paths[0]), n_vertices, n_networks).T, None
+        return read_network_dscalars(paths), None
+    except Exception as e:
+        return None, str(e)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Build or incrementally update a cohort PFN loading store.")
+    ap.add_argument("--store", required=True, help="Store directory (created if missing).")
+    ap.add_argument("--mat-root", default=None,
+                    help="pNet Personalized_FN directory with sub-<ID>_ses-<LABEL>/**/FN.mat (pipeline 'new').")
+    ap.add_argument("--old-root", default=None,
+                    help="Old-pipeline directory with sub-<ID>/**/final_UV.mat (pipeline 'old', session 'baseline').")
+    ap.add_argument("--sessions", nargs="*", default=None, help="Keep only these sessions from --mat-root.")
+    ap.add_argument("--dscalar-root", default=None,
+                    help="Directory with sub-<ID>/*.dscalar.nii, one normalized loading map per network.")
+    ap.add_argument("--dscalar-glob", default="*.dscalar.nii", help="Network maps within each sub-<ID> directory.")
+    ap.add_argument("--ses", default="", help="Session recorded for --dscalar-root entries (default: none, matches any).")
+    ap.add_argument("--dtype", choices=["float16", "float32"], default="float16",
+                    help="Loading precision for a new store (default: %(default)s).")
+    ap.add_argument("--vertices", type=int, default=N_VERTICES, help="Vertices per FN.mat (default: %(default)s).")
+    ap.add_argument("--networks", type=int, default=N_NETWORKS, help="Networks per FN.mat (default: %(default)s).")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Reader processes (default: %(default)s).")
+    ap.add_argument("--force", action="store_true", help="Re-read inputs even if unchanged.")
+    args = ap.parse_args(argv)
+
+    store = PfnStore(args.store, mode="a", dtype=args.dtype)
+    # (key, source, files, networks, read job)
+    todo = []
+    if args.mat_root or args.old_root:
+        nets = [f"PFN{k + 1}" for k in range(args.networks)]
+        for sub, ses, pipeline, path in find_pfn_mats(Path(args.mat_root) if args.mat_root else None,
+                                                      Path(args.old_root) if args.old_root else None,
+                                                      args.sessions):
+            todo.append(((sub, ses, pipeline), path, [Path(path)], nets,
+                         ("mat", [Path(path)], args.vertices, args.networks)))
+    if args.dscalar_root:
+        for d in sorted(Path(args.dscalar_root).glob("sub-*")):
+            m = SUB_DIR_RE.match(d.name)
+            files = sorted(d.glob(args.dscalar_glob)) if m and d.is_dir() else []
+            if files:
+                nets = [f.name.replace(".dscalar.nii", "") for f in files]
+                todo.append(((m.group(1), args.ses, ""), str(d), files, nets, ("dscalar", files, 0, 0)))
+
+    jobs = []
+    for key, source, files, nets, job in todo:
+        size, mtime = _source_stat(files)
+        if not args.force and store.is_current(key, source, size, mtime):
+            continue
+        jobs.append((key, source, size, mtime, nets, job))
+    print(f"[INFO] {len(todo)} inputs, {len(todo) - len(jobs)} up-to-date, {len(jobs)} to read")
+
+    n_ok = 0
+    with ProcessPoolExecutor(max_workers=max(1, args.workers)) as ex:
+        # map yields in order and drops each W once it is in the store, so memory stays bounded
+        results = ex.map(_read_job, [j[-1] for j in jobs], chunksize=4)
+        for (key, source, size, mtime, nets, _), (W, err) in zip(jobs, results):
+            if err is not None:
+                print(f"[WARN] {source}: {err}")
+                continue
+            try:
+                store.add(key[0], key[1], W, nets, pipeline=key[2], source=source, size=size, mtime_ns=mtime)
+                n_ok += 1
+            except Exception as e:
+                print(f"[WARN] {source}: {e}")
+    store.flush()
+    print(f"[OK] {args.store}: {n_ok} entries written, {len(store.index)} in store")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+reduced_precision.py
+
+Write CIFTI dtseries as int16 instead of float32, halving their size and read time,
+and read them back.
+
+Precisions:
+  float32             unchanged (no rewrite)
+  int16               one scale/offset for the file, stored as the standard NIfTI
+                      scl_slope/scl_inter, so wb_command, nibabel and pNet decode it
+                      transparently
+  int16-grayordinate  one scale/offset per grayordinate, stored base64-encoded
+                      (float32, little-endian) in the CIFTI matrix metadata under
+                      QuantScale/QuantOffset; much smaller error when grayordinates
+                      differ in range, but readers must use load_dtseries()
+
+NIfTI-2 has no float16 datatype, so half-precision floats are not an option for
+CIFTI files; int16 gives the same storage.
+
+write_reduced() returns the largest absolute difference between the decoded output
+and the float32 input, for the caller to record. Input and output are both handled
+in blocks of grayordinates (contiguous on disk), so a multi-GB dtseries is never
+held in memory.
+"""
+
+import base64
+import os
+import struct
+from pathlib import Path
+from typing import Tuple
+
+import numpy as np
+
+PRECISIONS = ("float32", "int16", "int16-grayordinate")
+META_PRECISION = "ReducedPrecision"
+META_SCALE = "QuantScale"
+META_OFFSET = "QuantOffset"
+Q_MAX = 32767
+CHUNK_COLUMNS = 4096
+SCL_OFFSET = 176    # scl_slope, scl_inter (float64) in the NIfTI-2 header
+
+
+def _encode(a: np.ndarray) -> str:
+    return base64.b64encode(np.ascontiguousarray(a, dtype="<f4").tobytes()).decode("ascii")
+
+
+def _decode(s: str) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(s), dtype="<f4").astype(np.float32)
+
+
+def _column_range(data, chunk_columns: int) -> Tuple[np.ndarray, np.ndarray]:
+    lo = np.empty(data.shape[1])
+    hi = np.empty(data.shape[1])
+    for a in range(0, data.shape[1], chunk_columns):
+        block = np.asarray(data[:, a:a + chunk_columns], dtype=np.float64)
+        lo[a:a + chunk_columns] = block.min(axis=0)
+        hi[a:a + chunk_columns] = block.max(axis=0)
+    return lo, hi
+
+
+def _scaling(lo: np.ndarray, hi: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    offset = (hi + lo) / 2
+    scale = (hi - lo) / (2 * Q_MAX)
+    scale[~(scale > 0)] = 1.0
+    return scale, offset
+
+
+def column_scaling(data, chunk_columns: int = CHUNK_COLUMNS) -> Tuple[np.ndarray, np.ndarray]:
+    """Per-column (scale, offset) mapping [min, max] onto [-Q_MAX, Q_MAX]; constant columns get scale 1."""
+    scale, offset = _scaling(*_column_range(data, chunk_columns))
+    return scale.astype(np.float32), offset.astype(np.float32)
+
+
+def _tmp_path(out: Path) -> Path:
+    return out.with_name(f".tmp{os.getpid()}_{out.name}")    # keeps the extension nibabel dispatches on
+
+
+def write_reduced(src, out, precision: str, chunk_columns: int = CHUNK_COLUMNS) -> float:
+    """
+    Rewrite the dtseries src at the given precision into out (temp file + rename; out may
+    equal src) and return the max absolute quantization error.
+    """
+    import nibabel as nib
+    from nibabel import cifti2 as ci
+    from cifti_io import CiftiFile
+
+    if precision not in PRECISIONS[1:]:
+        raise ValueError(f"Unknown precision {precision!r}; choose from {', '.join(PRECISIONS[1:])}")
+    src, out = Path(src), Path(out)
+    data = CiftiFile(src).data
+    lo, hi = _column_range(data, chunk_columns)
+    if precision == "int16":
+        # One scl_slope/scl_inter for the file; readers decode in float64
+        slope, inter = _scaling(lo.min(initial=0.0, keepdims=True), hi.max(initial=0.0, keepdims=True))
+        scale, offset = np.full(data.shape[1], slope[0]), np.full(data.shape[1], inter[0])
+        meta = {META_PRECISION: precision}
+    else:
+        scale, offset = _scaling(lo, hi)
+        scale, offset = scale.astype(np.float32), offset.astype(np.float32)
+        meta = {META_PRECISION: precision, META_SCALE: _encode(scale), META_OFFSET: _encode(offset)}
+    header = nib.load(str(src)).header
+    header.matrix.metadata = ci.Cifti2MetaData(dict(header.matrix.metadata or {}, **meta))
+    tmp = _tmp_path(out)
+    try:
+        # nibabel writes the header and a zero data block (from a broadcast view, no
+        # allocation); the quantized blocks are then written in place
+        nib.save(ci.Cifti2Image(np.broadcast_to(np.int16(0), data.shape), header=header), str(tmp))
+        written = CiftiFile(tmp)
+        if precision == "int16":
+            with open(tmp, "r+b") as f:
+                f.seek(SCL_OFFSET)
+                f.write(struct.pack(written.endian + "2d", slope[0], inter[0]))
+        q = np.memmap(tmp, dtype=written.dtype, mode="r+", offset=written.vox_offset,
+                      shape=data.shape, order="F")
+        err = 0.0
+        for a in range(0, data.shape[1], chunk_columns):
+            cols = slice(a, a + chunk_columns)
+            ref = np.asarray(data[:, cols], dtype=scale.dtype)
+            block = np.clip(np.rint((ref - offset[cols]) / scale[cols]), -Q_MAX, Q_MAX)
+            q[:, cols] = block
+            decoded = block.astype(scale.dtype) * scale[cols] + offset[cols]    # what the readers compute
+            err = max(err, float(np.abs(decoded.astype(np.float64) - ref).max(initial=0.0)))
+        q.flush()
+        del q
+        os.replace(tmp, out)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+    return err
+
+
+def load_dtseries(path) -> np.ndarray:
+    """(time, grayordinate) float32 data of a dtseries at any of PRECISIONS."""
+    from cifti_io import CiftiFile
+
+    img = CiftiFile(path)
+    meta = img.metadata
+    if meta.get(META_PRECISION) == "int16-grayordinate":
+        q = np.asarray(img.data.raw)
+        return q.astype(np.float32) * _decode(meta[META_SCALE]) + _decode(meta[META_OFFSET])
+    return np.asarray(img.data, dtype=np.float32)